@@ -1,50 +1,146 @@
+import asyncio
 import logging
+import aiohttp
 import requests
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-from googleapiclient.http import MediaIoBaseUpload
-import io
-import string
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import openai
-import base64
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import time
+import hashlib
 import json
-from PIL import Image
+import re
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from googleapiclient.errors import HttpError
 from requests.adapters import HTTPAdapter
+from GenerationCache import GenerationCache
+from ImageCache import ThumbnailCache, encode_thumbnail, thumbnail_digest
+from LogConfig import mask_secret, setup_logging, summarize
+from Metrics import Metrics
+from SheetClient import SCOPES, build_sheets_service, load_credentials
+from SheetRange import column_letter
+from SheetTable import SheetTable
 
 # ログの設定
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 
 # 定数の設定
-SERVICE_ACCOUNT_FILE = r'C:\Users\kanchi\Desktop\プログラミング\MMスクール\出品算出シート001\mmschool-unlimi-001-dc6603fc2808.json'
-SPREADSHEET_ID = '1oNSqWAQZd-Tqg5QUsY-M-hjx1Pf9WdFgGxPIipW0sEE'
-MAX_RETRIES = 10
+SERVICE_ACCOUNT_FILE = os.environ.get('MM_SERVICE_ACCOUNT_FILE', r'C:\Users\kanchi\Desktop\プログラミング\MMスクール\出品算出シート001\mmschool-unlimi-001-dc6603fc2808.json')
+SPREADSHEET_ID = os.environ.get('MM_SPREADSHEET_ID', '1oNSqWAQZd-Tqg5QUsY-M-hjx1Pf9WdFgGxPIipW0sEE')
 BATCH_SIZE = 20
+OPENAI_API_BASE = os.environ.get('OPENAI_API_BASE', 'https://api.openai.com/v1')
+OPENAI_CHAT_ENDPOINT = f"{OPENAI_API_BASE}/chat/completions"
+# 'thread': ThreadPoolExecutor + requests / 'async': asyncio + aiohttp
+# 'packed': asyncio + aiohttp で複数の商品を1回のリクエストにまとめる
+# 'batch': OpenAI Batch API でまとめて送信し、次回以降の実行で結果を書き込む
+GENERATION_MODE = 'async'
+PACK_SIZE = 10  # packed モードで1回のリクエストにまとめる商品数の上限
+PACK_TOKEN_BUDGET = 30000  # packed モードの1回のリクエストの入力トークン数の上限 (概算)
+PACK_OUTPUT_TOKENS_PER_LISTING = 1200
+PACK_MAX_OUTPUT_TOKENS = 16000
+MAX_CONCURRENCY = 20  # async モードで同時に送信する OpenAI リクエスト数
+OPENAI_TIMEOUT = 300  # 秒
+USE_GENERATION_CACHE = True  # 入力が前回と同じ行は OpenAI に送らずキャッシュを使う
+USE_IMAGE_CACHE = True  # 縮小済みの画像をディスクに保存して再利用する
+IMAGE_POOL_SIZE = 20  # 画像取得用の接続プールのサイズ
+IMAGE_TIMEOUT = 30  # 秒
+IMAGE_MEMO_MAX_ENTRIES = 1000  # 1回の実行の中で同じ画像を再取得しないように覚えておく件数
+USE_PROCESS_POOL = True  # 画像の縮小をプロセスプールで実行する (GIL の影響を受けない)
+IMAGE_PROCESS_WORKERS = os.cpu_count() or 1
+# ストリーミングモード: AI-memo をページ単位で読み、完了した行から順に書き込む
+STREAMING = False
+STREAM_PAGE_SIZE = 200  # 1回に読む行数
+STREAM_WINDOW = 100  # 同時に処理中にする行数の上限
+STREAM_FLUSH_ROWS = 100  # この行数が完了したら書き込む
+STREAM_FLUSH_INTERVAL = 30  # 秒。この間隔でも書き込む
+# batch モード
+BATCH_WAIT = False  # True の場合はバッチが完了するまで待つ
+BATCH_POLL_INTERVAL = 60  # 秒
+BATCH_STATE_DIR = os.environ.get(
+    'MM_BATCH_STATE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'mm-school', 'batches'))
+# AI-memo の1行目のヘッダー名 (列は SheetTable のヘッダーから引く)
+# 読み込む列: 日本語タイトル・日本語説明・SKU・画像-01 (A〜D列)、書き込む列: New-Titel・New-Discription (AB・AC列)
+# New-Discription より右の列が商品情報 (ItemSpecifics) のヘッダー
+TITLE_COL, DESCRIPTION_COL, SKU_COL, IMAGE_COL = '日本語タイトル', '日本語説明', 'SKU', '画像-01'
+NEW_TITLE_COL, NEW_DESCRIPTION_COL = 'New-Titel', 'New-Discription'
+MEMO_COLUMNS = (TITLE_COL, DESCRIPTION_COL, SKU_COL, IMAGE_COL, NEW_TITLE_COL, NEW_DESCRIPTION_COL)
+PROGRESS_DIR = os.environ.get(
+    'MM_PROGRESS_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'mm-school', 'progress'))
+RATE_LIMIT_DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+RATE_LIMIT_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+# 商品タイトル・説明の作成ルール (1件ずつ送る場合とまとめて送る場合で共通)
+PRODUCT_INFO_RULES = (
+    "**作成するタイトルは英語で可能な限り80文字に近い文字数で作成してください。半角スペースは1文字でカウントします。できるだけ80字に近くなるように作成してください。**\n"
+    "**※作成するタイトルは最大80文字とし、できるだけ文字数を活用してください。**\n"
+    "**作成するタイトルをカウントして70文字以下のようなに明らかに少なければ再度作成してください。**\n"
+    "**作成する商品説明は送料関する項目や発送方法などの余分な説明は省いてください。**\n"
+    "**省く文言例：発送に関しての説明、梱包に関しての説明、購入する際の注意点など**\n"
+    "**残す文言例：商品のサイズ、商品に関する傷や汚れなどの注意事項**\n"
+    "**商品情報に記載するサイズがセンチメートルの場合はインチに変換して記載してください。**\n"
+    "**情報が不明な場合は「N/A」と記載してください。**\n"
+)
 
 class GoogleSheetService:
-    def __init__(self, service_account_file, spreadsheet_id):
-        self.scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        self.credentials = service_account.Credentials.from_service_account_file(
-            service_account_file, scopes=self.scopes)
-        self.service = build('sheets', 'v4', credentials=self.credentials)
+    def __init__(self, service_account_file, spreadsheet_id, credentials=None, scheduler=None):
+        # 複数のスプレッドシートを処理する場合は読み込み済みの credentials とスケジューラーを渡す
+        self.scopes = SCOPES
+        self.credentials = credentials or load_credentials(service_account_file, self.scopes)
+        self.service = build_sheets_service(self.credentials, scheduler)
         self.spreadsheet_id = spreadsheet_id
         logging.debug(f"Initialized GoogleSheetService with spreadsheet ID: {spreadsheet_id}")
 
     def get_values(self, range_name):
         try:
-            logging.debug(f"Fetching values from range: {range_name}")
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.spreadsheet_id, range=range_name).execute()
-            values = result.get('values', [])
-            logging.debug(f"Fetched values: {values}")
-            return values
+            return self.fetch_values(range_name)
         except Exception as e:
             logging.error(f"Error fetching values from range {range_name}: {e}")
             return []
 
+    def fetch_values(self, range_name):
+        """get_values と同じですが、失敗した場合は [] を返さずに例外を送出します (空の範囲と区別するため)。"""
+        logging.debug("Fetching values from range: %s", range_name)
+        with Metrics.stage('read'):
+            result = self.service.spreadsheets().values().get(
+                spreadsheetId=self.spreadsheet_id, range=range_name).execute()
+        values = result.get('values', [])
+        logging.debug("Fetched %s from %s", summarize(values), range_name)
+        return values
+
+    def get_row_count(self, sheet_name):
+        """シートの行数 (gridProperties.rowCount) を返します。取得できない場合は None を返します。"""
+        try:
+            result = self.service.spreadsheets().get(
+                spreadsheetId=self.spreadsheet_id,
+                fields='sheets.properties(title,gridProperties.rowCount)').execute()
+        except Exception as e:
+            logging.error(f"Error fetching the row count of {sheet_name}: {e}")
+            return None
+        for sheet in result.get('sheets', []):
+            properties = sheet.get('properties', {})
+            if properties.get('title') == sheet_name:
+                return properties.get('gridProperties', {}).get('rowCount')
+        logging.error(f"Sheet name {sheet_name} not found.")
+        return None
+
+    def batch_get_values(self, ranges, major_dimension='ROWS'):
+        """複数の範囲を1回の values.batchGet で取得し、範囲名をキーにした辞書で返します。"""
+        try:
+            logging.debug("Fetching values from %d ranges: %s", len(ranges), summarize(ranges))
+            with Metrics.stage('read'):
+                result = self.service.spreadsheets().values().batchGet(
+                    spreadsheetId=self.spreadsheet_id, ranges=ranges,
+                    majorDimension=major_dimension,
+                    fields='valueRanges(range,values)').execute()
+            value_ranges = result.get('valueRanges', [])
+            # レスポンスはリクエストした順番で返るため、リクエスト時の範囲名をキーにする
+            snapshot = {range_name: value_range.get('values', [])
+                        for range_name, value_range in zip(ranges, value_ranges)}
+            logging.debug("Fetched %d ranges", len(snapshot))
+            return snapshot
+        except Exception as e:
+            logging.error(f"Error fetching values from ranges {ranges}: {e}")
+            return {range_name: [] for range_name in ranges}
+
     def update_values(self, range_name, values):
         try:
             body = {
@@ -53,7 +149,7 @@ class GoogleSheetService:
             result = self.service.spreadsheets().values().update(
                 spreadsheetId=self.spreadsheet_id, range=range_name,
                 valueInputOption='RAW', body=body).execute()
-            logging.debug(f"Updated range {range_name} with values: {values}")
+            logging.debug("Updated range %s with %s", range_name, summarize(values))
             return result
         except Exception as e:
             logging.error(f"Error updating values in range {range_name}: {e}")
@@ -67,16 +163,122 @@ class GoogleSheetService:
             }
             result = self.service.spreadsheets().values().batchUpdate(
                 spreadsheetId=self.spreadsheet_id, body=body).execute()
-            logging.debug(f"Batch update result: {result}")
+            logging.debug("Batch update result: %s", summarize(result))
         except Exception as e:
             logging.error(f"Error during batch update: {e}")
 
+class OpenAIKeyPool:
+    """Setting!F列の API キーごとに残りのリクエスト数・トークン数を管理します。
+
+    残量は x-ratelimit-* ヘッダーから学習し、呼び出しごとに最も余裕のある
+    キーを選びます。429 を受けたキーは Retry-After (なければ指数バックオフ)
+    の間だけ休ませ、その間は他のキーを使います。
+    複数のスプレッドシートで同じキーを使う場合は、states と lock を共有すると
+    キーごとの残量と休止が全てのスプレッドシートで共通になります。
+    """
+
+    def __init__(self, api_keys, states=None, lock=None):
+        self.api_keys = list(api_keys)
+        self.lock = lock or threading.Lock()
+        self.states = states if states is not None else {}
+        with self.lock:
+            for key in self.api_keys:
+                self.states.setdefault(key, {
+                    'remaining_requests': None,
+                    'remaining_tokens': None,
+                    'requests_reset_at': 0.0,
+                    'tokens_reset_at': 0.0,
+                    'cooldown_until': 0.0,
+                    'consecutive_429': 0,
+                    'in_flight': 0,
+                })
+
+    @staticmethod
+    def parse_duration(value):
+        """'1s', '6m0s', '20ms' 形式の時間を秒に変換します。"""
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        parts = RATE_LIMIT_DURATION_PATTERN.findall(value)
+        if not parts:
+            return None
+        return sum(float(amount) * RATE_LIMIT_DURATION_UNITS[unit] for amount, unit in parts)
+
+    def _headroom(self, state, now):
+        # リセット時刻を過ぎた (または未学習の) 残量は上限まで回復したとみなす
+        requests_left = state['remaining_requests'] if now < state['requests_reset_at'] else None
+        tokens_left = state['remaining_tokens'] if now < state['tokens_reset_at'] else None
+        requests_left = float('inf') if requests_left is None else requests_left
+        tokens_left = float('inf') if tokens_left is None else tokens_left
+        return requests_left - state['in_flight'], tokens_left
+
+    def _select(self, preferred):
+        now = time.monotonic()
+        available = [key for key in self.api_keys if self.states[key]['cooldown_until'] <= now]
+        if not available:
+            key = min(self.api_keys, key=lambda k: self.states[k]['cooldown_until'])
+            return None, self.states[key]['cooldown_until'] - now
+        key = max(available, key=lambda k: (*self._headroom(self.states[k], now), k == preferred))
+        self.states[key]['in_flight'] += 1
+        return key, 0
+
+    def acquire(self, preferred=None):
+        """使用するキーを返します。全てのキーが休止中の場合は最短の休止明けまで待ちます。"""
+        while True:
+            with self.lock:
+                key, wait_time = self._select(preferred)
+            if key is not None:
+                return key
+            time.sleep(wait_time)
+
+    async def acquire_async(self, preferred=None):
+        while True:
+            with self.lock:
+                key, wait_time = self._select(preferred)
+            if key is not None:
+                return key
+            await asyncio.sleep(wait_time)
+
+    def release(self, key, status=None, headers=None):
+        """レスポンスのステータスとヘッダーからキーの状態を更新します。"""
+        headers = headers or {}
+        now = time.monotonic()
+        with self.lock:
+            state = self.states[key]
+            state['in_flight'] = max(0, state['in_flight'] - 1)
+
+            for kind in ('requests', 'tokens'):
+                remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+                reset = self.parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+                if remaining is not None:
+                    try:
+                        state[f'remaining_{kind}'] = int(remaining)
+                    except ValueError:
+                        pass
+                    state[f'{kind}_reset_at'] = now + (reset if reset is not None else 60)
+
+            if status == 429:
+                state['consecutive_429'] += 1
+                wait_time = self.parse_duration(headers.get('retry-after'))
+                if wait_time is None:
+                    wait_time = self.parse_duration(headers.get('x-ratelimit-reset-requests'))
+                if wait_time is None:
+                    wait_time = min(10 * (2 ** (state['consecutive_429'] - 1)), 300)
+                state['cooldown_until'] = now + wait_time
+                logging.warning(f"API key ...{key[-4:]} throttled, cooling down for {wait_time} seconds")
+            elif status is not None and status < 400:
+                state['consecutive_429'] = 0
+
 class OpenAIService:
-    def __init__(self, api_keys):
+    def __init__(self, api_keys, key_pool=None, cache=None):
         self.api_keys = api_keys
+        self.key_pool = key_pool or OpenAIKeyPool(api_keys)
+        self.cache = cache
 
     def generate_summary(self, description, index):
-        endpoint = "https://api.openai.com/v1/chat/completions"
         messages = [
             {
                 "role": "user",
@@ -98,7 +300,7 @@ class OpenAIService:
         }
 
         try:
-            response = requests.post(endpoint, headers=headers, json=payload)
+            response = requests.post(OPENAI_CHAT_ENDPOINT, headers=headers, json=payload)
             response.raise_for_status()
             json_response = response.json()
             summary = json_response['choices'][0]['message']['content']
@@ -110,9 +312,8 @@ class OpenAIService:
             logging.error(f"Error generating summary: {e}")
             return "Error generating summary"
 
-    def send_to_openai(self, image_url, title, description, item_specifics_headers, index):
-        endpoint = "https://api.openai.com/v1/chat/completions"
-
+    @staticmethod
+    def build_product_info_payload(title, description, item_specifics_headers, base64_image=None):
         item_specifics_schema = {header: {"type": "string"} for header in item_specifics_headers}
 
         schema = {
@@ -135,28 +336,89 @@ class OpenAIService:
                            f"参考商品説明-{description}\n"
                            f"商品情報: {', '.join(item_specifics_headers)}\n"
                            f"出力形式はJSON形式で NewTitle, NewDescription, ItemSpecifics を含むようにしてください。\n"
-                           f"**作成するタイトルは英語で可能な限り80文字に近い文字数で作成してください。半角スペースは1文字でカウントします。できるだけ80字に近くなるように作成してください。**\n"
-                           f"**※作成するタイトルは最大80文字とし、できるだけ文字数を活用してください。**\n"
-                           f"**作成するタイトルをカウントして70文字以下のようなに明らかに少なければ再度作成してください。**\n"
-                           f"**作成する商品説明は送料関する項目や発送方法などの余分な説明は省いてください。**\n"
-                           f"**省く文言例：発送に関しての説明、梱包に関しての説明、購入する際の注意点など**\n"
-                           f"**残す文言例：商品のサイズ、商品に関する傷や汚れなどの注意事項**\n"
-                           f"**商品情報に記載するサイズがセンチメートルの場合はインチに変換して記載してください。**\n"
-                           f"**情報が不明な場合は「N/A」と記載してください。**\n"
+                           + PRODUCT_INFO_RULES
             }
         ]
-        if image_url:
-            base64_image = ImageService.encode_image_from_url(image_url)
+        if base64_image:
+            messages.append({
+                "role": "user",
+                "content": f"data:image/jpeg;base64,{base64_image}"
+            })
+
+        return {
+            "model": "gpt-4o-mini",
+            "messages": messages,
+            "max_tokens": 4000,
+            "temperature": 0.0,
+            "functions": [
+                {
+                    "name": "generate_product_info",
+                    "parameters": schema
+                }
+            ]
+        }
+
+    @staticmethod
+    def parse_product_info(json_response):
+        with Metrics.stage('parse'):
+            extracted_data = json_response['choices'][0]['message']['function_call']['arguments']
+            try:
+                extracted_json = json.loads(extracted_data)
+                new_title = extracted_json.get("NewTitle", "No Title Found")
+                new_description = extracted_json.get("NewDescription", "No Description Found")
+                item_specifics = extracted_json.get("ItemSpecifics", {})
+                return new_title, new_description, item_specifics
+            except json.JSONDecodeError as e:
+                logging.error(f"JSON decode error: {e}")
+                return "JSON Decode Error"
+
+    @staticmethod
+    def build_packed_payload(listings, item_specifics_headers):
+        """複数の商品 [(SKU, タイトル, 説明, base64画像)] を1回のリクエストにまとめた payload を作成します。"""
+        item_specifics_schema = {header: {"type": "string"} for header in item_specifics_headers}
+
+        schema = {
+            "type": "object",
+            "properties": {
+                "Listings": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "SKU": {"type": "string"},
+                            "NewTitle": {"type": "string"},
+                            "NewDescription": {"type": "string"},
+                            "ItemSpecifics": {
+                                "type": "object",
+                                "properties": item_specifics_schema
+                            }
+                        },
+                        "required": ["SKU", "NewTitle", "NewDescription", "ItemSpecifics"]
+                    }
+                }
+            }
+        }
+
+        content = (f"画像を見て、次の各商品の参考情報を元に商品タイトルと説明を英語で作成し、参考情報に基づいて商品情報を埋めてください。\n"
+                   f"商品情報: {', '.join(item_specifics_headers)}\n"
+                   f"出力形式はJSON形式で Listings の配列とし、各商品ごとに SKU, NewTitle, NewDescription, ItemSpecifics を含むようにしてください。\n"
+                   f"**SKU は参考情報の SKU をそのまま記載してください。全ての商品を出力してください。**\n"
+                   + PRODUCT_INFO_RULES)
+        for sku, title, description, _ in listings:
+            content += f"\nSKU-{sku}\n参考商品タイトル-{title}\n参考商品説明-{description}\n"
+
+        messages = [{"role": "user", "content": content}]
+        for sku, _, _, base64_image in listings:
             if base64_image:
                 messages.append({
                     "role": "user",
-                    "content": f"data:image/jpeg;base64,{base64_image}"
+                    "content": f"SKU-{sku}の画像: data:image/jpeg;base64,{base64_image}"
                 })
 
-        payload = {
+        return {
             "model": "gpt-4o-mini",
             "messages": messages,
-            "max_tokens": 4000,
+            "max_tokens": min(PACK_MAX_OUTPUT_TOKENS, PACK_OUTPUT_TOKENS_PER_LISTING * len(listings)),
             "temperature": 0.0,
             "functions": [
                 {
@@ -166,127 +428,958 @@ class OpenAIService:
             ]
         }
 
-        headers = {
-            'Authorization': f'Bearer {self.api_keys[index % len(self.api_keys)]}',
-            'Content-Type': 'application/json'
-        }
+    @staticmethod
+    def parse_packed_product_info(json_response, skus):
+        """まとめて生成した結果を {SKU: (タイトル, 説明, 商品情報)} で返します。形式が不正な商品は含みません。"""
+        with Metrics.stage('parse'):
+            try:
+                extracted_data = json_response['choices'][0]['message']['function_call']['arguments']
+                listings = json.loads(extracted_data).get("Listings", [])
+            except (KeyError, IndexError, TypeError, AttributeError, json.JSONDecodeError) as e:
+                logging.error(f"Malformed packed response: {e}")
+                return {}
+
+            results = {}
+            for listing in listings if isinstance(listings, list) else []:
+                if not isinstance(listing, dict):
+                    continue
+                sku = str(listing.get("SKU", ""))
+                new_title = listing.get("NewTitle")
+                new_description = listing.get("NewDescription")
+                item_specifics = listing.get("ItemSpecifics", {})
+                if sku not in skus or sku in results or not isinstance(new_title, str) \
+                        or not isinstance(new_description, str) or not isinstance(item_specifics, dict):
+                    continue
+                results[sku] = (new_title, new_description, item_specifics)
+            return results
+
+    @staticmethod
+    def record_usage(api_key, json_response):
+        """レスポンスの usage からキーごとの使用トークン数を数えます。"""
+        usage = json_response.get('usage') if isinstance(json_response, dict) else None
+        if not usage:
+            return
+        key = mask_secret(api_key)
+        Metrics.count('openai_tokens', usage.get('prompt_tokens', 0), key=key, type='prompt')
+        Metrics.count('openai_tokens', usage.get('completion_tokens', 0), key=key, type='completion')
+
+    @staticmethod
+    def estimate_tokens(text):
+        """トークン数の概算です。ASCII は約4文字、日本語などは約1文字で1トークンとして数えます。"""
+        ascii_chars = sum(1 for char in text if ord(char) < 128)
+        return ascii_chars // 4 + (len(text) - ascii_chars) + 1
 
-        retry_attempts = 5
+    @staticmethod
+    def lookup_cache(cache, image_url, title, description, item_specifics_headers, base64_image=None):
+        """(キャッシュキー, キャッシュされた結果) を返します。キャッシュを使わない場合は (None, None) です。
+
+        キーには画像の内容も含めるため、base64_image には取得済みの画像を渡します。
+        """
+        if cache is None:
+            return None, None
+        cache_key = GenerationCache.make_key(
+            OpenAIService.build_product_info_payload(title, description, item_specifics_headers), image_url,
+            thumbnail_digest(base64_image))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logging.info('Cache hit for title: %s', title)
+        return cache_key, cached
+
+    @staticmethod
+    def store_cache(cache, cache_key, result):
+        # エラー時の文字列は保存せず、正常に生成できた結果だけを保存する
+        if cache is not None and cache_key is not None and isinstance(result, tuple):
+            cache.put(cache_key, result)
+        return result
+
+    def send_to_openai(self, image_url, title, description, item_specifics_headers, index):
+        # 画像はサムネイルのキャッシュから取得できるため、生成結果のキャッシュを確認する前に取得する
+        base64_image = ImageService.encode_image_from_url(image_url) if image_url else None
+        cache_key, cached = self.lookup_cache(
+            self.cache, image_url, title, description, item_specifics_headers, base64_image)
+        if cached is not None:
+            return cached
+        result = self._send_to_openai(base64_image, title, description, item_specifics_headers, index)
+        return self.store_cache(self.cache, cache_key, result)
+
+    def _send_to_openai(self, base64_image, title, description, item_specifics_headers, index):
+        payload = self.build_product_info_payload(title, description, item_specifics_headers, base64_image)
+
+        json_response = self.post_chat_completion(payload, index)
+        if isinstance(json_response, str):
+            return json_response
+        logging.info('API response received for title: %s', title)
+        return self.parse_product_info(json_response)
+
+    def post_chat_completion(self, payload, index):
+        """payload を送信してレスポンスの JSON を返します。失敗した場合はエラーの文字列を返します。"""
+        retry_attempts = 5 + len(self.api_keys)
         for attempt in range(retry_attempts):
+            api_key = self.key_pool.acquire(preferred=self.api_keys[index % len(self.api_keys)])
+            headers = {
+                'Authorization': f'Bearer {api_key}',
+                'Content-Type': 'application/json'
+            }
+            response = None
             try:
-                logging.info(f'Using API Key: {self.api_keys[index % len(self.api_keys)]}')
-                response = requests.post(endpoint, headers=headers, json=payload)
+                logging.debug('Using API key %s', mask_secret(api_key))
+                with Metrics.stage('openai'):
+                    response = requests.post(OPENAI_CHAT_ENDPOINT, headers=headers, json=payload)
+                Metrics.count('openai_requests', key=mask_secret(api_key), status=response.status_code)
                 response.raise_for_status()
-
                 json_response = response.json()
-                extracted_data = json_response['choices'][0]['message']['function_call']['arguments']
-                logging.info(f'API response received for title: {title}')
-
-                try:
-                    extracted_json = json.loads(extracted_data)
-                    new_title = extracted_json.get("NewTitle", "No Title Found")
-                    new_description = extracted_json.get("NewDescription", "No Description Found")
-                    item_specifics = extracted_json.get("ItemSpecifics", {})
-                    return new_title, new_description, item_specifics
-                except json.JSONDecodeError as e:
-                    logging.error(f"JSON decode error: {e}")
-                    return "JSON Decode Error"
+                self.record_usage(api_key, json_response)
+                return json_response
 
             except requests.exceptions.HTTPError as e:
                 if response.status_code == 429:
-                    wait_time = 10 * (2 ** attempt)
-                    logging.warning(f"Rate limit reached, retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
+                    # 休止したキーは OpenAIKeyPool が避けるため、すぐに別のキーで再試行する
+                    Metrics.count('rate_limited', api='openai')
+                    Metrics.count('openai_retries')
+                    logging.warning("Rate limit reached, retrying with another key...")
                 else:
                     logging.error(f'Error during API request: {e}')
                     logging.error(f'Response content: {response.content.decode()}')
                     return "Request Error"
-            except requests.RequestException as e:
+            except (requests.RequestException, ValueError) as e:
+                if response is None:
+                    Metrics.count('openai_requests', key=mask_secret(api_key), status='error')
+                logging.error(f'Error during API request: {e}')
+                return "Request Error"
+            finally:
+                # キーの状態はレスポンスの有無にかかわらず1回だけ更新する
+                if response is not None:
+                    self.key_pool.release(api_key, response.status_code, response.headers)
+                else:
+                    self.key_pool.release(api_key)
+
+        logging.error("Max retry attempts reached.")
+        return "Max Retry Error"
+
+class AsyncOpenAIService:
+    """OpenAIService の asyncio 版です。
+
+    1つの aiohttp.ClientSession を共有し、同時に送信するリクエスト数を
+    max_concurrency で制限します。キーの休止明けを待つ間は枠を使わないため、
+    待機中のリクエストが他のリクエストを止めることはありません。
+    """
+
+    def __init__(self, api_keys, session, max_concurrency=MAX_CONCURRENCY, key_pool=None, cache=None):
+        self.api_keys = api_keys
+        self.key_pool = key_pool or OpenAIKeyPool(api_keys)
+        self.cache = cache
+        self.session = session
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.image_service = AsyncImageService(session)
+
+    async def send_to_openai(self, image_url, title, description, item_specifics_headers, index):
+        base64_image = await self.image_service.encode_image_from_url(image_url) if image_url else None
+        cache_key, cached = OpenAIService.lookup_cache(
+            self.cache, image_url, title, description, item_specifics_headers, base64_image)
+        if cached is not None:
+            return cached
+        result = await self._send_to_openai(base64_image, title, description, item_specifics_headers, index)
+        return OpenAIService.store_cache(self.cache, cache_key, result)
+
+    async def _send_to_openai(self, base64_image, title, description, item_specifics_headers, index):
+        payload = OpenAIService.build_product_info_payload(
+            title, description, item_specifics_headers, base64_image)
+
+        json_response = await self.post_chat_completion(payload, index)
+        if isinstance(json_response, str):
+            return json_response
+        logging.info('API response received for title: %s', title)
+        return OpenAIService.parse_product_info(json_response)
+
+    async def send_packed_to_openai(self, listings, item_specifics_headers, index):
+        """[(SKU, タイトル, 説明, base64画像)] を1回で送信し、{SKU: 結果} を返します。"""
+        payload = OpenAIService.build_packed_payload(listings, item_specifics_headers)
+        json_response = await self.post_chat_completion(payload, index)
+        if isinstance(json_response, str):
+            return {}
+        results = OpenAIService.parse_packed_product_info(json_response, {listing[0] for listing in listings})
+        logging.info(f'Packed API response received for {len(results)}/{len(listings)} listings')
+        return results
+
+    async def post_chat_completion(self, payload, index):
+        """payload を送信してレスポンスの JSON を返します。失敗した場合はエラーの文字列を返します。"""
+        retry_attempts = 5 + len(self.api_keys)
+        for attempt in range(retry_attempts):
+            # 全てのキーが休止中の場合はここで待機する (セマフォの枠は使わない)
+            api_key = await self.key_pool.acquire_async(preferred=self.api_keys[index % len(self.api_keys)])
+            headers = {
+                'Authorization': f'Bearer {api_key}',
+                'Content-Type': 'application/json'
+            }
+            status, response_headers = None, None
+            try:
+                async with self.semaphore:
+                    with Metrics.stage('openai'):
+                        async with self.session.post(OPENAI_CHAT_ENDPOINT, headers=headers, json=payload) as response:
+                            status, response_headers = response.status, response.headers
+                            Metrics.count('openai_requests', key=mask_secret(api_key), status=response.status)
+                            if response.status == 429:
+                                Metrics.count('rate_limited', api='openai')
+                                Metrics.count('openai_retries')
+                                logging.warning("Rate limit reached, retrying with another key...")
+                                continue
+                            if response.status >= 400:
+                                content = await response.text()
+                                logging.error(f'Error during API request: HTTP {response.status}')
+                                logging.error(f'Response content: {content}')
+                                return "Request Error"
+                            json_response = await response.json()
+                OpenAIService.record_usage(api_key, json_response)
+                return json_response
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                if status is None:
+                    Metrics.count('openai_requests', key=mask_secret(api_key), status='error')
                 logging.error(f'Error during API request: {e}')
                 return "Request Error"
+            finally:
+                # キーの状態はレスポンスの有無にかかわらず1回だけ更新する
+                self.key_pool.release(api_key, status, response_headers)
 
         logging.error("Max retry attempts reached.")
         return "Max Retry Error"
 
 class ImageService:
+    # 全スレッドで共有する接続プール・サムネイルキャッシュと、同じ実行内の結果
+    # 結果は IMAGE_MEMO_MAX_ENTRIES 件まで新しいものを残し、取得に失敗した画像は覚えない (次の呼び出しで再取得する)
+    session = None
+    cache = None
+    process_pool = None
+    lock = threading.Lock()
+    results = OrderedDict()
+    pending = {}
+
+    @classmethod
+    def get_session(cls):
+        with cls.lock:
+            if cls.session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=IMAGE_POOL_SIZE, pool_maxsize=IMAGE_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                cls.session = session
+            if cls.cache is None and USE_IMAGE_CACHE:
+                cls.cache = ThumbnailCache()
+        return cls.session
+
+    @classmethod
+    def get_process_pool(cls):
+        """画像の縮小に使うプロセスプールを返します。使わない設定の場合は None です。"""
+        if not USE_PROCESS_POOL:
+            return None
+        with cls.lock:
+            if cls.process_pool is None:
+                cls.process_pool = ProcessPoolExecutor(max_workers=IMAGE_PROCESS_WORKERS)
+        return cls.process_pool
+
+    @classmethod
+    def reset(cls):
+        """実行の終わりに、その実行で取得した結果を忘れます (取得中の画像はそのまま待てます)。"""
+        with cls.lock:
+            cls.results.clear()
+
+    @classmethod
+    def shutdown(cls):
+        with cls.lock:
+            cls.results.clear()
+            if cls.process_pool is not None:
+                cls.process_pool.shutdown()
+                cls.process_pool = None
+
     @staticmethod
-    def encode_image_from_url(url, max_size=(150, 150)):
+    def encode_image_bytes(content, max_size=(150, 150)):
+        return encode_thumbnail(content, max_size)
+
+    @classmethod
+    def encode_in_pool(cls, content, max_size=(150, 150)):
+        pool = cls.get_process_pool()
+        with Metrics.stage('image_encode'):
+            if pool is None:
+                return encode_thumbnail(content, max_size)
+            return pool.submit(encode_thumbnail, content, max_size).result()
+
+    @classmethod
+    def encode_image_from_url(cls, url, max_size=(150, 150)):
+        # 同じ URL は1回だけ取得し、他のスレッドはその結果を待つ
+        key = (url, tuple(max_size))
+        with cls.lock:
+            if key in cls.results:
+                cls.results.move_to_end(key)
+                return cls.results[key]
+            event = cls.pending.get(key)
+            owner = event is None
+            if owner:
+                event = cls.pending[key] = threading.Event()
+        if not owner:
+            event.wait()
+            with cls.lock:
+                result = cls.results.get(key)
+            # 先に取得したスレッドが失敗した場合は自分で取得し直す
+            return result if result is not None else cls._fetch_and_encode(url, max_size)
+
+        result = None
+        try:
+            result = cls._fetch_and_encode(url, max_size)
+        finally:
+            with cls.lock:
+                if result is not None:
+                    cls.results[key] = result
+                    while len(cls.results) > IMAGE_MEMO_MAX_ENTRIES:
+                        cls.results.popitem(last=False)
+                cls.pending.pop(key).set()
+        return result
+
+    @classmethod
+    def _fetch_and_encode(cls, url, max_size):
+        session = cls.get_session()
+        entry = cls.cache.load(url, max_size) if cls.cache else None
+        if entry and cls.cache.is_fresh(entry):
+            Metrics.count('image_requests', result='cache_hit')
+            return entry['thumbnail']
+
         try:
-            response = requests.get(url)
+            with Metrics.stage('image_fetch'):
+                response = session.get(url, headers=ThumbnailCache.conditional_headers(entry), timeout=IMAGE_TIMEOUT)
+            if response.status_code == 304 and entry:
+                Metrics.count('image_requests', result='not_modified')
+                cls.cache.mark_validated(url, max_size, entry)
+                return entry['thumbnail']
             response.raise_for_status()
+            Metrics.count('image_requests', result='fetched')
+            thumbnail = cls.encode_in_pool(response.content, max_size)
+        except requests.RequestException as e:
+            Metrics.count('image_requests', result='error')
+            logging.error(f'Error encoding image from URL: {e}')
+            return None
 
-            image = Image.open(io.BytesIO(response.content))
-            image.thumbnail(max_size)
+        if cls.cache:
+            cls.cache.store(url, max_size, thumbnail,
+                            response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return thumbnail
 
-            buffered = io.BytesIO()
-            image.save(buffered, format="JPEG", quality=85)
+class AsyncImageService:
+    def __init__(self, session, cache=None):
+        self.session = session
+        self.cache = cache if cache is not None else (ThumbnailCache() if USE_IMAGE_CACHE else None)
+        self.tasks = {}  # 同じ URL の取得は1つのタスクにまとめる
 
-            return base64.b64encode(buffered.getvalue()).decode('utf-8')
-        except requests.RequestException as e:
+    async def encode_image_from_url(self, url, max_size=(150, 150)):
+        key = (url, tuple(max_size))
+        task = self.tasks.get(key)
+        if task is None:
+            task = self.tasks[key] = asyncio.ensure_future(self._fetch_and_encode(url, max_size))
+            task.add_done_callback(lambda done: self._forget_failed(key, done))
+        return await asyncio.shield(task)
+
+    def _forget_failed(self, key, task):
+        # 失敗した画像は覚えず、次の呼び出しで再取得する
+        if task.cancelled() or task.exception() is not None or task.result() is None:
+            self.tasks.pop(key, None)
+
+    async def _fetch_and_encode(self, url, max_size):
+        entry = self.cache.load(url, max_size) if self.cache else None
+        if entry and self.cache.is_fresh(entry):
+            Metrics.count('image_requests', result='cache_hit')
+            return entry['thumbnail']
+
+        try:
+            with Metrics.stage('image_fetch'):
+                async with self.session.get(url, headers=ThumbnailCache.conditional_headers(entry)) as response:
+                    if response.status == 304 and entry:
+                        Metrics.count('image_requests', result='not_modified')
+                        self.cache.mark_validated(url, max_size, entry)
+                        return entry['thumbnail']
+                    response.raise_for_status()
+                    content = await response.read()
+                    etag = response.headers.get('ETag')
+                    last_modified = response.headers.get('Last-Modified')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            Metrics.count('image_requests', result='error')
             logging.error(f'Error encoding image from URL: {e}')
             return None
+        Metrics.count('image_requests', result='fetched')
+        # 画像の縮小は CPU 処理のためイベントループの外 (プロセスプール) で実行する
+        loop = asyncio.get_running_loop()
+        with Metrics.stage('image_encode'):
+            thumbnail = await loop.run_in_executor(ImageService.get_process_pool(), encode_thumbnail, content, max_size)
+        if self.cache:
+            self.cache.store(url, max_size, thumbnail, etag, last_modified)
+        return thumbnail
 
 class BatchUpdater:
     @staticmethod
-    def batch_update_values(sheet_service, data, max_retries=MAX_RETRIES, batch_size=BATCH_SIZE):
+    def batch_update_values(sheet_service, data, batch_size=BATCH_SIZE):
+        """BATCH_SIZE 範囲ずつ書き込みます。全て書き込めた場合は True を返します。
+
+        クォータの待ち合わせと 429 / 5xx の再試行は SheetQuota (execute()) で行います。
+        """
+        from googleapiclient.errors import HttpError
+
+        succeeded = True
         for i in range(0, len(data), batch_size):
             batch_data = data[i:i + batch_size]
-            for attempt in range(max_retries):
-                try:
-                    body = {
-                        'valueInputOption': 'RAW',
-                        'data': batch_data
-                    }
+            try:
+                body = {
+                    'valueInputOption': 'RAW',
+                    'data': batch_data
+                }
+                with Metrics.stage('write'):
                     result = sheet_service.service.spreadsheets().values().batchUpdate(
                         spreadsheetId=sheet_service.spreadsheet_id, body=body).execute()
-                    logging.debug(f"Batch update result: {result}")
-                    break
-                except HttpError as e:
-                    if e.resp.status in [403, 429]:
-                        wait_time = 60 ** attempt
-                        logging.warning(f"Rate limit reached, retrying in {wait_time} seconds...")
-                        time.sleep(wait_time)
-                    else:
-                        logging.error(f"Error during batch update: {e}")
-                        break
-                except Exception as e:
-                    logging.error(f"Unexpected error during batch update: {e}")
-                    break
-
-class Utils:
-    @staticmethod
-    def get_column_letter(index):
-        letters = ""
-        while index >= 0:
-            letters = string.ascii_uppercase[index % 26] + letters
-            index = index // 26 - 1
-        return letters
-
-def get_openai_api_keys(sheet_service):
+                logging.debug("Batch update result: %s", summarize(result))
+            except HttpError as e:
+                logging.error(f"Error during batch update: {e}")
+                succeeded = False
+            except Exception as e:
+                logging.error(f"Unexpected error during batch update: {e}")
+                succeeded = False
+        return succeeded
+
+def get_openai_api_keys(api_key_values):
     try:
-        api_key_values = sheet_service.get_values('Setting!F1:F')
         api_keys = [row[0] for row in api_key_values if row]
         if not api_keys:
             raise ValueError("No API keys found in the specified range.")
-        logging.debug(f"Fetched OpenAI API keys: {api_keys}")
+        logging.debug("Fetched %d OpenAI API keys", len(api_keys))
         return api_keys
     except Exception as e:
         logging.error(f"Error fetching OpenAI API keys: {e}")
         return []
 
+def generate_with_threads(openai_service, jobs, item_specifics_headers):
+    """ThreadPoolExecutor で各行を OpenAI に送信し、{行番号: 結果} を返します。"""
+    results = {}
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = {
+            executor.submit(
+                openai_service.send_to_openai,
+                image_url,
+                title,
+                description,
+                item_specifics_headers,
+                i
+            ): i for i, (image_url, title, description) in enumerate(jobs)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                results[i] = e
+    return results
+
+async def generate_with_asyncio(api_keys, jobs, item_specifics_headers, max_concurrency=MAX_CONCURRENCY,
+                                cache=None, key_pool=None):
+    """1つの aiohttp セッションで各行を OpenAI に送信し、{行番号: 結果} を返します。"""
+    connector = aiohttp.TCPConnector(limit=max_concurrency * 2)
+    timeout = aiohttp.ClientTimeout(total=OPENAI_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        openai_service = AsyncOpenAIService(api_keys, session, max_concurrency, key_pool=key_pool, cache=cache)
+        outputs = await asyncio.gather(*(
+            openai_service.send_to_openai(image_url, title, description, item_specifics_headers, i)
+            for i, (image_url, title, description) in enumerate(jobs)
+        ), return_exceptions=True)
+    return dict(enumerate(outputs))
+
+async def generate_packed(api_keys, jobs, skus, item_specifics_headers, max_concurrency=MAX_CONCURRENCY,
+                          cache=None, key_pool=None):
+    """複数の商品を1回のリクエストにまとめて生成し、{行番号: 結果} を返します。
+
+    1回のリクエストは PACK_SIZE 件かつ概算 PACK_TOKEN_BUDGET トークン以内にまとめ、
+    結果は SKU で行に対応付けます。SKU が空・重複している商品や、結果が欠けていたり
+    形式が不正だった商品は1件ずつのリクエストで生成し直します。
+    """
+    connector = aiohttp.TCPConnector(limit=max_concurrency * 2)
+    timeout = aiohttp.ClientTimeout(total=OPENAI_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        openai_service = AsyncOpenAIService(api_keys, session, max_concurrency, key_pool=key_pool, cache=cache)
+        results = {}
+        pending = []
+        single = []
+        seen_skus = set()
+        # キャッシュのキーとトークン数の見積もりに使うため、先に画像を取得する
+        # 壊れた画像などで縮小に失敗した行は、他の行を止めずにその行だけを失敗にする
+        images = await asyncio.gather(*(
+            openai_service.image_service.encode_image_from_url(image_url) if image_url else asyncio.sleep(0)
+            for image_url, _, _ in jobs
+        ), return_exceptions=True)
+        for i, ((image_url, title, description), base64_image) in enumerate(zip(jobs, images)):
+            if isinstance(base64_image, Exception):
+                logging.error(f"Error encoding image for row {i + 2}: {base64_image!r}")
+                results[i] = base64_image
+                continue
+            cache_key, cached = OpenAIService.lookup_cache(
+                cache, image_url, title, description, item_specifics_headers, base64_image)
+            if cached is not None:
+                results[i] = cached
+                continue
+            sku = skus[i] if i < len(skus) else ''
+            if not sku or sku in seen_skus:
+                single.append(i)
+                continue
+            seen_skus.add(sku)
+            pending.append((i, sku, image_url, title, description, cache_key, base64_image))
+
+        base_tokens = OpenAIService.estimate_tokens(
+            json.dumps(OpenAIService.build_packed_payload([], item_specifics_headers), ensure_ascii=False))
+        packs = []
+        current = []
+        current_tokens = base_tokens
+        for item in pending:
+            _, sku, _, title, description, _, base64_image = item
+            listing = (sku, title, description, base64_image)
+            cost = OpenAIService.estimate_tokens(f"SKU-{sku}\n参考商品タイトル-{title}\n参考商品説明-{description}\n")
+            cost += OpenAIService.estimate_tokens(base64_image) if base64_image else 0
+            if current and (len(current) >= PACK_SIZE or current_tokens + cost > PACK_TOKEN_BUDGET):
+                packs.append(current)
+                current = []
+                current_tokens = base_tokens
+            current.append((item, listing))
+            current_tokens += cost
+        if current:
+            packs.append(current)
+        logging.info(f"Packed {len(pending)} listings into {len(packs)} requests")
+
+        async def run_pack(pack_index, pack):
+            try:
+                packed = await openai_service.send_packed_to_openai(
+                    [listing for _, listing in pack], item_specifics_headers, pack_index)
+            except Exception as e:
+                logging.error(f"Error in packed request: {e}")
+                packed = {}
+            for (i, sku, _, _, _, cache_key, _), _ in pack:
+                if sku in packed:
+                    results[i] = OpenAIService.store_cache(cache, cache_key, packed[sku])
+                else:
+                    single.append(i)
+
+        await asyncio.gather(*(run_pack(pack_index, pack) for pack_index, pack in enumerate(packs)))
+
+        if single:
+            logging.info(f"Falling back to single requests for {len(single)} listings")
+        outputs = await asyncio.gather(*(
+            openai_service.send_to_openai(*jobs[i], item_specifics_headers, i) for i in single
+        ), return_exceptions=True)
+        results.update(zip(single, outputs))
+    return results
+
+class OpenAIBatchService:
+    """OpenAI Batch API (/v1/files, /v1/batches) でまとめて生成するためのクライアントです。
+
+    OPENAI_API_BASE を変更するとローカルの代替サーバー (benchmarks/fake_openai.py) に接続できます。
+    """
+
+    def __init__(self, api_key, session=None):
+        self.api_key = api_key
+        self.session = session or requests.Session()
+
+    def _headers(self):
+        return {'Authorization': f'Bearer {self.api_key}'}
+
+    def submit(self, jsonl_path, metadata=None):
+        """JSONL ファイルをアップロードしてバッチを作成し、バッチの情報を返します。"""
+        with open(jsonl_path, 'rb') as f:
+            response = self.session.post(
+                f'{OPENAI_API_BASE}/files', headers=self._headers(),
+                files={'file': (os.path.basename(jsonl_path), f, 'application/jsonl')},
+                data={'purpose': 'batch'}, timeout=OPENAI_TIMEOUT)
+        response.raise_for_status()
+        input_file_id = response.json()['id']
+
+        response = self.session.post(
+            f'{OPENAI_API_BASE}/batches', headers=self._headers(), json={
+                'input_file_id': input_file_id,
+                'endpoint': '/v1/chat/completions',
+                'completion_window': '24h',
+                'metadata': metadata or {},
+            }, timeout=OPENAI_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, batch_id):
+        response = self.session.get(f'{OPENAI_API_BASE}/batches/{batch_id}',
+                                    headers=self._headers(), timeout=OPENAI_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def iter_file_lines(self, file_id):
+        """結果ファイルを1行ずつ読み込み、JSON に変換して返します。"""
+        with self.session.get(f'{OPENAI_API_BASE}/files/{file_id}/content', headers=self._headers(),
+                              stream=True, timeout=OPENAI_TIMEOUT) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+def encode_image_or_error(image_url):
+    """画像を取得・縮小します。壊れた画像などで失敗した場合は例外を送出せずに返します。"""
+    try:
+        return ImageService.encode_image_from_url(image_url)
+    except Exception as e:
+        return e
+
+def submit_batch(batch_service, state_path, jobs, skus, memo_headers, cache=None, metadata=None):
+    """各行の payload を JSONL にまとめてバッチを作成し、状態をファイルに保存します。
+
+    memo_headers は AI-memo の1行目で、結果を書き込む列を決めるために状態にも保存します。
+    各リクエストには行番号と SKU を記録し、結果を書き込む時に行がずれていないかを確認します。
+    キャッシュにある行と画像を縮小できなかった行は送信せず、{行番号: 結果または例外} として返します。
+    """
+    unsent_results = {}
+    requests_by_id = {}
+    item_specifics_headers = get_item_specifics_headers(result_table(memo_headers))
+    image_urls = sorted({image_url for image_url, _, _ in jobs if image_url})
+    with ThreadPoolExecutor(max_workers=IMAGE_POOL_SIZE) as executor:
+        images = dict(zip(image_urls, executor.map(encode_image_or_error, image_urls)))
+
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    jsonl_path = state_path[:-len('.json')] + '.jsonl'
+    with open(jsonl_path, 'w', encoding='utf-8') as f:
+        for i, (image_url, title, description) in enumerate(jobs):
+            base64_image = images.get(image_url)
+            if isinstance(base64_image, Exception):
+                logging.error(f"Error encoding image for row {i + 2}: {base64_image!r}")
+                unsent_results[i] = base64_image
+                continue
+            cache_key, cached = OpenAIService.lookup_cache(
+                cache, image_url, title, description, item_specifics_headers, base64_image)
+            if cached is not None:
+                unsent_results[i] = cached
+                continue
+            custom_id = f'row-{i + 2}'
+            payload = OpenAIService.build_product_info_payload(
+                title, description, item_specifics_headers, base64_image)
+            f.write(json.dumps({'custom_id': custom_id, 'method': 'POST',
+                                'url': '/v1/chat/completions', 'body': payload}, ensure_ascii=False) + '\n')
+            requests_by_id[custom_id] = {'row': i + 2, 'sku': skus[i] if i < len(skus) else '',
+                                         'cache_key': cache_key}
+
+    if requests_by_id:
+        batch = batch_service.submit(jsonl_path, metadata=metadata)
+        with open(state_path, 'w', encoding='utf-8') as f:
+            json.dump({'batch_id': batch['id'], 'headers': memo_headers, 'requests': requests_by_id}, f)
+        logging.info(f"Submitted batch {batch['id']} with {len(requests_by_id)} requests")
+    os.remove(jsonl_path)
+    return unsent_results
+
+def resolve_batch_row(current_skus, request):
+    """送信時の行に今も同じ SKU があればその行、別の行に移動していれば移動先の行 (シート上の行番号) を返します。
+
+    SKU が見つからない場合は None を返します (行が削除された・SKU が書き換えられた)。
+    """
+    row = request['row'] - 2
+    sku = request.get('sku')
+    if sku is None:  # SKU を記録していない古い状態ファイル
+        return request['row']
+    if row < len(current_skus) and current_skus.value(row, 0) == sku:
+        return request['row']
+    if sku == '':
+        return None
+    moved = current_skus.find(0, sku)
+    return None if moved is None else current_skus.sheet_row(moved)
+
+def collect_batch(batch_service, sheet_service, state_path, cache=None):
+    """保存したバッチの状態を確認し、完了していれば結果を AI-memo に書き込みます。
+
+    書き込む列は送信時の AI-memo のヘッダーで決めます。
+    送信後に行が挿入・削除されていても、現在の AI-memo の SKU 列で行を探してから書き込みます。
+    バッチがまだ処理中の場合は False を返します (次回の実行で再確認します)。
+    """
+    with open(state_path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    batch = batch_service.get(state['batch_id'])
+    status = batch.get('status')
+    logging.info(f"Batch {state['batch_id']} status: {status} {batch.get('request_counts', {})}")
+    if status in ('validating', 'in_progress', 'finalizing', 'cancelling'):
+        return False
+
+    results = result_table(state['headers'])
+    pending_rows = 0
+    written_rows = 0
+    if batch.get('output_file_id'):
+        sku_col = column_letter(results.sheet_col(SKU_COL))
+        current_skus = SheetTable.from_rows(
+            'AI-memo', sheet_service.get_values(f'AI-memo!{sku_col}2:{sku_col}'), start_row=1)
+        # 結果ファイルを1行ずつ読み、STREAM_FLUSH_ROWS 行ごとにまとめて書き込む
+        for line in batch_service.iter_file_lines(batch['output_file_id']):
+            request = state['requests'].get(line.get('custom_id'))
+            response = line.get('response') or {}
+            if request is None or response.get('status_code') != 200:
+                logging.error(f"Batch request {line.get('custom_id')} failed: {line.get('error') or response}")
+                continue
+            OpenAIService.record_usage(batch_service.api_key, response.get('body'))
+            try:
+                result = OpenAIService.parse_product_info(response['body'])
+            except (KeyError, IndexError, TypeError) as e:
+                result = e
+            row_number = resolve_batch_row(current_skus, request)
+            if row_number is None:
+                logging.error(f"Batch request {line.get('custom_id')} skipped: SKU {request['sku']!r} "
+                              f"is no longer in AI-memo")
+                continue
+            if row_number != request['row']:
+                logging.warning(f"SKU {request['sku']!r} moved from row {request['row']} to {row_number}")
+            if add_result_cells(results, row_number - 2, result):
+                OpenAIService.store_cache(cache, request['cache_key'], result)
+                pending_rows += 1
+            if pending_rows >= STREAM_FLUSH_ROWS:
+                BatchUpdater.batch_update_values(sheet_service, results.write_ranges())
+                written_rows += pending_rows
+                results = result_table(state['headers'])
+                pending_rows = 0
+        BatchUpdater.batch_update_values(sheet_service, results.write_ranges())
+        written_rows += pending_rows
+    if batch.get('error_file_id'):
+        for line in batch_service.iter_file_lines(batch['error_file_id']):
+            logging.error(f"Batch request {line.get('custom_id')} failed: {line.get('error') or line.get('response')}")
+    if status != 'completed':
+        logging.error(f"Batch {state['batch_id']} ended with status {status}")
+
+    logging.info(f"Wrote {written_rows} rows from batch {state['batch_id']}")
+    os.remove(state_path)
+    return True
+
+def run_batch_mode(sheet_service, api_keys, jobs, skus, memo_headers, cache=None):
+    """バッチモードの1回分の処理です。
+
+    未送信であればバッチを作成し、送信済みであれば状態を確認して完了していれば書き込みます。
+    BATCH_WAIT が True の場合は完了するまで BATCH_POLL_INTERVAL 秒ごとに確認します。
+
+    バッチは Setting!F列の最初のキーだけで送信・取得します。
+    作成したバッチと結果ファイルは送信したキーのプロジェクトからしか読めないため、
+    実行ごとにキーを切り替えず、次回の実行でも同じキーで結果を取得します (キーの順番を変えないでください)。
+    """
+    batch_service = OpenAIBatchService(api_keys[0])
+    state_path = os.path.join(BATCH_STATE_DIR, f'{sheet_service.spreadsheet_id}.json')
+
+    if not os.path.exists(state_path):
+        unsent_results = submit_batch(batch_service, state_path, jobs, skus, memo_headers, cache,
+                                      metadata={'spreadsheet_id': sheet_service.spreadsheet_id})
+        results = result_table(memo_headers)
+        for i, result in unsent_results.items():
+            add_result_cells(results, i, result)
+        BatchUpdater.batch_update_values(sheet_service, results.write_ranges())
+        if not os.path.exists(state_path):
+            return
+
+    while not collect_batch(batch_service, sheet_service, state_path, cache):
+        if not BATCH_WAIT:
+            logging.info("Batch is still running, run again later to collect the results")
+            return
+        time.sleep(BATCH_POLL_INTERVAL)
+
+def result_table(memo_headers):
+    """AI-memo の1行目をヘッダーにした、生成結果を書き込むための表 (2行目から、読み込んだ列なし) を返します。"""
+    return SheetTable('AI-memo', [], headers=memo_headers, start_row=1)
+
+def get_item_specifics_headers(table):
+    """AI-memo のヘッダーのうち New-Discription より右の商品情報のヘッダーを返します。"""
+    return table.headers[table.col(NEW_DESCRIPTION_COL) + 1:]
+
+def add_result_cells(table, row, result):
+    """生成結果を表の書き込みに追加します。タイトルは New-Titel、説明は New-Discription、商品情報は同名の列です。
+
+    row は表のデータの行番号 (AI-memo の2行目が 0) です。
+    商品情報は New-Discription より右の列だけに書き込み、同名のヘッダーは最初の列を使います。
+    """
+    try:
+        if isinstance(result, Exception):
+            raise result
+        new_title, new_description, item_specifics = result
+    except Exception as e:
+        logging.error(f"Error in thread: {e}")
+        return False
+
+    if new_title is not None:
+        table.set(row, NEW_TITLE_COL, new_title)
+    if new_description is not None:
+        table.set(row, NEW_DESCRIPTION_COL, new_description)
+    specifics_start = table.col(NEW_DESCRIPTION_COL) + 1
+    for key, value in item_specifics.items():
+        if value is not None and table.header_index.get(key, -1) >= specifics_start:
+            table.set(row, key, value)
+    return True
+
+class ProgressWatermark:
+    """ストリーミングモードで書き込みが完了した行を記録し、中断した実行を再開できるようにします。
+
+    watermark は「この行までの全ての行を書き込み済み」の行番号です。
+    商品情報のヘッダーが変わった場合は記録を無視して最初からやり直します。
+    """
+
+    def __init__(self, spreadsheet_id, item_specifics_headers, progress_dir=PROGRESS_DIR):
+        self.path = os.path.join(progress_dir, f'{spreadsheet_id}.json')
+        self.signature = hashlib.sha256(json.dumps(item_specifics_headers).encode('utf-8')).hexdigest()
+        self.watermark = 1  # ヘッダー行
+        self.done = set()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return self.watermark
+        if progress.get('signature') == self.signature:
+            self.watermark = progress.get('watermark', 1)
+            logging.info(f"Resuming from row {self.watermark + 1}")
+        return self.watermark
+
+    def mark_done(self, row_numbers):
+        self.done.update(row_numbers)
+        while self.watermark + 1 in self.done:
+            self.watermark += 1
+            self.done.discard(self.watermark)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'signature': self.signature, 'watermark': self.watermark}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+async def generate_streaming(sheet_service, api_keys, memo_headers, cache=None,
+                             max_concurrency=MAX_CONCURRENCY, key_pool=None):
+    """AI-memo をページ単位で読みながら生成し、完了した行を定期的にまとめて書き込みます。
+
+    同時に処理中の行は STREAM_WINDOW 行までに制限し、書き込み済みの位置を
+    ProgressWatermark に記録するため、途中で止まっても続きから再開できます。
+    values.get は末尾の空行を返さないため、ページは読んだ行数ではなく要求した行数だけ進め、
+    シートの行数 (gridProperties.rowCount) を超えたところで終わります。
+    """
+    item_specifics_headers = get_item_specifics_headers(result_table(memo_headers))
+    progress = ProgressWatermark(sheet_service.spreadsheet_id, item_specifics_headers)
+    next_row = progress.load() + 1
+    window = asyncio.Semaphore(STREAM_WINDOW)
+    completed = {}  # 行番号 -> 生成結果 (未書き込み)
+    tasks = set()
+    last_flush = time.monotonic()
+    failed_rows = set()
+
+    async def flush():
+        nonlocal last_flush
+        if not completed:
+            return
+        rows = dict(completed)
+        completed.clear()
+        results = result_table(memo_headers)
+        done_rows = []
+        for row_number, result in rows.items():
+            # 空行 (None) と書き込む値がある行だけを完了にし、失敗した行は次の実行でやり直す
+            if result is None or add_result_cells(results, row_number - 2, result):
+                done_rows.append(row_number)
+            else:
+                failed_rows.add(row_number)
+        data = results.write_ranges()
+        logging.info(f"Flushing {len(rows)} rows as {len(data)} ranges")
+        if await asyncio.to_thread(BatchUpdater.batch_update_values, sheet_service, data):
+            progress.mark_done(done_rows)
+        else:
+            failed_rows.update(done_rows)
+        last_flush = time.monotonic()
+
+    async def process(openai_service, row_number, image_url, title, description):
+        try:
+            completed[row_number] = await openai_service.send_to_openai(
+                image_url, title, description, item_specifics_headers, row_number)
+        except Exception as e:
+            completed[row_number] = e
+        finally:
+            window.release()
+
+    connector = aiohttp.TCPConnector(limit=max_concurrency * 2)
+    timeout = aiohttp.ClientTimeout(total=OPENAI_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        openai_service = AsyncOpenAIService(api_keys, session, max_concurrency, key_pool=key_pool, cache=cache)
+        row_count = await asyncio.to_thread(sheet_service.get_row_count, 'AI-memo')
+        if row_count is None:
+            failed_rows.add(next_row)
+            row_count = 0
+        while next_row <= row_count:
+            last_row = min(next_row + STREAM_PAGE_SIZE - 1, row_count)
+            try:
+                page = await asyncio.to_thread(sheet_service.fetch_values, f'AI-memo!A{next_row}:D{last_row}')
+            except Exception as e:
+                # 読めなかったページを空行として扱うと書き込み済みになるため、ここで止めて次の実行でやり直す
+                logging.error(f"Error fetching values from rows {next_row}-{last_row} of AI-memo: {e}")
+                failed_rows.add(next_row)
+                break
+            # 末尾の省略された空行も含めて、要求した行数の表にする
+            page = page + [[] for _ in range(last_row - next_row + 1 - len(page))]
+            table = SheetTable.from_rows('AI-memo', page, start_row=next_row - 1, headers=memo_headers)
+            rows = table.rows(TITLE_COL, DESCRIPTION_COL, IMAGE_COL)
+            for offset, (title, description, image_url) in enumerate(rows):
+                if not title and not description:
+                    completed[next_row + offset] = None  # 空行は生成せずに書き込み済みとして扱う
+                else:
+                    await window.acquire()
+                    task = asyncio.ensure_future(
+                        process(openai_service, next_row + offset, image_url or None, title, description))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if len(completed) >= STREAM_FLUSH_ROWS or time.monotonic() - last_flush >= STREAM_FLUSH_INTERVAL:
+                    await flush()
+            next_row = last_row + 1
+
+        while tasks:
+            await asyncio.wait(set(tasks), timeout=STREAM_FLUSH_INTERVAL)
+            await flush()
+    await flush()
+    if failed_rows:
+        logging.error(f"{len(failed_rows)} rows were not written; the next run resumes from row "
+                      f"{progress.watermark + 1}")
+    else:
+        progress.clear()
+
 def main():
     start_time = datetime.now()
     
     sheet_service = GoogleSheetService(SERVICE_ACCOUNT_FILE, SPREADSHEET_ID)
-    openai_api_keys = get_openai_api_keys(sheet_service)
-    openai_service = OpenAIService(openai_api_keys)
+    cache = None
+    if USE_GENERATION_CACHE:
+        cache = GenerationCache()
+        cache.evict()
+
+    run(sheet_service, cache=cache)
+
+    if cache is not None:
+        cache.close()
+    ImageService.shutdown()
+    if USE_IMAGE_CACHE:
+        ThumbnailCache().evict()
+    
+    end_time = datetime.now()
+    elapsed_time = end_time - start_time
+    logging.info(f"プログラム開始時間: {start_time}")
+    logging.info(f"プログラム終了時間: {end_time}")
+    logging.info(f"プログラムにかかった時間: {elapsed_time}")
+
+def run(sheet_service, cache=None, make_key_pool=OpenAIKeyPool):
+    """1つのスプレッドシートの AI-memo にタイトル・説明・商品情報を生成して書き込みます。
+
+    キーのプールは make_key_pool(Setting!F列のキー) で作成します (複数のスプレッドシートで共有する場合に指定)。
+    結果を {'mode': 生成モード, 'rows': 行数, 'generated': 成功した行数} で返します。
+    失敗した場合は {'error': 内容} を返します。
+    """
+    # 実行に必要な範囲を1回でまとめて取得 (ストリーミングモードでは AI-memo の行はページ単位で読む)
+    ranges = ['Setting!F1:F', 'AI-memo!A1:1']
+    if not STREAMING:
+        ranges.append('AI-memo!A2:D')
+    snapshot = sheet_service.batch_get_values(ranges)
+    openai_api_keys = get_openai_api_keys(snapshot['Setting!F1:F'])
 
     if not openai_api_keys:
         logging.error("OpenAI APIキーが見つかりませんでした。")
-        return
-
-    descriptions = sheet_service.get_values('AI-memo!B2:B')
-    row_indices = [i + 2 for i in range(len(descriptions))]
+        return {'error': "OpenAI API keys not found"}
+    key_pool = make_key_pool(openai_api_keys)
+    openai_service = OpenAIService(openai_api_keys, key_pool=key_pool, cache=cache)
 
     # 説明を要約
     #summaries = []
@@ -298,70 +1391,51 @@ def main():
     #BatchUpdater.batch_update_values(sheet_service, data)
 
     # 商品タイトルと説明を更新
-    item_specifics_headers = sheet_service.get_values('AI-memo!AD1:1')[0]
-    jp_titles = sheet_service.get_values('AI-memo!A2:A')
-    img_urls = sheet_service.get_values('AI-memo!D2:D')
-    min_length = min(len(jp_titles), len(descriptions), len(img_urls))
-    
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        futures = {
-            executor.submit(
-                openai_service.send_to_openai,
-                img_urls[i][0],
-                jp_titles[i][0],
-                descriptions[i][0],
-                item_specifics_headers,
-                i
-            ): i for i in range(min_length)
-        }
+    # 列は AI-memo の1行目のヘッダー名で引く
+    memo_headers = (snapshot['AI-memo!A1:1'] or [[]])[0]
+    header_table = result_table(memo_headers)
+    missing = [column for column in MEMO_COLUMNS if column not in header_table.header_index]
+    if missing:
+        logging.error(f"AI-memo の1行目にヘッダーが見つかりませんでした: {missing}")
+        return {'error': f"AI-memo headers not found: {missing}"}
+    item_specifics_headers = get_item_specifics_headers(header_table)
+    if STREAMING:
+        asyncio.run(generate_streaming(sheet_service, openai_api_keys, memo_headers, cache=cache,
+                                       key_pool=key_pool))
+        return {'mode': 'streaming'}
+    else:
+        # A〜D列を列ごとの表にし、タイトルか説明がある最後の行までを生成する (空のセルは '')
+        memo = SheetTable.from_rows('AI-memo', snapshot['AI-memo!A2:D'], start_row=1, headers=memo_headers)
+        row_count = memo.last_row(TITLE_COL, DESCRIPTION_COL)
+        jobs = [(image_url, title, description) for title, description, image_url
+                in memo.rows(TITLE_COL, DESCRIPTION_COL, IMAGE_COL)][:row_count]
+        if GENERATION_MODE == 'batch':
+            run_batch_mode(sheet_service, openai_api_keys, jobs, memo.column(SKU_COL), memo_headers, cache=cache)
+            results = {}
+        elif GENERATION_MODE == 'packed':
+            skus = memo.column(SKU_COL)
+            results = asyncio.run(generate_packed(openai_api_keys, jobs, skus, item_specifics_headers, cache=cache,
+                                                  key_pool=key_pool))
+        elif GENERATION_MODE == 'async':
+            results = asyncio.run(generate_with_asyncio(openai_api_keys, jobs, item_specifics_headers, cache=cache,
+                                                        key_pool=key_pool))
+        else:
+            results = generate_with_threads(openai_service, jobs, item_specifics_headers)
 
-        titles = [None] * min_length
-        new_descriptions = [None] * min_length
-        specifics = {header: [None] * min_length for header in item_specifics_headers}
+        # タイトル・説明・商品情報 (ItemSpecifics) を表の書き込みに追加する
+        for i, result in results.items():
+            add_result_cells(memo, i, result)
 
-        for future in as_completed(futures):
-            i = futures[future]
-            try:
-                new_title, new_description, item_specifics = future.result()
-                titles[i] = new_title
-                new_descriptions[i] = new_description
-                for key, value in item_specifics.items():
-                    if key in specifics:
-                        specifics[key][i] = value
-            except Exception as e:
-                logging.error(f"Error in thread: {e}")
-
-    # タイトルと説明をシートに挿入
-    data = []
-    for i, (title, description) in enumerate(zip(titles, new_descriptions)):
-        if title is not None:
-            title_range = f'AI-memo!AB{row_indices[i]}:AB{row_indices[i]}'
-            data.append({'range': title_range, 'values': [[title]]})
-
-        if description is not None:
-            description_range = f'AI-memo!AC{row_indices[i]}:AC{row_indices[i]}'
-            data.append({'range': description_range, 'values': [[description]]})
-
-    BatchUpdater.batch_update_values(sheet_service, data)
-
-    # 商品情報 (ItemSpecifics) をシートに挿入
-    item_data = []
-    for key, values in specifics.items():
-        if key in item_specifics_headers:
-            col_index = item_specifics_headers.index(key) + 29  # AD列は29番目
-            col_letter = Utils.get_column_letter(col_index)  # 列の文字を取得
-            for i, value in enumerate(values):
-                if value is not None:
-                    specifics_range = f'AI-memo!{col_letter}{row_indices[i]}:{col_letter}{row_indices[i]}'
-                    item_data.append({'range': specifics_range, 'values': [[value]]})
-
-    BatchUpdater.batch_update_values(sheet_service, item_data)
-    
-    end_time = datetime.now()
-    elapsed_time = end_time - start_time
-    logging.info(f"プログラム開始時間: {start_time}")
-    logging.info(f"プログラム終了時間: {end_time}")
-    logging.info(f"プログラムにかかった時間: {elapsed_time}")
+        # 連続する行・列を矩形範囲にまとめてシートに挿入
+        data = memo.write_ranges()
+        logging.debug("Coalesced %d cells into %d ranges", len(memo.updates), len(data))
+        BatchUpdater.batch_update_values(sheet_service, data)
+    generated = sum(1 for result in results.values() if isinstance(result, tuple))
+    return {'mode': GENERATION_MODE, 'rows': len(jobs), 'generated': generated}
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # 処理段階ごとの時間、API 呼び出し・再試行・429 の回数、キーごとの使用トークン数を出力
+        Metrics.log_summary()
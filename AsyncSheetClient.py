@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+from urllib.parse import quote
+
+import aiohttp
+
+from Metrics import Metrics
+from SheetClient import SCOPES, SHEETS_API_ENDPOINT, refresh_credentials, token_is_valid
+from SheetQuota import (MAX_RETRIES, RETRY_STATUSES, QuotaScheduler, backoff_delay, is_rate_limited,
+                        parse_retry_after, request_kind)
+
+# Google Sheets API (REST) を aiohttp で直接呼び出す非同期クライアント
+# googleapiclient (httplib2) はスレッドセーフではなくブロッキングのため、FastAPI からはこちらを使う
+
+SHEETS_API_BASE = SHEETS_API_ENDPOINT.rstrip('/') + '/v4'
+POOL_SIZE = 50  # 同時に使う HTTP 接続数の上限
+KEEPALIVE_TIMEOUT = 60  # 秒
+REQUEST_DEADLINE = 30  # 1リクエストあたりの上限時間 (秒)
+
+
+class SheetsApiError(Exception):
+    """Sheets API がエラーを返した場合の例外です。status に HTTP ステータスを持ちます。"""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+async def error_message(response):
+    """エラーのレスポンスからメッセージを取り出します。
+
+    プロキシが返す HTML の 502 / 503 など、JSON ではない本文の場合は本文の先頭を使います。
+    """
+    text = await response.text(errors='replace')
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = None
+    if isinstance(data, dict) and isinstance(data.get('error'), dict) and data['error'].get('message'):
+        return data['error']['message']
+    text = ' '.join(text.split())
+    return f'{response.reason}: {text[:200]}' if text else str(response.reason)
+
+
+class AsyncSheetClient:
+    """1つの aiohttp セッション (接続プール) で Sheets API を呼び出すクライアントです。
+
+    各メソッドは deadline 秒 (クォータ待ち・再試行を含む) で打ち切られ、呼び出し元のタスクが
+    キャンセルされた場合は送信中のリクエストも中断されます。
+    """
+
+    def __init__(self, credentials, spreadsheet_id, scopes=SCOPES,
+                 pool_size=POOL_SIZE, deadline=REQUEST_DEADLINE, api_base=SHEETS_API_BASE, scheduler=None):
+        self.credentials = credentials
+        self.spreadsheet_id = spreadsheet_id
+        self.scopes = scopes
+        self.pool_size = pool_size
+        self.deadline = deadline
+        self.api_base = api_base
+        self.scheduler = scheduler or QuotaScheduler.for_credentials(credentials)
+        self.session = None
+        self.token_lock = None
+
+    async def open(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=KEEPALIVE_TIMEOUT)
+            self.session = aiohttp.ClientSession(connector=connector, raise_for_status=False)
+            self.token_lock = asyncio.Lock()
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _authorization(self):
+        if not token_is_valid(self.credentials):
+            async with self.token_lock:
+                if not token_is_valid(self.credentials):
+                    # トークンの再取得はブロッキングのため、まとめて1回だけスレッドで行う
+                    loop = asyncio.get_running_loop()
+                    await loop.run_in_executor(None, refresh_credentials, self.credentials, self.scopes)
+        return f'Bearer {self.credentials.token}'
+
+    async def request(self, method, path, params=None, body=None, deadline=None):
+        """Sheets API にリクエストを送り、レスポンスの JSON を返します。"""
+        await self.open()
+        url = f'{self.api_base}/spreadsheets/{self.spreadsheet_id}{path}'
+        deadline = deadline or self.deadline
+
+        kind = request_kind(method)
+
+        async def send():
+            headers = {'Authorization': await self._authorization()}
+            async with self.session.request(method, url, params=params, json=body, headers=headers) as response:
+                Metrics.count('sheets_requests', kind=kind, status=response.status)
+                if response.status >= 400:
+                    raise SheetsApiError(response.status, await error_message(response),
+                                         parse_retry_after(response.headers.get('Retry-After')))
+                return await response.json(content_type=None)
+
+        async def send_with_retry():
+            for attempt in range(MAX_RETRIES + 1):
+                await self.scheduler.acquire_async(kind)
+                try:
+                    return await send()
+                except SheetsApiError as e:
+                    rate_limited = is_rate_limited(e.status, str(e))
+                    if rate_limited:
+                        Metrics.count('rate_limited', api='sheets')
+                    if attempt == MAX_RETRIES or not (rate_limited or e.status in RETRY_STATUSES):
+                        raise
+                    if rate_limited:
+                        self.scheduler.penalize(kind, e.retry_after)
+                    wait_time = backoff_delay(attempt, e.retry_after)
+                    Metrics.count('sheets_retries', kind=kind)
+                    logging.warning(f"Sheets API returned {e.status}, retrying in {wait_time:.1f} seconds "
+                                    f"({attempt + 1}/{MAX_RETRIES})")
+                    await asyncio.sleep(wait_time)
+
+        try:
+            return await asyncio.wait_for(send_with_retry(), timeout=deadline)
+        except asyncio.TimeoutError:
+            raise SheetsApiError(504, f'Sheets API request exceeded the {deadline}s deadline')
+        except aiohttp.ClientError as e:
+            raise SheetsApiError(502, f'Sheets API request failed: {e}')
+        except ValueError as e:
+            raise SheetsApiError(502, f'Sheets API returned an invalid response: {e}')
+
+    async def get_spreadsheet(self, fields=None):
+        return await self.request('GET', '', params={'fields': fields} if fields else None)
+
+    async def get_values(self, range_name):
+        return await self.request('GET', f'/values/{quote(range_name, safe="")}')
+
+    async def batch_get_values(self, ranges, major_dimension='ROWS'):
+        params = [('ranges', range_name) for range_name in ranges] + [('majorDimension', major_dimension)]
+        return await self.request('GET', '/values:batchGet', params=params)
+
+    async def update_values(self, range_name, values, value_input_option='RAW'):
+        return await self.request('PUT', f'/values/{quote(range_name, safe="")}',
+                                  params={'valueInputOption': value_input_option}, body={'values': values})
+
+    async def batch_update_values(self, data, value_input_option='RAW'):
+        return await self.request('POST', '/values:batchUpdate',
+                                  body={'valueInputOption': value_input_option, 'data': data})
+
+    async def batch_clear_values(self, ranges):
+        return await self.request('POST', '/values:batchClear', body={'ranges': ranges})
+
+    async def batch_update(self, requests):
+        return await self.request('POST', ':batchUpdate', body={'requests': requests})
+
+
+async def cancel_on_disconnect(request, coroutine):
+    """クライアントが切断した場合に coroutine をキャンセルします。
+
+    Starlette の Request から http.disconnect を待ち、先に届いた場合は
+    Sheets API へのリクエストを中断して SheetsApiError (499) を送出します。
+    """
+    async def wait_for_disconnect():
+        while True:
+            message = await request.receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    task = asyncio.ensure_future(coroutine)
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if not task.done():
+        task.cancel()
+        logging.info(f"Client disconnected, cancelled {request.method} {request.url.path}")
+        raise SheetsApiError(499, 'Client closed request')
+    return task.result()
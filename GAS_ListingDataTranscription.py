@@ -1,160 +1,393 @@
-from fastapi import FastAPI, HTTPException
-import openai
-import requests
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-import logging
+from contextlib import asynccontextmanager
+from typing import Annotated
+from fastapi import Body, FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-import uvicorn
+import json
+import logging
+import os
+from AsyncSheetClient import AsyncSheetClient, SheetsApiError, cancel_on_disconnect
+from LogConfig import setup_logging, summarize
+from Metrics import Metrics, MetricsMiddleware
+from RangeCache import RangeCache, etag_matches
+from SheetClient import SCOPES, load_credentials
+from SheetMetadata import METADATA_FIELDS, SheetMetadata
+from SheetRange import GridRange, format_a1, from_grid_range, parse_a1
+from WriteCoalescer import WriteCoalescer, parse_write
+try:
+    import orjson
+except ImportError:
+    orjson = None
 # ログの設定
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 
-# FastAPIのインスタンスを作成
-app = FastAPI()
+STREAM_PAGE_ROWS = 10000  # ストリーミングで1回に Sheets API から読む行数
+STREAM_CHUNK_ROWS = 500  # ストリーミングで1回に送信する行数
 
-executor = ThreadPoolExecutor()
+def dumps(data):
+    """JSON のバイト列を返します。orjson がインストールされていればそちらを使います。"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
 
 class GoogleSheetService:
+    """AsyncSheetClient を使って Sheets API を呼び出します。
+
+    全てのエンドポイントで1つの接続プールを共有し、スレッドプールは使いません。
+    """
     def __init__(self, service_account_file, spreadsheet_id):
-        self.scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        self.credentials = service_account.Credentials.from_service_account_file(
-            service_account_file, scopes=self.scopes)
-        self.service = build('sheets', 'v4', credentials=self.credentials)
+        self.scopes = SCOPES
+        self.credentials = load_credentials(service_account_file, self.scopes)
+        self.client = AsyncSheetClient(self.credentials, spreadsheet_id, self.scopes)
+        self.range_cache = RangeCache()
+        self.metadata = SheetMetadata()
+        self.write_coalescer = WriteCoalescer(spreadsheet_id, self.client.batch_update_values)
         self.spreadsheet_id = spreadsheet_id
         logging.debug(f"Initialized GoogleSheetService with spreadsheet ID: {spreadsheet_id}")
 
-    def get_sheet_id(self, sheet_name):
+    async def get_sheet_id(self, sheet_name):
         try:
-            spreadsheet = self.service.spreadsheets().get(spreadsheetId=self.spreadsheet_id).execute()
-            for sheet in spreadsheet.get('sheets', []):
-                if sheet.get("properties", {}).get("title") == sheet_name:
-                    return sheet.get("properties", {}).get("sheetId")
+            properties = await self.metadata.get_async(
+                sheet_name, lambda: self.client.get_spreadsheet(fields=METADATA_FIELDS))
+            if properties is not None:
+                return properties.get("sheetId")
             logging.error(f"Sheet name {sheet_name} not found.")
             return None
-        except Exception as e:
+        except SheetsApiError as e:
             logging.error(f"Error fetching sheet ID for {sheet_name}: {e}")
+            self.metadata.invalidate_on_error(e.status, str(e))
             return None
 
-    def get_values(self, range_name):
-        try:
-            logging.debug(f"Fetching values from range: {range_name}")
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.spreadsheet_id, range=range_name).execute()
-            logging.debug(f"Fetched values: {result.get('values', [])}")
+    async def get_values(self, range_name):
+        values, _ = await self.get_values_with_etag(range_name)
+        return values
+
+    async def get_values_with_etag(self, range_name):
+        """(値, ETag) を返します。最近読み込んだ範囲はキャッシュから返します。"""
+        async def fetch():
+            logging.debug("Fetching values from range: %s", range_name)
+            result = await self.client.get_values(range_name)
+            logging.debug("Fetched %s from %s", summarize(result.get('values', [])), range_name)
             return result.get('values', [])
-        except Exception as e:
+
+        try:
+            return await self.range_cache.get_or_fetch(range_name, fetch)
+        except SheetsApiError as e:
             logging.error(f"Error fetching values from range {range_name}: {e}")
-            return []
+            self.metadata.invalidate_on_error(e.status, str(e))
+            return [], None
+
+    async def batch_get_values(self, ranges):
+        """[(範囲, 値)] を返します。キャッシュにない範囲だけを1回の batchGet で取得します。"""
+        results = {}
+        missing = []
+        generation = self.range_cache.generation
+        for range_name in ranges:
+            key, grid = self.range_cache.normalize(range_name)
+            entry = self.range_cache.get(key) if key is not None else None
+            if entry is not None:
+                self.range_cache.record(hits=1)
+                results[range_name] = entry[1]
+            elif range_name not in missing:
+                missing.append(range_name)
+
+        if missing:
+            self.range_cache.record(misses=len(missing))
+            logging.debug("Fetching values from %d ranges: %s", len(missing), summarize(missing))
+            try:
+                response = await self.client.batch_get_values(missing)
+            except SheetsApiError as e:
+                self.metadata.invalidate_on_error(e.status, str(e))
+                raise
+            for range_name, value_range in zip(missing, response.get('valueRanges', [])):
+                values = value_range.get('values', [])
+                key, grid = self.range_cache.normalize(range_name)
+                if key is not None:
+                    self.range_cache.put(key, grid, values, generation)
+                results[range_name] = values
+        return [(range_name, results.get(range_name, [])) for range_name in ranges]
 
-    def update_values(self, range_name, values):
+    async def iter_value_pages(self, range_name):
+        """範囲を STREAM_PAGE_ROWS 行ずつ読み込み、(先頭の行番号(0始まり), 値) を順に返します。
+
+        次のページを読み込みながら現在のページを返すため、大きな範囲でも
+        メモリに持つのは2ページ分だけです。行数はシート情報の行数を上限にします。
+        """
+        grid = parse_a1(range_name)
+        if grid.sheet and grid.end_row is None:
+            # 下端のない範囲はシートの行数まで読むため、他のプロセスが増やした行を読み落とさないように再取得する
+            self.metadata.invalidate()
+        properties = await self.metadata.get_async(
+            grid.sheet, lambda: self.client.get_spreadsheet(fields=METADATA_FIELDS)) if grid.sheet else None
+        row_count = (properties or {}).get('gridProperties', {}).get('rowCount')
+        column_count = (properties or {}).get('gridProperties', {}).get('columnCount')
+        start_row = grid.start_row or 0
+        end_row = grid.end_row if grid.end_row is not None else row_count
+        if end_row is None:
+            # シートの行数が分からない場合は1回で読み込む
+            result = await self.client.get_values(range_name)
+            yield start_row, result.get('values', [])
+            return
+
+        async def fetch(page_start):
+            page = GridRange(grid.sheet, page_start, min(page_start + STREAM_PAGE_ROWS, end_row),
+                             grid.start_col, grid.end_col)
+            if page.start_col is None and page.end_col is None:
+                page = page._replace(start_col=0, end_col=column_count)
+            result = await self.client.get_values(format_a1(page))
+            return page_start, result.get('values', [])
+
+        next_page = asyncio.ensure_future(fetch(start_row)) if start_row < end_row else None
+        try:
+            while next_page is not None:
+                page_start, values = await next_page
+                following = page_start + STREAM_PAGE_ROWS
+                next_page = asyncio.ensure_future(fetch(following)) if following < end_row else None
+                yield page_start, values
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    async def batch_update_values(self, data):
+        """[{'range', 'values'}] をまとめて書き込みます。/update-values の書き込みと同じキューを使います。"""
+        ranges = [item['range'] for item in data]
         try:
-            logging.debug(f"Updating values in range: {range_name} with data: {values}")
-            body = {
-                'values': values
-            }
-            result = self.service.spreadsheets().values().update(
-                spreadsheetId=self.spreadsheet_id, range=range_name,
-                valueInputOption='RAW', body=body).execute()
+            for item in data:
+                parse_write(item['range'], item.get('values', []))
+            coalesce = True
+        except ValueError:
+            coalesce = False
+        try:
+            logging.debug("Batch updating values in %d ranges", len(ranges))
+            if coalesce:
+                results = await asyncio.gather(*(self.write_coalescer.submit(item['range'], item['values'])
+                                                 for item in data))
+            else:
+                response = await self.client.batch_update_values(data)
+                results = response.get('responses', [])
+            logging.info("Batch update successful")
+            return results
+        except SheetsApiError as e:
+            logging.error(f"Error updating values in ranges {ranges}: {e}")
+            self.metadata.invalidate_on_error(e.status, str(e))
+            raise HTTPException(status_code=e.status, detail=str(e))
+        finally:
+            self.range_cache.invalidate_ranges(ranges)
+
+    async def update_values(self, range_name, values):
+        try:
+            logging.debug("Updating values in range %s with %s", range_name, summarize(values))
+            try:
+                # 同時に届いた書き込みと1回の batchUpdate にまとめる
+                result = await self.write_coalescer.submit(range_name, values)
+            except ValueError:
+                result = await self.client.update_values(range_name, values)
             logging.info("Update successful")
             return result
-        except Exception as e:
+        except SheetsApiError as e:
             logging.error(f"Error updating values in range {range_name}: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+            self.metadata.invalidate_on_error(e.status, str(e))
+            raise HTTPException(status_code=e.status, detail=str(e))
+        finally:
+            # 失敗した場合も一部が書き込まれている可能性があるため削除する
+            self.range_cache.invalidate_ranges([range_name])
 
-    def batch_clear_values(self, ranges):
+    async def batch_clear_values(self, ranges):
         try:
-            logging.debug(f"Clearing values in ranges: {ranges}")
-            clear_body = {
-                'ranges': ranges
-            }
-            result = self.service.spreadsheets().values().batchClear(
-                spreadsheetId=self.spreadsheet_id,
-                body=clear_body
-            ).execute()
+            logging.debug("Clearing values in %d ranges: %s", len(ranges), summarize(ranges))
+            result = await self.client.batch_clear_values(ranges)
             logging.info("Batch clear successful")
             return result
-        except Exception as e:
+        except SheetsApiError as e:
             logging.error(f"Error clearing values in ranges {ranges}: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+            self.metadata.invalidate_on_error(e.status, str(e))
+            raise HTTPException(status_code=e.status, detail=str(e))
+        finally:
+            self.range_cache.invalidate_ranges(ranges)
 
-    def batch_update_cell_colors(self, sheet_id, requests):
+    async def batch_update_cell_colors(self, sheet_id, requests, sheet_name=None):
         try:
-            logging.debug(f"Updating cell colors with requests: {requests}")
-            result = self.service.spreadsheets().batchUpdate(
-                spreadsheetId=self.spreadsheet_id,
-                body={'requests': requests}
-            ).execute()
+            logging.debug("Updating cell colors with %d requests", len(requests))
+            result = await self.client.batch_update(requests)
             logging.info("Batch update cell colors successful")
             return result
-        except Exception as e:
+        except SheetsApiError as e:
             logging.error(f"Error updating cell colors: {e}")
-            raise HTTPException(status_code=500, detail=str(e))
+            # シートが削除・再作成されてシートIDが変わった可能性がある
+            self.metadata.invalidate_on_error(e.status, str(e))
+            raise HTTPException(status_code=e.status, detail=str(e))
+        finally:
+            grids = [from_grid_range(sheet_name, request['repeatCell']['range'])
+                     for request in requests if 'repeatCell' in request]
+            if len(grids) < len(requests):
+                grids = [GridRange(sheet_name, None, None, None, None)]
+            self.range_cache.invalidate(grids)
 
 # Google Sheetsサービスのインスタンスを初期化
-SERVICE_ACCOUNT_FILE = r'C:\Users\kanchi\Desktop\プログラミング\MMスクール\出品算出シート001\mmschool-unlimi-001-dc6603fc2808.json'
-SPREADSHEET_ID = '1oNSqWAQZd-Tqg5QUsY-M-hjx1Pf9WdFgGxPIipW0sEE'
+SERVICE_ACCOUNT_FILE = os.environ.get('MM_SERVICE_ACCOUNT_FILE', r'C:\Users\kanchi\Desktop\プログラミング\MMスクール\出品算出シート001\mmschool-unlimi-001-dc6603fc2808.json')
+SPREADSHEET_ID = os.environ.get('MM_SPREADSHEET_ID', '1oNSqWAQZd-Tqg5QUsY-M-hjx1Pf9WdFgGxPIipW0sEE')
 sheet_service = GoogleSheetService(SERVICE_ACCOUNT_FILE, SPREADSHEET_ID)
 
+@asynccontextmanager
+async def lifespan(app):
+    # 接続プールはイベントループ上で作成し、終了時に閉じる
+    await sheet_service.client.open()
+    yield
+    await sheet_service.write_coalescer.close()
+    await sheet_service.client.close()
+
+# FastAPIのインスタンスを作成
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+@app.get("/metrics")
+async def metrics():
+    """
+    エンドポイントごとの処理時間、Sheets API の呼び出し回数・再試行・429 などを Prometheus 形式で返します。
+    """
+    return PlainTextResponse(Metrics.render_prometheus(), media_type='text/plain; version=0.0.4')
+
 @app.get("/get-values/{range_name}")
-async def get_values(range_name: str):
+async def get_values(range_name: str, request: Request, response: Response):
     """
     指定された範囲からGoogle Sheetsの値を取得します。
+    If-None-Match が現在の ETag と一致する場合は 304 を返します。
     """
     try:
-        loop = asyncio.get_event_loop()
-        values = await loop.run_in_executor(executor, sheet_service.get_values, range_name)
+        values, etag = await cancel_on_disconnect(request, sheet_service.get_values_with_etag(range_name))
         if not values:
             raise HTTPException(status_code=404, detail="No values found in the specified range.")
+        if etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers={'ETag': etag})
+        response.headers['ETag'] = etag
         return {"values": values}
+    except HTTPException:
+        raise
+    except SheetsApiError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
     except Exception as e:
         logging.error(f"Error in get_values endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/update-values/{range_name}")
-async def update_values(range_name: str, values: list):
+async def update_values(range_name: str, values: Annotated[list, Body()], request: Request):
     """
     指定された範囲にGoogle Sheetsの値を更新します。
     """
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(executor, sheet_service.update_values, range_name, values)
+        result = await cancel_on_disconnect(request, sheet_service.update_values(range_name, values))
         return {"updatedRange": result.get('updatedRange'), "updatedRows": result.get('updatedRows')}
+    except HTTPException:
+        raise
+    except SheetsApiError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
     except Exception as e:
         logging.error(f"Error in update_values endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/batch-clear-values")
-async def batch_clear_values(ranges: list):
+async def batch_clear_values(ranges: Annotated[list, Body()], request: Request):
     """
     指定された範囲のGoogle Sheetsの値をクリアします。
     """
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(executor, sheet_service.batch_clear_values, ranges)
+        result = await cancel_on_disconnect(request, sheet_service.batch_clear_values(ranges))
         return {"clearedRanges": result.get('clearedRanges')}
+    except HTTPException:
+        raise
+    except SheetsApiError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
     except Exception as e:
         logging.error(f"Error in batch_clear_values endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/update-cell-colors/{sheet_name}")
-async def update_cell_colors(sheet_name: str, color_requests: list):
+async def update_cell_colors(sheet_name: str, color_requests: Annotated[list, Body()], request: Request):
     """
     指定されたシート内のセルの色を更新します。
     """
     try:
-        loop = asyncio.get_event_loop()
-        sheet_id = await loop.run_in_executor(executor, sheet_service.get_sheet_id, sheet_name)
+        sheet_id = await cancel_on_disconnect(request, sheet_service.get_sheet_id(sheet_name))
         if sheet_id is None:
             raise HTTPException(status_code=404, detail="Sheet not found.")
         # シートIDをリクエストに追加
-        for request in color_requests:
-            request['repeatCell']['range']['sheetId'] = sheet_id
-        result = await loop.run_in_executor(executor, sheet_service.batch_update_cell_colors, sheet_id, color_requests)
+        for color_request in color_requests:
+            color_request['repeatCell']['range']['sheetId'] = sheet_id
+        result = await cancel_on_disconnect(
+            request, sheet_service.batch_update_cell_colors(sheet_id, color_requests, sheet_name))
         return {"updatedCells": result.get('replies')}
+    except HTTPException:
+        raise
+    except SheetsApiError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
     except Exception as e:
         logging.error(f"Error in update_cell_colors endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/batch-get")
+async def batch_get(ranges: Annotated[list, Body()], request: Request, stream: bool = False):
+    """
+    複数の範囲の値をまとめて取得します。
+    stream=true の場合は1行ごとに {"range", "row", "values"} の NDJSON を返します (row は1始まりの行番号)。
+    """
+    try:
+        if stream:
+            # 範囲の形式はストリーミングを開始する前に確認する
+            for range_name in ranges:
+                parse_a1(range_name)
+
+            async def generate():
+                try:
+                    for range_name in ranges:
+                        async for page_start, values in sheet_service.iter_value_pages(range_name):
+                            for chunk_start in range(0, len(values), STREAM_CHUNK_ROWS):
+                                chunk = values[chunk_start:chunk_start + STREAM_CHUNK_ROWS]
+                                yield b''.join(
+                                    dumps({"range": range_name, "row": page_start + chunk_start + i + 1,
+                                           "values": row}) + b'\n' for i, row in enumerate(chunk))
+                except SheetsApiError as e:
+                    # ステータスコードは送信済みのため、最後の行でエラーを伝える
+                    logging.error(f"Error streaming values from ranges {ranges}: {e}")
+                    sheet_service.metadata.invalidate_on_error(e.status, str(e))
+                    yield dumps({"error": str(e), "status": e.status}) + b'\n'
+
+            return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+        results = await cancel_on_disconnect(request, sheet_service.batch_get_values(ranges))
+        return Response(content=dumps({"valueRanges": [{"range": range_name, "values": values}
+                                                       for range_name, values in results]}),
+                        media_type='application/json')
+    except HTTPException:
+        raise
+    except SheetsApiError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error in batch_get endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/batch-update")
+async def batch_update(data: Annotated[list, Body()], request: Request):
+    """
+    [{"range": ..., "values": [[...]]}] の複数の範囲にまとめて値を書き込みます。
+    """
+    try:
+        results = await cancel_on_disconnect(request, sheet_service.batch_update_values(data))
+        return {"totalUpdatedCells": sum(result.get('updatedCells', 0) for result in results),
+                "responses": [{"updatedRange": result.get('updatedRange'), "updatedRows": result.get('updatedRows')}
+                              for result in results]}
+    except HTTPException:
+        raise
+    except SheetsApiError as e:
+        raise HTTPException(status_code=e.status, detail=str(e))
+    except (KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch update data: {e}")
+    except Exception as e:
+        logging.error(f"Error in batch_update endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,130 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# OpenAI で生成したタイトル・説明・商品情報をディスクに保存するキャッシュ
+# キーはプロンプトの入力 (タイトル・説明・画像URL・画像の内容・商品情報ヘッダー) とモデルのパラメータのハッシュ
+# 画像の内容 (サムネイルのハッシュ) を含めるため、同じ URL の画像が差し替えられた場合は別のキーになる
+
+GENERATION_CACHE_PATH = os.environ.get(
+    'MM_GENERATION_CACHE_PATH',
+    os.path.join(os.path.expanduser('~'), '.cache', 'mm-school', 'generation_cache.sqlite3'))
+MAX_AGE_DAYS = 30
+MAX_ENTRIES = 200000
+
+
+class GenerationCache:
+    def __init__(self, path=GENERATION_CACHE_PATH, max_age_days=MAX_AGE_DAYS, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_age = max_age_days * 24 * 60 * 60
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS generations ('
+            'key TEXT PRIMARY KEY, result TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)')
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)')
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(payload, image_url=None, image_digest=None):
+        """画像を含まない payload と画像URL・画像のハッシュ (ImageCache.thumbnail_digest) からキャッシュキーを作成します。"""
+        source = json.dumps({'payload': payload, 'image_url': image_url or '', 'image': image_digest or ''},
+                            ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT result, created_at FROM generations WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.max_age:
+                self.connection.execute('DELETE FROM generations WHERE key = ?', (key,))
+                self.connection.commit()
+                return None
+            self.connection.execute('UPDATE generations SET last_used = ? WHERE key = ?', (now, key))
+            self.connection.commit()
+        return tuple(json.loads(row[0]))
+
+    def put(self, key, result):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO generations (key, result, created_at, last_used) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(list(result), ensure_ascii=False), now, now))
+            self.connection.commit()
+
+    def evict(self):
+        """有効期限切れのエントリと、件数の上限を超えた古いエントリを削除します。"""
+        with self.lock:
+            expired = self.connection.execute(
+                'DELETE FROM generations WHERE created_at < ?', (time.time() - self.max_age,)).rowcount
+            overflow = self.connection.execute(
+                'DELETE FROM generations WHERE key IN ('
+                'SELECT key FROM generations ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)).rowcount
+            self.connection.commit()
+        if expired or overflow:
+            logging.info(f"Evicted {expired} expired and {overflow} least recently used cache entries")
+        return expired + overflow
+
+    def invalidate(self, older_than_days=None):
+        """キャッシュを削除します。older_than_days を指定した場合はそれより古いものだけを削除します。"""
+        with self.lock:
+            if older_than_days is None:
+                count = self.connection.execute('DELETE FROM generations').rowcount
+            else:
+                count = self.connection.execute(
+                    'DELETE FROM generations WHERE created_at < ?',
+                    (time.time() - older_than_days * 24 * 60 * 60,)).rowcount
+            self.connection.commit()
+        logging.info(f"Invalidated {count} cache entries")
+        return count
+
+    def stats(self):
+        with self.lock:
+            count, oldest = self.connection.execute(
+                'SELECT COUNT(*), MIN(created_at) FROM generations').fetchone()
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {'entries': count, 'oldest': oldest, 'bytes': size}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI 生成結果キャッシュの管理')
+    parser.add_argument('--path', default=GENERATION_CACHE_PATH)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    invalidate_parser = subparsers.add_parser('invalidate', help='キャッシュを削除します')
+    invalidate_parser.add_argument('--older-than-days', type=float)
+    subparsers.add_parser('evict', help='期限切れ・上限超過のエントリを削除します')
+    subparsers.add_parser('stats', help='キャッシュの件数とサイズを表示します')
+    args = parser.parse_args()
+
+    cache = GenerationCache(args.path)
+    try:
+        if args.command == 'invalidate':
+            print(f"Invalidated {cache.invalidate(args.older_than_days)} entries")
+        elif args.command == 'evict':
+            print(f"Evicted {cache.evict()} entries")
+        else:
+            print(json.dumps(cache.stats()))
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
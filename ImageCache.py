@@ -0,0 +1,148 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+
+# 縮小・エンコード済みの画像 (サムネイル) をディスクに保存するキャッシュ
+# URL と縮小サイズごとに1ファイルで保存し、ETag / Last-Modified で再検証する
+
+IMAGE_CACHE_DIR = os.environ.get(
+    'MM_IMAGE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'mm-school', 'thumbnails'))
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+REVALIDATE_AFTER = 24 * 60 * 60  # この秒数以内に確認したサムネイルは再検証せずに使う
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_bytes=MAX_CACHE_BYTES, revalidate_after=REVALIDATE_AFTER):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url, max_size):
+        key = hashlib.sha256(f'{url}|{max_size[0]}x{max_size[1]}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def load(self, url, max_size):
+        """キャッシュされたエントリを返します。使用時刻を更新して LRU の順番に反映します。"""
+        path = self._path(url, max_size)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != url:
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry.get('checked_at', 0) < self.revalidate_after
+
+    @staticmethod
+    def conditional_headers(entry):
+        """再検証用の If-None-Match / If-Modified-Since ヘッダーを返します。"""
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, max_size, thumbnail, etag=None, last_modified=None):
+        entry = {
+            'url': url,
+            'thumbnail': thumbnail,
+            'etag': etag,
+            'last_modified': last_modified,
+            'checked_at': time.time(),
+        }
+        self._write(self._path(url, max_size), entry)
+        return entry
+
+    def mark_validated(self, url, max_size, entry):
+        """304 で変更がなかったエントリの確認時刻を更新します。"""
+        entry['checked_at'] = time.time()
+        self._write(self._path(url, max_size), entry)
+
+    def _write(self, path, entry):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not write thumbnail cache {path}: {e}")
+
+    def evict(self):
+        """合計サイズが max_bytes を超えている場合、最後に使われた時刻が古い順に削除します。"""
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            logging.info(f"Evicted {removed} thumbnails from image cache")
+        return removed
+
+
+def thumbnail_digest(thumbnail):
+    """サムネイルの内容のハッシュを返します。画像がない場合は '' です。
+
+    同じ URL の画像が差し替えられた場合に、生成結果のキャッシュを区別するために使います。
+    """
+    if not thumbnail:
+        return ''
+    return hashlib.sha256(thumbnail.encode('ascii')).hexdigest()
+
+
+def encode_thumbnail(content, max_size=(150, 150), draft=True):
+    """画像データを縮小して JPEG の base64 文字列に変換します。
+
+    プロセスプールから呼び出せるようにモジュールの関数にしています。
+    JPEG は draft モードで縮小版を直接デコードしてから縮小します。
+    透過や CMYK などの RGB 以外の画像は白背景の RGB に変換します。
+    """
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(content))
+    if draft and image.format == 'JPEG':
+        # デコーダに 1/2〜1/8 のサイズでデコードさせる (max_size より小さくはならない)
+        image.draft('RGB', max_size)
+    image.thumbnail(max_size)
+
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG", quality=85)
+
+    return base64.b64encode(buffered.getvalue()).decode('utf-8')
@@ -1,29 +1,32 @@
-import openai
-import requests
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-import threading
-import aiohttp
 import logging
+import os
+from ListingSource import read_listing_file, write_grid_file
+from LogConfig import setup_logging, summarize
+from Metrics import Metrics
+from SheetClient import SCOPES, build_sheets_service, load_credentials
+from SheetMetadata import METADATA_FIELDS, SheetMetadata
+from SheetRange import GridRange, coalesce_blocks, coalesce_cells, format_a1, to_grid_range
+from SheetTable import SheetTable
 
 # ログの設定
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 
 class GoogleSheetService:
-    def __init__(self, service_account_file, spreadsheet_id):
-        self.scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        self.credentials = service_account.Credentials.from_service_account_file(
-            service_account_file, scopes=self.scopes)
-        self.service = build('sheets', 'v4', credentials=self.credentials)
+    def __init__(self, service_account_file, spreadsheet_id, credentials=None, scheduler=None):
+        # 複数のスプレッドシートを処理する場合は読み込み済みの credentials とスケジューラーを渡す
+        self.scopes = SCOPES
+        self.credentials = credentials or load_credentials(service_account_file, self.scopes)
+        self.service = build_sheets_service(self.credentials, scheduler)
         self.spreadsheet_id = spreadsheet_id
+        self.metadata = SheetMetadata()
         logging.debug(f"Initialized GoogleSheetService with spreadsheet ID: {spreadsheet_id}")
 
     def get_sheet_id(self, sheet_name):
         try:
-            spreadsheet = self.service.spreadsheets().get(spreadsheetId=self.spreadsheet_id).execute()
-            for sheet in spreadsheet.get('sheets', []):
-                if sheet.get("properties", {}).get("title") == sheet_name:
-                    return sheet.get("properties", {}).get("sheetId")
+            properties = self.metadata.get(sheet_name, lambda: self.service.spreadsheets().get(
+                spreadsheetId=self.spreadsheet_id, fields=METADATA_FIELDS).execute())
+            if properties is not None:
+                return properties.get("sheetId")
             logging.error(f"Sheet name {sheet_name} not found.")
             return None
         except Exception as e:
@@ -32,18 +35,36 @@ class GoogleSheetService:
 
     def get_values(self, range_name):
         try:
-            logging.debug(f"Fetching values from range: {range_name}")
+            logging.debug("Fetching values from range: %s", range_name)
             result = self.service.spreadsheets().values().get(
                 spreadsheetId=self.spreadsheet_id, range=range_name).execute()
-            logging.debug(f"Fetched values: {result.get('values', [])}")
+            logging.debug("Fetched %s from %s", summarize(result.get('values', [])), range_name)
             return result.get('values', [])
         except Exception as e:
             logging.error(f"Error fetching values from range {range_name}: {e}")
             return []
 
+    def batch_get_values(self, ranges, major_dimension='ROWS'):
+        """複数の範囲を1回の values.batchGet で取得し、範囲名をキーにした辞書で返します。"""
+        try:
+            logging.debug("Fetching values from %d ranges: %s", len(ranges), summarize(ranges))
+            result = self.service.spreadsheets().values().batchGet(
+                spreadsheetId=self.spreadsheet_id, ranges=ranges,
+                majorDimension=major_dimension,
+                fields='valueRanges(range,values)').execute()
+            value_ranges = result.get('valueRanges', [])
+            # レスポンスはリクエストした順番で返るため、リクエスト時の範囲名をキーにする
+            snapshot = {range_name: value_range.get('values', [])
+                        for range_name, value_range in zip(ranges, value_ranges)}
+            logging.debug("Fetched %d ranges", len(snapshot))
+            return snapshot
+        except Exception as e:
+            logging.error(f"Error fetching values from ranges {ranges}: {e}")
+            return {range_name: [] for range_name in ranges}
+
     def update_values(self, range_name, values):
         try:
-            logging.debug(f"Updating values in range: {range_name} with data: {values}")
+            logging.debug("Updating values in range %s with %s", range_name, summarize(values))
             body = {
                 'values': values
             }
@@ -55,229 +76,352 @@ class GoogleSheetService:
         except Exception as e:
             logging.error(f"Error updating values in range {range_name}: {e}")
 
-def prepare_batch_data(sheet_name, start_col, values):
-    data = []
-    for i, value in enumerate(values):
-        if isinstance(value, list):
-            for j, val in enumerate(value):
-                data.append({
-                    'range': f'{sheet_name}!{chr(start_col + j)}{i + 1}',
-                    'values': [[val]]
-                })
+# AI-memoシートの1行目に追加するヘッダー
+AI_MEMO_HEADERS = [
+    "日本語タイトル", "日本語説明", "SKU", "画像-01", "画像-02", "画像-03", "画像-04", "画像-05",
+    "画像-06", "画像-07", "画像-08", "画像-09", "画像-10", "画像-11", "画像-12", "画像-13",
+    "画像-14", "画像-15", "画像-16", "画像-17", "画像-18", "画像-19", "画像-20", "画像-21",
+    "画像-22", "画像-23", "画像-24", "New-Titel", "New-Discription"
+]
+IMAGE_START_COL = 3  # D列
+IMAGE_COLUMNS = 24   # D列からAA列まで
+SERVICE_ACCOUNT_FILE = os.environ.get('MM_SERVICE_ACCOUNT_FILE', r'C:\Users\kanchi\Desktop\プログラミング\MMスクール\出品算出シート001\mmschool-unlimi-001-dc6603fc2808.json')
+SPREADSHEET_ID = os.environ.get('MM_SPREADSHEET_ID', '1oNSqWAQZd-Tqg5QUsY-M-hjx1Pf9WdFgGxPIipW0sEE')
+# 差分モード: AI-memo を全て書き直さず、SKU で比較して追加・変更・削除された行だけを書き込む
+INCREMENTAL = False
+# 出品用CSV を Sheets API ではなく、書き出した CSV / Parquet ファイルから読み込む場合のパス (None ならシートから読む)
+LISTING_SOURCE_FILE = os.environ.get('MM_LISTING_SOURCE_FILE') or None
+LISTING_SOURCE_ENCODING = os.environ.get('MM_LISTING_SOURCE_ENCODING', 'utf-8-sig')  # cp932 の CSV は 'cp932'
+# AI-memo の表を書き出すファイル (.csv / .parquet) と書き込み先 ('sheet' / 'file' / 'both')
+# 書き込み先を指定しない場合は、ファイルを指定していれば 'both'、していなければ 'sheet'
+AI_MEMO_OUTPUT_FILE = os.environ.get('MM_AI_MEMO_OUTPUT_FILE') or None
+AI_MEMO_OUTPUT_MODE = os.environ.get('MM_AI_MEMO_OUTPUT_MODE') or None
+AI_MEMO_OUTPUT_MODES = ('sheet', 'file', 'both')
+# Setting!B2 の代わりに使う画像 URL (ファイルからファイルへの転記で Sheets API を使わない場合に指定)
+PLACEHOLDER_IMAGE_URL = os.environ.get('MM_PLACEHOLDER_IMAGE_URL') or None
+
+def get_placeholder_image_url(setting_values):
+    """SettingシートB2のGoogle DriveのURLを画像URLに変換します。"""
+    if not setting_values or not setting_values[0]:
+        logging.error("No valid image URL found in Setting!B2.")
+        return None
+    drive_url = setting_values[0][0]
+    try:
+        image_id = drive_url.split('/d/')[1].split('/')[0]  # URLから画像IDを抽出
+    except IndexError:
+        logging.error("Invalid Google Drive URL format.")
+        return None
+    image_url = f"https://lh3.googleusercontent.com/d/{image_id}"
+    logging.debug("Image URL: %s", image_url)
+    return image_url
+
+def build_ai_memo_grid(listing, csv_headers, placeholder_url):
+    """出品用CSVの値からAI-memoシートの最終的な表をメモリ上で作成します。
+
+    listing は [タイトル, 説明, SKU, 画像(|区切り)] の列を並べた SheetTable です。
+    (表, 画像セルの位置) を返します。画像セルの位置は {(行, 列): True} 形式で、
+    プレースホルダーで埋めたセルは含みません。
+    """
+    header_row = AI_MEMO_HEADERS + (csv_headers[0] if csv_headers else [])
+    grid = [header_row]
+    image_cells = {}
+
+    for i, (title, description, sku, images) in enumerate(listing.rows(0, 1, 2, 3)):
+        image_urls = images.split('|')[:IMAGE_COLUMNS] if images else []
+        if len(images.split('|')) > IMAGE_COLUMNS:
+            logging.warning(f"Row {i + 2}: more than {IMAGE_COLUMNS} images, extra images are ignored")
+
+        for j in range(len(image_urls)):
+            image_cells[(i + 1, IMAGE_START_COL + j)] = True
+        # 各行の画像が24枚になるまでSettingシートの画像URLで埋める
+        if placeholder_url:
+            image_urls = image_urls + [placeholder_url] * (IMAGE_COLUMNS - len(image_urls))
+
+        grid.append([title, description, sku] + image_urls)
+
+    return grid, image_cells
+
+WHITE = {'red': 1, 'green': 1, 'blue': 1}
+YELLOW = {'red': 1.0, 'green': 1.0, 'blue': 0.0}
+
+def color_request(grid_range, sheet_id, color):
+    """範囲の背景色を変更する repeatCell リクエストを作成します。"""
+    return {
+        "repeatCell": {
+            "range": to_grid_range(grid_range, sheet_id),
+            "cell": {
+                "userEnteredFormat": {
+                    "backgroundColor": color
+                }
+            },
+            "fields": "userEnteredFormat.backgroundColor"
+        }
+    }
+
+def image_color_requests(image_cells, sheet_id):
+    """値がある画像セルを矩形にまとめ、黄色に塗るリクエストを作成します。"""
+    return [
+        color_request(GridRange('AI-memo', start_row, start_row + len(values),
+                                start_col, start_col + len(values[0])), sheet_id, YELLOW)
+        for start_row, start_col, values in coalesce_blocks(image_cells)
+    ]
+
+def plan_incremental_update(existing_values, grid):
+    """AI-memo の既存の行と新しい表を SKU (C列) で比較し、更新内容を作成します。
+
+    existing_values は AI-memo!A1:AA の値 (1行目はヘッダー)、grid は build_ai_memo_grid の表です。
+    次のキーを持つ辞書を返します。SKU が空または重複している場合は None を返します。
+        removed: 削除する行番号 (1始まり) のリスト
+        changed: 削除後の行番号と grid の行番号の組のリスト
+        added:   削除後の行番号と grid の行番号の組のリスト (既存の行の後ろに追加)
+    """
+    width = IMAGE_START_COL + IMAGE_COLUMNS
+    new_rows = {}
+    for row in grid[1:]:
+        sku = row[2]
+        if not sku or sku in new_rows:
+            logging.warning(f"SKU is empty or duplicated ({sku!r}), falling back to a full rewrite")
+            return None
+        new_rows[sku] = len(new_rows) + 1  # grid の行番号
+
+    existing_rows = {}
+    removed = []
+    for row_number, row in enumerate(existing_values[1:], start=2):
+        sku = row[2] if len(row) > 2 else ''
+        if sku in new_rows and sku not in existing_rows:
+            existing_rows[sku] = (row_number, row)
         else:
-            data.append({
-                'range': f'{sheet_name}!{chr(start_col)}{i + 1}',
-                'values': [[value]]
+            removed.append(row_number)
+    # 末尾の空行は値の取得結果に含まれないため、行数は既存の最後の行までになる
+    # シートが空でも1行目はヘッダーを書き込むため、追加する行は2行目から始める
+    last_row = max(len(existing_values), 1)
+
+    removed_set = set(removed)
+    changed = []
+    for sku, (row_number, row) in existing_rows.items():
+        grid_index = new_rows[sku]
+        if (row + [''] * width)[:width] != (grid[grid_index] + [''] * width)[:width]:
+            shift = sum(1 for removed_row in removed_set if removed_row < row_number)
+            changed.append((row_number - shift, grid_index))
+
+    added = []
+    next_row = last_row - len(removed) + 1
+    for sku, grid_index in new_rows.items():
+        if sku not in existing_rows:
+            added.append((next_row, grid_index))
+            next_row += 1
+
+    return {'removed': removed, 'changed': changed, 'added': added}
+
+def apply_incremental_update(sheet_service, sheet_id, plan, grid, image_cells):
+    """plan_incremental_update の結果を AI-memo シートに書き込みます。
+
+    変更された行は AB列以降の AI の生成結果が古くなるためクリアします。
+    変更のない行はそのまま残します。
+    """
+    service = sheet_service.service.spreadsheets()
+
+    # 削除する行を下から順に削除する (連続する行は1つのリクエストにまとめる)
+    if plan['removed']:
+        delete_requests = []
+        for start_row, _, values in reversed(coalesce_blocks({(row - 1, 0): True for row in plan['removed']})):
+            delete_requests.append({
+                'deleteDimension': {
+                    'range': {
+                        'sheetId': sheet_id,
+                        'dimension': 'ROWS',
+                        'startIndex': start_row,
+                        'endIndex': start_row + len(values)
+                    }
+                }
             })
-    #logging.debug(f"Prepared batch data: {data}")
-    return data
+        service.batchUpdate(spreadsheetId=sheet_service.spreadsheet_id,
+                            body={'requests': delete_requests}).execute()
+        sheet_service.metadata.invalidate_if_structural(delete_requests)
+
+    # 変更・追加された行の A〜AA 列を書き込む
+    width = IMAGE_START_COL + IMAGE_COLUMNS
+    cells = {(0, col): value for col, value in enumerate(grid[0])}
+    rewritten_image_cells = {}
+    rewritten_rows = []
+    for row_number, grid_index in plan['changed'] + plan['added']:
+        row = (grid[grid_index] + [''] * width)[:width]
+        for col, value in enumerate(row):
+            cells[(row_number - 1, col)] = value
+            if (grid_index, col) in image_cells:
+                rewritten_image_cells[(row_number - 1, col)] = True
+        rewritten_rows.append(row_number)
+
+    service.values().batchUpdate(spreadsheetId=sheet_service.spreadsheet_id, body={
+        'valueInputOption': 'RAW',
+        'data': coalesce_cells('AI-memo', cells)
+    }).execute()
+
+    # 変更された行の古い生成結果 (AB列以降) をクリアする
+    changed_rows = {(row_number - 1, 0): True for row_number, _ in plan['changed']}
+    if changed_rows:
+        clear_ranges = [format_a1(GridRange('AI-memo', start_row, start_row + len(values), 27, None))
+                        for start_row, _, values in coalesce_blocks(changed_rows)]
+        service.values().batchClear(spreadsheetId=sheet_service.spreadsheet_id,
+                                    body={'ranges': clear_ranges}).execute()
+
+    # 書き換えた行の画像セルの色を塗り直す
+    if rewritten_rows:
+        reset_cells = {(row - 1, IMAGE_START_COL): True for row in rewritten_rows}
+        format_requests = [
+            color_request(GridRange('AI-memo', start_row, start_row + len(values), IMAGE_START_COL, width),
+                          sheet_id, WHITE)
+            for start_row, _, values in coalesce_blocks(reset_cells)
+        ] + image_color_requests(rewritten_image_cells, sheet_id)
+        service.batchUpdate(spreadsheetId=sheet_service.spreadsheet_id,
+                            body={'requests': format_requests}).execute()
+
+    logging.info(f"Incremental update: {len(plan['added'])} added, {len(plan['changed'])} changed, "
+                 f"{len(plan['removed'])} removed")
+
+def resolve_output_mode(output_mode, output_file):
+    """AI-memo の書き込み先を返します。'sheet' / 'file' / 'both' 以外の場合は ValueError を送出します。"""
+    output_mode = output_mode or ('both' if output_file else 'sheet')
+    if output_mode not in AI_MEMO_OUTPUT_MODES:
+        raise ValueError(f"Invalid AI-memo output mode {output_mode!r} (expected one of {AI_MEMO_OUTPUT_MODES})")
+    return output_mode
+
+def uses_sheets(listing_source_file, placeholder_url, output_mode):
+    """読み込み・書き込みのどちらかでスプレッドシートを使うかどうかを返します。"""
+    return not (listing_source_file and placeholder_url and output_mode == 'file')
 
 def main():
-    SERVICE_ACCOUNT_FILE = r'C:\Users\kanchi\Desktop\プログラミング\MMスクール\出品算出シート001\mmschool-unlimi-001-dc6603fc2808.json'
-    SPREADSHEET_ID = '1oNSqWAQZd-Tqg5QUsY-M-hjx1Pf9WdFgGxPIipW0sEE'
+    try:
+        output_mode = resolve_output_mode(AI_MEMO_OUTPUT_MODE, AI_MEMO_OUTPUT_FILE)
+    except ValueError as e:
+        logging.error(e)
+        return {'error': str(e)}
+    # ファイルから読み込んでファイルに書き出すだけの場合は認証もしない
+    if uses_sheets(LISTING_SOURCE_FILE, PLACEHOLDER_IMAGE_URL, output_mode):
+        sheet_service = GoogleSheetService(SERVICE_ACCOUNT_FILE, SPREADSHEET_ID)
+    else:
+        sheet_service = None
+    return run(sheet_service, output_mode=output_mode)
+
+def run(sheet_service, listing_source_file=LISTING_SOURCE_FILE, output_file=AI_MEMO_OUTPUT_FILE,
+        output_mode=AI_MEMO_OUTPUT_MODE, placeholder_url=PLACEHOLDER_IMAGE_URL):
+    """1つのスプレッドシートの出品用CSVから AI-memo シートを作成します。
 
-    sheet_service = GoogleSheetService(SERVICE_ACCOUNT_FILE, SPREADSHEET_ID)
-    
-    # スプレッドシートから値を取得
+    結果を {'rows': 行数, 'mode': 'full' / 'incremental' / 'file'} で返します。失敗した場合は {'error': 内容} を返します。
+    listing_source_file を指定した場合は出品用CSV をファイルから読み込み、
+    output_mode が 'file' / 'both' の場合は output_file に表を書き出します。
+    既定値はモジュールの設定 (MM_* 環境変数) で、MultiWorkbookRunner はワークブックごとに指定します。
+    """
+    try:
+        output_mode = resolve_output_mode(output_mode, output_file)
+    except ValueError as e:
+        logging.error(e)
+        return {'error': str(e)}
+    write_sheet = output_mode != 'file'
+    write_file = output_mode in ('file', 'both')
+    if write_file and not output_file:
+        logging.error("An output file is required when writing AI-memo to a file.")
+        return {'error': "An output file is required when writing AI-memo to a file."}
+
+    # スプレッドシートから必要な範囲を1回でまとめて取得
     ss_range_listing_csv = ['出品用CSV!AD2:AD', '出品用CSV!AE2:AE', '出品用CSV!B2:B', '出品用CSV!H2:H']
-    values_list = list(map(sheet_service.get_values, ss_range_listing_csv))
-    #logging.debug(f"Fetched values: {values_list}")
-    # AI-memoシートの全てのデータとセルの色をクリア
+    csv_header_range = '出品用CSV!AF1:1'  # AF列以降の1行目
+    setting_range = 'Setting!B2'  # 画像URL
+    ai_memo_range = 'AI-memo!A1:AA'  # 差分モードで比較する既存の行
+    ranges = []
+    if not listing_source_file:
+        ranges += ss_range_listing_csv + [csv_header_range]
+    if not placeholder_url:
+        ranges.append(setting_range)
+    if INCREMENTAL and write_sheet:
+        ranges.append(ai_memo_range)
+    snapshot = {}
+    with Metrics.stage('read'):
+        if ranges:
+            snapshot = sheet_service.batch_get_values(ranges)
+        if listing_source_file:
+            # 出品用CSV はファイルから読み込み、シートの読み込みクォータを使わない
+            try:
+                listing, csv_headers = read_listing_file(listing_source_file, LISTING_SOURCE_ENCODING)
+            except (OSError, ImportError, ValueError) as e:
+                logging.error(f"Error reading listing file {listing_source_file}: {e}")
+                return {'error': str(e)}
+            logging.info(f"Read {len(listing)} rows from {listing_source_file}")
+        else:
+            listing = SheetTable.from_column_ranges(snapshot, ss_range_listing_csv)
+            csv_headers = snapshot[csv_header_range]
+
+    # AI-memoシートの表をメモリ上で作成
+    placeholder_url = placeholder_url or get_placeholder_image_url(snapshot[setting_range])
+    with Metrics.stage('transcribe'):
+        grid, image_cells = build_ai_memo_grid(listing, csv_headers, placeholder_url)
+    logging.info(f"Built AI-memo grid with {len(grid) - 1} rows")
+
+    if write_file:
+        try:
+            with Metrics.stage('write'):
+                write_grid_file(output_file, grid)
+        except (OSError, ImportError) as e:
+            logging.error(f"Error writing AI-memo file {output_file}: {e}")
+            return {'error': str(e)}
+        logging.info(f"Wrote AI-memo grid to {output_file}")
+        if not write_sheet:
+            return {'rows': len(grid) - 1, 'mode': 'file', 'output': output_file}
+
+    # シートIDを取得
+    sheet_id = sheet_service.get_sheet_id('AI-memo')
+    if sheet_id is None:
+        logging.error("Failed to retrieve sheet ID.")
+        return {'error': "Failed to retrieve sheet ID."}
+
+    if INCREMENTAL:
+        # SKU で既存の行と比較し、追加・変更・削除された行だけを書き込む
+        with Metrics.stage('transcribe'):
+            plan = plan_incremental_update(snapshot[ai_memo_range], grid)
+        if plan is not None:
+            try:
+                with Metrics.stage('write'):
+                    apply_incremental_update(sheet_service, sheet_id, plan, grid, image_cells)
+            except Exception as e:
+                logging.error(f"Error applying incremental update to AI-memo sheet: {e}")
+                return {'error': str(e)}
+            return {'rows': len(grid) - 1, 'mode': 'incremental', 'added': len(plan['added']),
+                    'changed': len(plan['changed']), 'removed': len(plan['removed'])}
+
+    # AI-memoシートの全てのデータをクリアし、表を一括で書き込む
+    # (update_values はエラーをログに出して None を返すため、失敗を検出できるよう API を直接呼ぶ)
     try:
-        # シート全体の範囲を指定
-        clear_range = 'AI-memo'
-        clear_body = {
-            'ranges': [clear_range]
-        }
-        # データをクリア
-        sheet_service.service.spreadsheets().values().batchClear(
-            spreadsheetId=sheet_service.spreadsheet_id,
-            body=clear_body
-        ).execute()
-        
-        # セルの色をクリアするためのリクエストを作成
-        # AI-memoシートのIDを取得
-        sheet_metadata = sheet_service.service.spreadsheets().get(
-            spreadsheetId=sheet_service.spreadsheet_id
-        ).execute()
-        sheets = sheet_metadata.get('sheets', '')
-        ai_memo_sheet_id = None
-        for sheet in sheets:
-            if sheet.get("properties", {}).get("title", "") == "AI-memo":
-                ai_memo_sheet_id = sheet.get("properties", {}).get("sheetId", None)
-                break
-
-        if ai_memo_sheet_id is not None:
-            requests = [{
-                'repeatCell': {
-                    'range': {
-                        'sheetId': ai_memo_sheet_id
-                    },
-                    'cell': {
-                        'userEnteredFormat': {
-                            'backgroundColor': {
-                                'red': 1,
-                                'green': 1,
-                                'blue': 1
-                            }
-                        }
-                    },
-                    'fields': 'userEnteredFormat.backgroundColor'
-                }
-            }]
-            
-            # バッチ更新リクエストを送信
-            sheet_service.service.spreadsheets().batchUpdate(
+        with Metrics.stage('write'):
+            sheet_service.service.spreadsheets().values().batchClear(
                 spreadsheetId=sheet_service.spreadsheet_id,
-                body={'requests': requests}
+                body={'ranges': ['AI-memo']}
+            ).execute()
+            sheet_service.service.spreadsheets().values().update(
+                spreadsheetId=sheet_service.spreadsheet_id, range='AI-memo!A1',
+                valueInputOption='RAW', body={'values': grid}
             ).execute()
-        else:
-            logging.error("AI-memoシートが見つかりませんでした。")
-        
-        logging.info("Cleared all data and cell colors from AI-memo sheet")
     except Exception as e:
-        logging.error(f"Error clearing data and cell colors from AI-memo sheet: {e}")
-    # AI-memoシートの1行目に指定されたヘッダーを追加
-    headers = [
-        "日本語タイトル", "日本語説明", "SKU", "画像-01", "画像-02", "画像-03", "画像-04", "画像-05",
-        "画像-06", "画像-07", "画像-08", "画像-09", "画像-10", "画像-11", "画像-12", "画像-13",
-        "画像-14", "画像-15", "画像-16", "画像-17", "画像-18", "画像-19", "画像-20", "画像-21",
-        "画像-22", "画像-23", "画像-24", "New-Titel", "New-Discription"
-    ]
-    header_range = 'AI-memo!A1:1'  # 1行目の範囲を指定
-    sheet_service.update_values(header_range, [headers])
-
-    # 出品用CSVシートの1行目のAF列以降の値を取得
-    csv_header_range = '出品用CSV!AF1:1'  # AF列以降の1行目の範囲を指定
-    csv_headers = sheet_service.get_values(csv_header_range)
-
-    # AI-memoシートの1行目の指定されたヘッダーの後に出品用CSVシートのヘッダーを追加
-    if csv_headers and len(csv_headers) > 0:
-        combined_headers = headers + csv_headers[0]
-        combined_header_range = 'AI-memo!A1:1'  # 1行目の範囲を指定
-        sheet_service.update_values(combined_header_range, [combined_headers])
-    # AI-memoシートのA列に最初のデータを2行目から貼り付け
-    if values_list and values_list[0]:
-        range_to_update = 'AI-memo!A2:A'  # A列の2行目からの範囲を指定
-        sheet_service.update_values(range_to_update, values_list[0])
-    
-    # B列に2番目のデータを2行目から貼り付け
-    if len(values_list) > 1 and values_list[1]:
-        range_to_update = 'AI-memo!B2:B'  # B列の2行目からの範囲を指定
-        sheet_service.update_values(range_to_update, values_list[1])
-    
-    # C列に3番目のデータを2行目から貼り付け
-    if len(values_list) > 2 and values_list[2]:
-        range_to_update = 'AI-memo!C2:C'  # C列の2行目からの範囲を指定
-        sheet_service.update_values(range_to_update, values_list[2])
-    
-    # D列以降に4番目のデータを2行目から貼り付け
-    if len(values_list) > 3 and values_list[3]:
-        # 各要素がリストであることを考慮
-        split_values = [value[0].split('|') for value in values_list[3] if value and isinstance(value, list) and len(value) > 0]
-        
-        # バッチデータを準備
-        batch_data = []
-        format_requests = []
-        for row_index, row_values in enumerate(split_values, start=2):  # 2行目から開始
-            for col_index, val in enumerate(row_values, start=3):  # D列は3番目のインデックス
-                range_to_update = f'AI-memo!{chr(65 + col_index)}{row_index}:{chr(65 + col_index)}{row_index}'
-                batch_data.append({
-                    'range': range_to_update,
-                    'values': [[val]]
-                })
-                # 値があるセルに色をつけるリクエストを追加
-                format_requests.append({
-                    "repeatCell": {
-                        "range": {
-                            "sheetId": sheet_service.spreadsheet_id,
-                            "startRowIndex": row_index - 1,
-                            "endRowIndex": row_index,
-                            "startColumnIndex": col_index,
-                            "endColumnIndex": col_index + 1
-                        },
-                        "cell": {
-                            "userEnteredFormat": {
-                                "backgroundColor": {
-                                    "red": 1.0,
-                                    "green": 1.0,
-                                    "blue": 0.0
-                                }
-                            }
-                        },
-                        "fields": "userEnteredFormat.backgroundColor"
-                    }
-                })
-        
-        # バッチで更新
-        if batch_data:
-            # Google Sheets APIのバッチ更新を実行
-            body = {
-                'valueInputOption': 'RAW',
-                'data': batch_data
-            }
-            sheet_service.service.spreadsheets().values().batchUpdate(
+        logging.error(f"Error writing AI-memo sheet: {e}")
+        return {'error': str(e)}
+
+    # セルの色をクリアし、値がある画像セルに色をつける
+    format_requests = [color_request(GridRange('AI-memo', None, None, None, None), sheet_id, WHITE)]
+    format_requests += image_color_requests(image_cells, sheet_id)
+
+    try:
+        with Metrics.stage('write'):
+            sheet_service.service.spreadsheets().batchUpdate(
                 spreadsheetId=sheet_service.spreadsheet_id,
-                body=body
+                body={"requests": format_requests}
             ).execute()
-        
-        # セルの色を変更するリクエストを実行
-        if format_requests:
-            # シートIDを整数として取得
-            sheet_id = sheet_service.get_sheet_id('AI-memo')
-            if sheet_id is not None:
-                # シートIDをリクエストに追加
-                for request in format_requests:
-                    request['repeatCell']['range']['sheetId'] = sheet_id
-
-                # バッチ更新を実行
-                sheet_service.service.spreadsheets().batchUpdate(
-                    spreadsheetId=sheet_service.spreadsheet_id,
-                    body={"requests": format_requests}
-                ).execute()
-            else:
-                logging.error("Failed to retrieve sheet ID for formatting requests.")
-    
-    # シートIDを取得
-    sheet_id = sheet_service.get_sheet_id('AI-memo')
-    if sheet_id is None:
-        logging.error("Failed to retrieve sheet ID.")
-        exit()
-
-    # D列2行目からAA列までのデータを取得
-    range_to_fetch = 'AI-memo!D2:AA'
-    existing_values = sheet_service.get_values(range_to_fetch)
-    logging.debug(f"Existing values: {existing_values}")
-
-    # SettingシートのB2列の画像URLを取得
-    setting_values = sheet_service.get_values('Setting!B2')
-    
-    if setting_values and len(setting_values) > 0 and len(setting_values[0]) > 0:
-        # 取得した値をGoogle DriveのURLから画像IDに変換
-        drive_url = setting_values[0][0]  # 取得した値の最初の要素を使用
-        try:
-            image_id = drive_url.split('/d/')[1].split('/')[0]  # URLから画像IDを抽出
-            image_url = f"https://lh3.googleusercontent.com/d/{image_id}"
-            logging.debug(f"Image URL: {image_url}")
-            
-            # 各行の要素数が24になるまで画像URLを追加
-            updated_values = False
-            for row_index, row in enumerate(existing_values):
-                while len(row) < 24:
-                    row.append(image_url)
-                    updated_values = True
-            
-            # 更新するデータを準備
-            if updated_values:
-                logging.debug(f"Updated values: {existing_values}")
-                try:
-                    sheet_service.update_values(range_to_fetch, existing_values)
-                except Exception as e:
-                    logging.error(f"Error updating sheet with image URLs: {e}")
-        except IndexError:
-            logging.error("Invalid Google Drive URL format.")
-    else:
-        logging.error("No valid image URL found in Setting!B2.")
+        logging.info("Updated cell colors of AI-memo sheet")
+    except Exception as e:
+        logging.error(f"Error updating cell colors of AI-memo sheet: {e}")
+    return {'rows': len(grid) - 1, 'mode': 'full'}
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # 処理段階ごとの時間と API 呼び出し回数の集計を出力
+        Metrics.log_summary()
@@ -0,0 +1,126 @@
+import csv
+import os
+
+from SheetTable import SheetTable
+
+# 出品用CSV シートの元になった CSV / Parquet ファイルを Sheets API を使わずに読み込み、書き出す
+# シートから読む場合 ('出品用CSV!AD2:AD' などの範囲) と同じ SheetTable と AF1:1 のヘッダー行を返すため、
+# 転記の処理はどちらから読んだかを区別しない
+# CSV は1行ずつ読んで必要な4列だけを残し、Parquet は pyarrow でファイルをメモリマップして必要な列だけを読むため、
+# 大きなカタログでもメモリ使用量は4列分で済む
+#
+# ファイルの列はシートと同じ並び (1行目がヘッダー、B 列が2列目) である必要があります。
+
+LISTING_SHEET = '出品用CSV'
+LISTING_COLUMNS = [29, 30, 1, 7]  # AD (タイトル)・AE (説明)・B (SKU)・H (画像) 列
+HEADER_START_COL = 31  # AF 列以降の1行目が商品情報のヘッダー
+CSV_ENCODING = 'utf-8-sig'  # Excel で保存した CSV の BOM を読み飛ばす
+PARQUET_BATCH_SIZE = 65536  # 1回に読み込む行数
+
+
+def is_parquet(path):
+    return os.path.splitext(path)[1].lower() in ('.parquet', '.pq')
+
+
+def _import_parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("pyarrow is required to read or write Parquet files (pip install pyarrow)") from None
+    return pyarrow, pyarrow.parquet
+
+
+def _cell(value):
+    """Parquet の値をシートから読んだ場合と同じ文字列にします (欠損値は '')。"""
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+
+def _trim(columns, row_count):
+    """末尾の4列とも空の行を除きます (Sheets API は列の末尾の空のセルを返さないため)。"""
+    return [column[:row_count] for column in columns]
+
+
+def _read_csv(path, encoding):
+    # 商品説明は csv の既定の上限 (131072 文字) を超えることがあるため上限を上げる
+    csv.field_size_limit(2 ** 31 - 1)
+    columns = [[] for _ in LISTING_COLUMNS]
+    row_count = 0
+    with open(path, 'r', encoding=encoding, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        for row in reader:
+            width = len(row)
+            filled = False
+            for values, col in zip(columns, LISTING_COLUMNS):
+                value = row[col] if col < width else ''
+                values.append(value)
+                filled = filled or value != ''
+            if filled:
+                row_count = len(columns[0])
+    return _trim(columns, row_count), header
+
+
+def _read_parquet(path):
+    _, parquet = _import_parquet()
+    parquet_file = parquet.ParquetFile(path, memory_map=True)
+    header = [str(name) for name in parquet_file.schema_arrow.names]
+    names = [header[col] if col < len(header) else None for col in LISTING_COLUMNS]
+    columns = [[] for _ in LISTING_COLUMNS]
+    row_count = 0
+    for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_SIZE,
+                                           columns=[name for name in names if name is not None]):
+        data = batch.to_pydict()
+        for values, name in zip(columns, names):
+            if name is None:
+                values.extend([''] * batch.num_rows)
+            else:
+                values.extend(_cell(value) for value in data[name])
+        for row in range(len(columns[0]) - 1, row_count - 1, -1):
+            if any(values[row] != '' for values in columns):
+                row_count = row + 1
+                break
+    return _trim(columns, row_count), header
+
+
+def read_listing_file(path, encoding=CSV_ENCODING):
+    """出品用CSV の CSV / Parquet ファイルを読み込み、(SheetTable, AF1:1 のヘッダー行) を返します。
+
+    SheetTable の列は AD・AE・B・H 列の順で、シートから読んだ場合と同じく2行目から始まります。
+    """
+    columns, header = _read_parquet(path) if is_parquet(path) else _read_csv(path, encoding)
+    headers = list(header[HEADER_START_COL:])
+    while headers and headers[-1] == '':
+        headers.pop()
+    table = SheetTable(LISTING_SHEET, columns, start_row=1, sheet_cols=LISTING_COLUMNS)
+    return table, [headers] if headers else []
+
+
+def write_grid_file(path, grid, encoding=CSV_ENCODING):
+    """表 (1行目がヘッダー) を CSV / Parquet ファイルに書き出します。
+
+    途中で失敗しても前回のファイルが壊れないように、一時ファイルに書いてから置き換えます。
+    一時ファイルの名前は書き込みごとに変え、同じファイルに同時に書き出しても互いの一時ファイルを壊さないようにします。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.{os.urandom(4).hex()}.tmp'
+    try:
+        if is_parquet(path):
+            pyarrow, parquet = _import_parquet()
+            header = grid[0] if grid else []
+            width = max([len(row) for row in grid] + [0])
+            names = [str(header[col]) if col < len(header) and header[col] != '' else f'column_{col + 1}'
+                     for col in range(width)]
+            arrays = [pyarrow.array([_cell(row[col]) if col < len(row) else '' for row in grid[1:]],
+                                    type=pyarrow.string()) for col in range(width)]
+            parquet.write_table(pyarrow.Table.from_arrays(arrays, names=names), temp_path)
+        else:
+            with open(temp_path, 'w', encoding=encoding, newline='') as f:
+                csv.writer(f).writerows(grid)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
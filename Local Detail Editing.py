@@ -1,9 +1,9 @@
 import logging
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
+from LogConfig import setup_logging, summarize
+from SheetClient import SCOPES, build_sheets_service, load_credentials
 
 # ログの設定
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 
 # 定数の設定
 SERVICE_ACCOUNT_FILE = r'C:\Users\kanchi\Desktop\プログラミング\MMスクール\出品算出シート001\mmschool-unlimi-001-dc6603fc2808.json'
@@ -11,20 +11,19 @@ SPREADSHEET_ID = '1oNSqWAQZd-Tqg5QUsY-M-hjx1Pf9WdFgGxPIipW0sEE'
 
 class GoogleSheetService:
     def __init__(self, service_account_file, spreadsheet_id):
-        self.scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        self.credentials = service_account.Credentials.from_service_account_file(
-            service_account_file, scopes=self.scopes)
-        self.service = build('sheets', 'v4', credentials=self.credentials)
+        self.scopes = SCOPES
+        self.credentials = load_credentials(service_account_file, self.scopes)
+        self.service = build_sheets_service(self.credentials)
         self.spreadsheet_id = spreadsheet_id
         logging.debug(f"Initialized GoogleSheetService with spreadsheet ID: {spreadsheet_id}")
 
     def get_values(self, range_name):
         try:
-            logging.debug(f"Fetching values from range: {range_name}")
+            logging.debug("Fetching values from range: %s", range_name)
             result = self.service.spreadsheets().values().get(
                 spreadsheetId=self.spreadsheet_id, range=range_name).execute()
             values = result.get('values', [])
-            logging.debug(f"Fetched values: {values}")
+            logging.debug("Fetched %s from %s", summarize(values), range_name)
             return values
         except Exception as e:
             logging.error(f"Error fetching values from range {range_name}: {e}")
@@ -38,7 +37,7 @@ class GoogleSheetService:
             result = self.service.spreadsheets().values().update(
                 spreadsheetId=self.spreadsheet_id, range=range_name,
                 valueInputOption='RAW', body=body).execute()
-            logging.debug(f"Updated range {range_name} with values: {values}")
+            logging.debug("Updated range %s with %s", range_name, summarize(values))
             return result
         except Exception as e:
             logging.error(f"Error updating values in range {range_name}: {e}")
@@ -52,7 +51,7 @@ class GoogleSheetService:
             }
             result = self.service.spreadsheets().values().batchUpdate(
                 spreadsheetId=self.spreadsheet_id, body=body).execute()
-            logging.debug(f"Batch update result: {result}")
+            logging.debug("Batch update result: %s", summarize(result))
             return result
         except Exception as e:
             logging.error(f"Error during batch update: {e}")
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+
+# 各スクリプト共通のログ設定
+# 大きなシートの値やリクエスト本文をそのまま出力すると、その整形と書き込みだけで時間とメモリを使うため、
+# 本番 (MM_LOG_MODE=production) では INFO 以上・1行の長さを制限・同じメッセージを間引いて、
+# 1回の呼び出しあたりのログの量が値の大きさによらず一定になるようにする
+#
+# 環境変数:
+#   MM_LOG_MODE     debug (既定) / production
+#   MM_LOG_LEVEL    ルートのレベル (例: INFO)
+#   MM_LOG_LEVELS   モジュールごとのレベル (例: "SheetQuota=WARNING,RangeCache=INFO")
+#   MM_LOG_FORMAT   text / json (1行1つの JSON)
+
+LOG_PRESETS = {
+    'debug': {'level': 'DEBUG', 'format': 'text', 'max_length': 20000, 'sample_first': 0, 'sample_every': 1},
+    'production': {'level': 'INFO', 'format': 'json', 'max_length': 500, 'sample_first': 20, 'sample_every': 100},
+}
+LOG_MODE = os.environ.get('MM_LOG_MODE', 'debug')
+_preset = LOG_PRESETS.get(LOG_MODE, LOG_PRESETS['debug'])
+LOG_LEVEL = os.environ.get('MM_LOG_LEVEL', _preset['level']).upper()
+LOG_MODULE_LEVELS = os.environ.get('MM_LOG_LEVELS', '')
+LOG_FORMAT = os.environ.get('MM_LOG_FORMAT', _preset['format'])
+LOG_MAX_LENGTH = int(os.environ.get('MM_LOG_MAX_LENGTH', _preset['max_length']))  # メッセージの最大文字数
+LOG_SAMPLE_FIRST = int(os.environ.get('MM_LOG_SAMPLE_FIRST', _preset['sample_first']))  # 間引く前にそのまま出す件数
+LOG_SAMPLE_EVERY = int(os.environ.get('MM_LOG_SAMPLE_EVERY', _preset['sample_every']))  # その後は N 件に1件だけ出す
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+_SECRET_PATTERNS = [
+    (re.compile(r'sk-[A-Za-z0-9_\-]{4,}([A-Za-z0-9]{4})'), r'sk-...\1'),
+    (re.compile(r'(Bearer\s+)[A-Za-z0-9._~+/\-]+=*'), r'\1[REDACTED]'),
+    (re.compile(r'ya29\.[A-Za-z0-9._\-]+'), '[REDACTED]'),
+    (re.compile(r'-----BEGIN [A-Z ]*PRIVATE KEY-----.*?-----END [A-Z ]*PRIVATE KEY-----', re.DOTALL),
+     '[REDACTED PRIVATE KEY]'),
+]
+
+
+def redact(text):
+    """API キー・アクセストークン・秘密鍵を伏せた文字列を返します。"""
+    for pattern, replacement in _SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def mask_secret(secret):
+    """ログやメトリクスのラベルに出すために、キーの末尾4文字だけを残します。"""
+    return f'...{secret[-4:]}' if secret else 'none'
+
+
+def describe(value):
+    """値の中身ではなく、大きさ (行数・列数・件数) を表す文字列を返します。"""
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(row, (list, tuple)) for row in value):
+            return f'{len(value)} rows x {max(len(row) for row in value)} cols'
+        return f'{len(value)} items'
+    if isinstance(value, dict):
+        # API の応答は件数などの短い値だけを残す (例: totalUpdatedCells)
+        fields = [f'{key}={item}' for key, item in value.items()
+                  if isinstance(item, (int, float, str)) and len(str(item)) <= 64]
+        nested = len(value) - len(fields)
+        return '{' + ', '.join(fields) + (f', +{nested} nested' if nested else '') + '}'
+    text = str(value)
+    return text if len(text) <= 64 else f'{text[:64]}... ({len(text)} chars)'
+
+
+class summarize:
+    """describe をログの出力時まで遅らせます。例: logging.debug("Fetched %s", summarize(values))"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return describe(self.value)
+
+
+class ModuleLevelFilter(logging.Filter):
+    """モジュール (ファイル名) ごとのレベルより低いレコードを捨てます。指定のないモジュールは default です。"""
+
+    def __init__(self, levels, default=logging.DEBUG):
+        super().__init__()
+        self.levels = levels
+        self.default = default
+
+    def filter(self, record):
+        return record.levelno >= self.levels.get(record.module, self.default)
+
+
+class SamplingFilter(logging.Filter):
+    """WARNING 未満のログを出力した場所 (モジュールと行) ごとに数え、最初の first 件の後は every 件に1件だけ通します。"""
+
+    def __init__(self, first=LOG_SAMPLE_FIRST, every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.first = first
+        self.every = max(1, every)
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.every == 1 or record.levelno >= logging.WARNING or getattr(record, 'keep_full', False):
+            return True
+        key = (record.module, record.lineno)
+        with self.lock:
+            count = self.counts[key] = self.counts.get(key, 0) + 1
+        if count <= self.first:
+            return True
+        if (count - self.first) % self.every:
+            return False
+        record.suppressed = self.every - 1
+        return True
+
+
+class SafeFormatter(logging.Formatter):
+    """メッセージを LOG_MAX_LENGTH 文字に切り詰め、秘密情報を伏せて出力します。
+
+    実行の最後の集計など、切り詰めたくないメッセージは extra={'keep_full': True} を付けて出力します。
+    """
+
+    def __init__(self, fmt=TEXT_FORMAT, max_length=LOG_MAX_LENGTH, structured=False):
+        super().__init__(fmt)
+        self.max_length = max_length
+        self.structured = structured
+
+    def message(self, record):
+        # 切り詰めでキーの途中が残らないように、先に秘密情報を伏せる
+        message = redact(record.getMessage())
+        if len(message) > self.max_length and not getattr(record, 'keep_full', False):
+            message = f'{message[:self.max_length]}... ({len(message) - self.max_length} chars truncated)'
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            message += f' ({suppressed} similar messages suppressed)'
+        return message
+
+    def format(self, record):
+        message = self.message(record)
+        if self.structured:
+            entry = {'time': self.formatTime(record), 'level': record.levelname,
+                     'module': record.module, 'message': message}
+            if record.exc_info:
+                entry['exception'] = self.formatException(record.exc_info)
+            return redact(json.dumps(entry, ensure_ascii=False))
+
+        record = logging.makeLogRecord({**record.__dict__, 'msg': message, 'args': None})
+        return redact(super().format(record))
+
+
+def parse_module_levels(value):
+    """"SheetQuota=WARNING,RangeCache=INFO" を {モジュール名: レベル} に変換します。"""
+    levels = {}
+    for item in value.split(','):
+        module, _, level = item.partition('=')
+        level = logging.getLevelName(level.strip().upper())
+        if module.strip() and isinstance(level, int):
+            levels[module.strip()] = level
+    return levels
+
+
+def setup_logging(level=LOG_LEVEL, module_levels=LOG_MODULE_LEVELS, log_format=LOG_FORMAT):
+    """ルートロガーにハンドラーを設定します。logging.basicConfig の代わりに各スクリプトの先頭で呼びます。"""
+    root = logging.getLogger()
+    if any(getattr(handler, 'mm_logging', False) for handler in root.handlers):
+        return
+    levels = parse_module_levels(module_levels) if isinstance(module_levels, str) else dict(module_levels)
+    root_level = logging.getLevelName(level) if isinstance(level, str) else level
+    if not isinstance(root_level, int):
+        root_level = logging.DEBUG
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.mm_logging = True
+    handler.setFormatter(SafeFormatter(structured=log_format == 'json'))
+    handler.addFilter(ModuleLevelFilter(levels, root_level))
+    handler.addFilter(SamplingFilter())
+    root.addHandler(handler)
+    # あるモジュールだけ低いレベルにした場合も、そのレコードが作られるようにルートは一番低いレベルにする
+    root.setLevel(min([root_level] + list(levels.values())))
@@ -0,0 +1,160 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# 各スクリプト・FastAPI サーバーで共通の計測 (処理段階ごとの時間と、API 呼び出し回数などのカウンター)
+# バッチスクリプトは終了時に log_summary で集計を出力し、FastAPI サーバーは /metrics で Prometheus 形式で公開する
+
+METRIC_PREFIX = 'mm'
+TIMING_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+logger = logging.getLogger('metrics')
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_key, extra=()):
+    pairs = list(label_key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+class Metrics:
+    # プロセス全体で共有する集計 (スレッドからも asyncio からも記録できる)
+    lock = threading.Lock()
+    counters = {}  # (名前, ラベル) -> 値
+    timings = {}  # (処理段階, ラベル) -> [回数, 合計秒, 最大秒, バケットごとの回数]
+    started_at = time.time()
+
+    @classmethod
+    def count(cls, name, value=1, **labels):
+        """カウンターに value を加えます。例: Metrics.count('openai_requests', status=429)"""
+        key = (name, _label_key(labels))
+        with cls.lock:
+            cls.counters[key] = cls.counters.get(key, 0) + value
+
+    @classmethod
+    def observe(cls, stage, seconds, **labels):
+        """処理段階 stage にかかった時間を記録します。"""
+        key = (stage, _label_key(labels))
+        with cls.lock:
+            timing = cls.timings.get(key)
+            if timing is None:
+                timing = cls.timings[key] = [0, 0.0, 0.0, [0] * len(TIMING_BUCKETS)]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+            index = bisect.bisect_left(TIMING_BUCKETS, seconds)
+            if index < len(TIMING_BUCKETS):
+                timing[3][index] += 1
+
+    @classmethod
+    @contextmanager
+    def stage(cls, stage, **labels):
+        """with ブロックの処理時間を stage として記録します。例外が発生した場合も記録します。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.observe(stage, time.perf_counter() - start, **labels)
+
+    @classmethod
+    def reset(cls):
+        with cls.lock:
+            cls.counters = {}
+            cls.timings = {}
+            cls.started_at = time.time()
+
+    @classmethod
+    def render_prometheus(cls):
+        """Prometheus のテキスト形式で全ての計測値を返します。"""
+        with cls.lock:
+            counters = sorted(cls.counters.items())
+            timings = sorted((key, [value[0], value[1], value[2], list(value[3])])
+                             for key, value in cls.timings.items())
+
+        lines = []
+        name = f'{METRIC_PREFIX}_stage_seconds'
+        lines.append(f'# HELP {name} Time spent in each processing stage.')
+        lines.append(f'# TYPE {name} histogram')
+        for (stage, labels), (count, total, _, buckets) in timings:
+            label_key = (('stage', stage),) + labels
+            cumulative = 0
+            for bound, bucket_count in zip(TIMING_BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{_format_labels(label_key, [("le", str(bound))])} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(label_key, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{_format_labels(label_key)} {total}')
+            lines.append(f'{name}_count{_format_labels(label_key)} {count}')
+
+        declared = set()
+        for (counter, labels), value in counters:
+            name = f'{METRIC_PREFIX}_{counter}_total'
+            if name not in declared:
+                lines.append(f'# TYPE {name} counter')
+                declared.add(name)
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        lines.append(f'# TYPE {METRIC_PREFIX}_uptime_seconds gauge')
+        lines.append(f'{METRIC_PREFIX}_uptime_seconds {time.time() - cls.started_at}')
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def summary(cls):
+        """処理段階ごとの合計時間 (多い順) とカウンターの一覧を文字列で返します。"""
+        with cls.lock:
+            counters = sorted(cls.counters.items())
+            timings = sorted(cls.timings.items(), key=lambda item: -item[1][1])
+
+        lines = [f'Run summary ({time.time() - cls.started_at:.1f}s)']
+        for (stage, labels), (count, total, maximum, _) in timings:
+            label_text = _format_labels(labels)
+            lines.append(f'  {stage}{label_text}: {count} calls, {total:.2f}s total, '
+                         f'{total / count * 1000:.1f}ms avg, {maximum * 1000:.1f}ms max')
+        for (counter, labels), value in counters:
+            lines.append(f'  {counter}{_format_labels(labels)}: {value}')
+        return '\n'.join(lines)
+
+    @classmethod
+    def log_summary(cls):
+        logger.info(cls.summary(), extra={'keep_full': True})
+
+
+class MetricsMiddleware:
+    """FastAPI (ASGI) のエンドポイントごとの処理時間とステータスを記録するミドルウェアです。
+
+    BaseHTTPMiddleware と違い receive をそのまま渡すため、切断の検知やストリーミングに影響しません。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = {'code': 500}
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # パスではなくルートのテンプレートをラベルにする (範囲ごとにラベルが増えないように)
+            endpoint = getattr(scope.get('route'), 'path', None) or 'unmatched'
+            Metrics.observe('endpoint', time.perf_counter() - start, endpoint=endpoint)
+            Metrics.count('http_requests', endpoint=endpoint, status=status['code'])
@@ -0,0 +1,196 @@
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ListingDataTranscription
+from GenerationCache import GenerationCache
+from ImageCache import ThumbnailCache
+from LogConfig import setup_logging
+from Metrics import Metrics
+from SheetClient import SCOPES, load_credentials
+from SheetQuota import FairQuotaScheduler, FairShare, QuotaScheduler
+
+# 複数のスプレッドシート (受講生・クライアントのワークブック) に転記と AI 生成をまとめて実行するランナー
+# 認証情報・画像取得の接続プール・生成結果キャッシュ・OpenAI キーの残量は全てのワークブックで共有し、
+# Sheets API のクォータは FairShare でトークンを待っているワークブックに公平に分ける
+# 全体の時間はワークブックの数ではなく、クォータ (と OpenAI のレート制限) で決まる
+#
+# 使い方:
+#     python MultiWorkbookRunner.py workbooks.json --workers 4 --output results.json
+#
+# マニフェスト (JSON):
+#     {
+#       "service_account_file": "...",          省略時は MM_SERVICE_ACCOUNT_FILE / スクリプトの既定値
+#       "stages": ["transcription", "ai"],      省略時は両方 (ワークブックごとにも指定できる)
+#       "workbooks": [
+#         {"spreadsheet_id": "...", "name": "受講生A"},
+#         {"spreadsheet_id": "...", "stages": ["ai"]},
+#         {"spreadsheet_id": "...", "listing_source_file": "a.csv", "output_file": "a-memo.parquet",
+#          "output_mode": "both", "placeholder_url": "..."},
+#         "1oNSqWAQZd-..."                       ID だけでもよい
+#       ]
+#     }
+# listing_source_file / output_file / output_mode / placeholder_url は転記の入出力 (ListingDataTranscription.run の引数) で、
+# 省略した項目は MM_* 環境変数の設定を使う
+
+setup_logging()
+
+AI_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'AI to Create Title Description ItemDetails.py')
+STAGES = ('transcription', 'ai')
+TRANSCRIPTION_OPTIONS = ('listing_source_file', 'output_file', 'output_mode', 'placeholder_url')
+WORKERS = int(os.environ.get('MM_RUNNER_WORKERS', 4))  # 同時に処理するワークブック数
+
+
+def load_ai_script():
+    """ファイル名に空白を含む AI スクリプトをモジュールとして読み込みます。"""
+    spec = importlib.util.spec_from_file_location('ai_item_details', AI_SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_manifest(path):
+    """マニフェストを読み込み、(サービスアカウントのファイル, ワークブックのリスト) を返します。"""
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {'workbooks': manifest}
+
+    default_stages = manifest.get('stages', list(STAGES))
+    workbooks = []
+    output_files = {}
+    for entry in manifest.get('workbooks', []):
+        if isinstance(entry, str):
+            entry = {'spreadsheet_id': entry}
+        stages = entry.get('stages', default_stages)
+        unknown = [stage for stage in stages if stage not in STAGES]
+        if unknown:
+            raise ValueError(f"Unknown stages {unknown} for {entry['spreadsheet_id']}")
+        options = {key: entry[key] for key in TRANSCRIPTION_OPTIONS if key in entry}
+        if 'output_mode' in options:
+            ListingDataTranscription.resolve_output_mode(options['output_mode'], options.get('output_file'))
+        # 同じファイルに複数のワークブックの AI-memo を書き出すと、後に終わった方で上書きされる
+        output_file = options.get('output_file')
+        if output_file:
+            output_path = os.path.abspath(output_file)
+            if output_path in output_files:
+                raise ValueError(f"{entry['spreadsheet_id']} and {output_files[output_path]} "
+                                 f"write to the same file {output_file}")
+            output_files[output_path] = entry['spreadsheet_id']
+        workbooks.append({
+            'spreadsheet_id': entry['spreadsheet_id'],
+            'name': entry.get('name') or entry['spreadsheet_id'],
+            'stages': [stage for stage in STAGES if stage in stages],  # 転記 → AI 生成の順に実行する
+            'transcription': options,
+        })
+    service_account_file = manifest.get('service_account_file') or ListingDataTranscription.SERVICE_ACCOUNT_FILE
+    return service_account_file, workbooks
+
+
+class WorkbookRunner:
+    def __init__(self, service_account_file):
+        self.credentials = load_credentials(service_account_file, SCOPES)
+        self.scheduler = QuotaScheduler.for_credentials(self.credentials)
+        self.share = FairShare()
+        self.ai = load_ai_script()
+        self.cache = GenerationCache() if self.ai.USE_GENERATION_CACHE else None
+        if self.cache is not None:
+            self.cache.evict()
+        # 同じキーを使うワークブックの間でキーごとの残量・休止を共有する
+        self.key_states = {}
+        self.key_lock = threading.Lock()
+
+    def make_key_pool(self, api_keys):
+        return self.ai.OpenAIKeyPool(api_keys, states=self.key_states, lock=self.key_lock)
+
+    def run_stage(self, stage, workbook, scheduler):
+        spreadsheet_id = workbook['spreadsheet_id']
+        if stage == 'transcription':
+            sheet_service = ListingDataTranscription.GoogleSheetService(
+                None, spreadsheet_id, credentials=self.credentials, scheduler=scheduler)
+            return ListingDataTranscription.run(sheet_service, **workbook.get('transcription', {}))
+        sheet_service = self.ai.GoogleSheetService(
+            None, spreadsheet_id, credentials=self.credentials, scheduler=scheduler)
+        try:
+            return self.ai.run(sheet_service, cache=self.cache, make_key_pool=self.make_key_pool)
+        finally:
+            # 取得した画像の結果はワークブックごとに忘れる (サムネイルはディスクのキャッシュに残る)
+            self.ai.ImageService.reset()
+
+    def run_workbook(self, workbook):
+        """1つのワークブックの各段階を実行し、段階ごとの結果と時間を返します。"""
+        name = workbook['name']
+        threading.current_thread().name = name
+        scheduler = FairQuotaScheduler(self.scheduler, self.share, workbook['spreadsheet_id'])
+        result = {'name': name, 'spreadsheet_id': workbook['spreadsheet_id'], 'stages': {}}
+        start = time.perf_counter()
+        for stage in workbook['stages']:
+            stage_start = time.perf_counter()
+            try:
+                outcome = dict(self.run_stage(stage, workbook, scheduler) or {})
+            except Exception as e:
+                logging.error(f"{name}: {stage} failed: {e}")
+                outcome = {'error': str(e)}
+            outcome['seconds'] = round(time.perf_counter() - stage_start, 3)
+            result['stages'][stage] = outcome
+            if 'error' in outcome:
+                break  # 転記に失敗したワークブックでは AI 生成を行わない
+        result['ok'] = all('error' not in outcome for outcome in result['stages'].values())
+        result['seconds'] = round(time.perf_counter() - start, 3)
+        logging.info(f"{name}: {'done' if result['ok'] else 'failed'} in {result['seconds']}s {result['stages']}")
+        return result
+
+    def run(self, workbooks, workers=WORKERS):
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(workbooks)))) as executor:
+            return list(executor.map(self.run_workbook, workbooks))
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+        self.ai.ImageService.shutdown()
+        if self.ai.USE_IMAGE_CACHE:
+            ThumbnailCache().evict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='複数のスプレッドシートに転記と AI 生成を実行します')
+    parser.add_argument('manifest', help='ワークブックの一覧 (JSON)')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='同時に処理するワークブック数')
+    parser.add_argument('--output', help='ワークブックごとの結果を保存する JSON ファイル')
+    args = parser.parse_args()
+
+    service_account_file, workbooks = load_manifest(args.manifest)
+    if not workbooks:
+        logging.error("No workbooks in the manifest.")
+        return
+
+    runner = WorkbookRunner(service_account_file)
+    start = time.perf_counter()
+    try:
+        results = runner.run(workbooks, args.workers)
+    finally:
+        runner.close()
+
+    report = {
+        'seconds': round(time.perf_counter() - start, 3),
+        'workbooks': len(results),
+        'failed': [result['name'] for result in results if not result['ok']],
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        Metrics.log_summary()
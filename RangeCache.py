@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from Metrics import Metrics
+from SheetRange import format_a1, parse_a1, ranges_overlap
+
+# FastAPI サーバーで読み込んだ範囲の値をメモリに保存するキャッシュ
+# キーは正規化したA1表記 ('Setting!F1:F' と "'setting'!f1:F" は同じキー、シート名は大文字・小文字を区別しない)
+# 書き込みと重なる範囲は削除し、シート上で直接編集された値は RANGE_CACHE_TTL 秒後に反映される
+
+RANGE_CACHE_TTL = 30  # 秒
+RANGE_CACHE_MAX_ENTRIES = 1000
+
+
+def make_etag(values):
+    """値から ETag を作成します。"""
+    source = json.dumps(values, ensure_ascii=False, separators=(',', ':'))
+    return '"' + hashlib.sha1(source.encode('utf-8')).hexdigest() + '"'
+
+
+def _opaque_tag(tag):
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match ヘッダー (カンマ区切りの ETag のリストまたは '*') に etag が含まれるかどうかを返します。
+
+    GET の比較は弱い比較のため、W/ の付いた ETag も同じ値として扱います。
+    """
+    if not if_none_match or not etag:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    if '*' in tags:
+        return True
+    return _opaque_tag(etag) in {_opaque_tag(tag) for tag in tags}
+
+
+class RangeCache:
+    def __init__(self, ttl=RANGE_CACHE_TTL, max_entries=RANGE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # キー -> (GridRange, 値, ETag, 有効期限)
+        self.pending = {}  # キー -> 読み込み中のタスク
+        self.generation = 0  # 書き込みのたびに増やし、読み込み中に書き込まれた値は保存しない
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(range_name):
+        """(キー, GridRange) を返します。A1表記として解釈できない場合は (None, None) です。"""
+        try:
+            grid = parse_a1(range_name)
+        except ValueError:
+            return None, None
+        key_grid = grid._replace(sheet=grid.sheet.casefold()) if grid.sheet else grid
+        return format_a1(key_grid), grid
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[3] <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, grid, values, generation):
+        entry = (grid, values, make_etag(values), time.monotonic() + self.ttl)
+        if generation != self.generation:
+            # 読み込み中に重なる範囲が書き込まれた可能性があるため保存しない
+            return entry
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    async def get_or_fetch(self, range_name, fetch):
+        """キャッシュされた (値, ETag) を返し、なければ fetch() で読み込みます。
+
+        同じ範囲を同時に読み込む場合は1回の読み込みを共有します。
+        """
+        key, grid = self.normalize(range_name)
+        if key is None:
+            values = await fetch()
+            return values, make_etag(values)
+
+        entry = self.get(key)
+        if entry is not None:
+            self.record(hits=1)
+            return entry[1], entry[2]
+
+        self.record(misses=1)
+        task = self.pending.get(key)
+        if task is None:
+            generation = self.generation
+
+            async def load():
+                try:
+                    values = await fetch()
+                    return self.put(key, grid, values, generation)
+                finally:
+                    self.pending.pop(key, None)
+
+            task = asyncio.ensure_future(load())
+            self.pending[key] = task
+        # 呼び出し元がキャンセルされても、同じ範囲を待っている他の呼び出し元の読み込みは続ける
+        entry = await asyncio.shield(task)
+        return entry[1], entry[2]
+
+    def invalidate(self, grids):
+        """GridRange のリストと重なるキャッシュを削除し、削除した件数を返します。"""
+        self.generation += 1
+        removed = [key for key, entry in self.entries.items()
+                   if any(ranges_overlap(entry[0], grid) for grid in grids)]
+        for key in removed:
+            del self.entries[key]
+        if removed:
+            logging.debug("Invalidated %d cached ranges", len(removed))
+        return len(removed)
+
+    def invalidate_ranges(self, range_names):
+        """A1表記の範囲と重なるキャッシュを削除します。解釈できない範囲がある場合は全て削除します。"""
+        grids = []
+        for range_name in range_names:
+            key, grid = self.normalize(range_name)
+            if grid is None:
+                self.generation += 1
+                count = len(self.entries)
+                self.entries.clear()
+                return count
+            grids.append(grid)
+        return self.invalidate(grids)
+
+    def record(self, hits=0, misses=0):
+        """ヒット・ミスの回数を数え、/metrics 用のカウンターにも加えます。"""
+        self.hits += hits
+        self.misses += misses
+        if hits:
+            Metrics.count('range_cache_lookups', hits, result='hit')
+        if misses:
+            Metrics.count('range_cache_lookups', misses, result='miss')
+
+    def stats(self):
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
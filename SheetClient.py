@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from SheetQuota import QuotaScheduler, make_request_builder
+
+# Google Sheets API の認証・サービス作成をまとめたモジュール
+# googleapiclient / google.auth は import が重いため、必要になった時点で読み込む
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+TOKEN_CACHE_DIR = os.environ.get(
+    'MM_TOKEN_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'mm-school', 'tokens'))
+TOKEN_EXPIRY_MARGIN = timedelta(minutes=5)  # 期限切れ直前のトークンは使わない
+# ローカルの代替サーバー (benchmarks/fake_sheets.py) を使う場合は 'http://127.0.0.1:8200/' などを指定する
+SHEETS_API_ENDPOINT = os.environ.get('MM_SHEETS_API_ENDPOINT', 'https://sheets.googleapis.com/')
+
+
+def _token_cache_path(credentials, scopes):
+    key = f"{credentials.service_account_email}|{' '.join(sorted(scopes))}"
+    return os.path.join(TOKEN_CACHE_DIR, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def _load_cached_token(credentials, cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        expiry = datetime.fromisoformat(cached['expiry'])
+    except (OSError, ValueError, KeyError):
+        return False
+    # google.auth は expiry を naive な UTC で扱う
+    if expiry - TOKEN_EXPIRY_MARGIN <= datetime.utcnow():
+        return False
+    credentials.token = cached['token']
+    credentials.expiry = expiry
+    return True
+
+
+_refresh_lock = threading.Lock()
+
+
+def _save_token(credentials, cache_path):
+    tmp_path = f'{cache_path}.{os.getpid()}.{os.urandom(4).hex()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        # 他のユーザーが読めないように、最初から 0600 で作成する
+        fd = os.open(tmp_path, os.O_CREAT | os.O_WRONLY | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'token': credentials.token, 'expiry': credentials.expiry.isoformat()}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logging.warning(f"Could not cache access token: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def load_credentials(service_account_file, scopes=SCOPES):
+    """サービスアカウントの認証情報を読み込みます。
+
+    前回の実行で取得したアクセストークンが有効期限内であれば再利用します。
+    なければ最初のリクエストの時に取得するため、この関数はネットワークにアクセスしません。
+    """
+    from google.oauth2 import service_account
+
+    credentials = service_account.Credentials.from_service_account_file(
+        service_account_file, scopes=scopes)
+    if _load_cached_token(credentials, _token_cache_path(credentials, scopes)):
+        logging.debug("Using cached access token")
+    return credentials
+
+
+def refresh_credentials(credentials, scopes=SCOPES):
+    """アクセストークンを再取得してディスクに保存します (ブロッキング)。"""
+    from google.auth.transport.requests import Request
+
+    credentials.refresh(Request())
+    _save_token(credentials, _token_cache_path(credentials, scopes))
+    return credentials
+
+
+def ensure_token(credentials, scopes=SCOPES):
+    """アクセストークンが期限切れ間近であれば再取得します。複数のスレッドから呼ばれても再取得は1回です。"""
+    if token_is_valid(credentials):
+        return
+    with _refresh_lock:
+        if not token_is_valid(credentials):
+            refresh_credentials(credentials, scopes)
+
+
+def token_is_valid(credentials):
+    """アクセストークンが TOKEN_EXPIRY_MARGIN 以上の余裕をもって有効かどうかを返します。"""
+    if not credentials.token or credentials.expiry is None:
+        return False
+    return credentials.expiry - TOKEN_EXPIRY_MARGIN > datetime.utcnow()
+
+
+def build_sheets_service(credentials, scheduler=None):
+    """同梱のディスカバリードキュメントを使って Sheets v4 サービスを作成します。
+
+    全てのリクエストの execute() は QuotaScheduler を通り、他のプロセスと
+    クォータを分け合いながら 429 / 5xx を再試行します。
+    """
+    from googleapiclient.discovery import build
+
+    scheduler = scheduler or QuotaScheduler.for_credentials(credentials)
+    scopes = getattr(credentials, 'scopes', None) or SCOPES
+    return build('sheets', 'v4', credentials=credentials,
+                 static_discovery=True, cache_discovery=False,
+                 requestBuilder=make_request_builder(scheduler, prepare=lambda: ensure_token(credentials, scopes)),
+                 client_options={'api_endpoint': SHEETS_API_ENDPOINT})
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import os
+import time
+
+# スプレッドシートのシート情報 (シート名・シートID・行数・列数) をメモリに保存するキャッシュ
+# spreadsheets.get は fields を指定しないと全シートの全プロパティを返すため、必要な項目だけを取得する
+# 他のプロセスやシート上での変更 (シートの追加・名前の変更・行数の変更) は METADATA_TTL 秒後か、
+# 範囲を解釈できないエラーを受けた時点で反映する
+
+METADATA_FIELDS = 'sheets.properties(sheetId,title,gridProperties)'
+MISS_REFRESH_INTERVAL = 5  # 秒。存在しないシート名で何度も再取得しないようにする
+METADATA_TTL = int(os.environ.get('MM_METADATA_TTL', 300))  # 秒
+
+# シートの追加・削除や行・列の増減など、シート情報が変わる batchUpdate のリクエスト
+STRUCTURAL_REQUESTS = {
+    'addSheet', 'deleteSheet', 'duplicateSheet', 'updateSheetProperties',
+    'insertDimension', 'deleteDimension', 'appendDimension', 'moveDimension',
+    'insertRange', 'deleteRange',
+}
+
+
+class SheetMetadata:
+    def __init__(self, ttl=METADATA_TTL):
+        self.ttl = ttl
+        self.sheets = {}  # シート名 -> properties
+        self.loaded_at = None
+        self.lock = None
+
+    def load(self, spreadsheet):
+        """spreadsheets.get (fields=METADATA_FIELDS) の結果を読み込みます。"""
+        self.sheets = {}
+        for sheet in spreadsheet.get('sheets', []):
+            properties = sheet.get('properties', {})
+            self.sheets[properties.get('title')] = properties
+        self.loaded_at = time.monotonic()
+        logging.debug(f"Loaded metadata of {len(self.sheets)} sheets")
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def invalidate_if_structural(self, requests):
+        """batchUpdate のリクエストにシートの構造を変えるものがあればキャッシュを無効にします。"""
+        if any(STRUCTURAL_REQUESTS.intersection(request) for request in requests):
+            self.invalidate()
+
+    def invalidate_on_error(self, status, message=''):
+        """400 (範囲を解釈できない・シートが見つからないなど) のエラーを受けた場合にキャッシュを無効にします。"""
+        if status == 400 or 'Unable to parse range' in (message or ''):
+            self.invalidate()
+
+    def _needs_refresh(self, sheet_name):
+        if self.loaded_at is None:
+            return True
+        age = time.monotonic() - self.loaded_at
+        if age >= self.ttl:
+            return True
+        return sheet_name not in self.sheets and age >= MISS_REFRESH_INTERVAL
+
+    def get(self, sheet_name, fetch):
+        """シートの properties を返します。fetch() は spreadsheets.get の結果を返す関数です。"""
+        if self._needs_refresh(sheet_name):
+            self.load(fetch())
+        return self.sheets.get(sheet_name)
+
+    async def get_async(self, sheet_name, fetch):
+        """get の非同期版です。同時に呼ばれた場合も spreadsheets.get は1回だけ実行します。"""
+        if self._needs_refresh(sheet_name):
+            if self.lock is None:
+                self.lock = asyncio.Lock()
+            async with self.lock:
+                if self._needs_refresh(sheet_name):
+                    self.load(await fetch())
+        return self.sheets.get(sheet_name)
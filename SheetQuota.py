@@ -0,0 +1,263 @@
+import asyncio
+import contextlib
+import email.utils
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from Metrics import Metrics
+
+# Sheets API のクォータ (1分あたりの読み込み・書き込み回数) をプロセス間で共有するトークンバケット
+# 転記スクリプト・AI スクリプト・FastAPI サーバーが同じサービスアカウントのクォータを使うため、
+# バケットの状態はロックしたファイルに保存し、どのプロセスからも同じ残量が見えるようにする
+
+QUOTA_DIR = os.environ.get(
+    'MM_QUOTA_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'mm-school', 'quota'))
+READ_REQUESTS_PER_MINUTE = int(os.environ.get('MM_SHEETS_READS_PER_MINUTE', 60))
+WRITE_REQUESTS_PER_MINUTE = int(os.environ.get('MM_SHEETS_WRITES_PER_MINUTE', 60))
+MAX_RETRIES = 8
+BACKOFF_BASE = 1  # 秒
+BACKOFF_MAX = 64  # 秒
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_RATE_LIMIT_PATTERN = re.compile(r'rate.?limit|quota', re.IGNORECASE)
+
+
+@contextlib.contextmanager
+def _locked_file(path):
+    """ファイルを排他ロックして開きます (Windows は msvcrt, それ以外は fcntl)。"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a+', encoding='utf-8') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield f
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def parse_retry_after(value):
+    """Retry-After ヘッダー (秒数または HTTP の日付) を秒数に変換します。"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """再試行までの待ち時間を返します。
+
+    Retry-After があればそれに少しの揺らぎを加え、なければ上限つきの指数バックオフ
+    (full jitter) にして、複数のプロセスが同時に再試行しないようにします。
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def is_rate_limited(status, content=''):
+    # Sheets API はクォータ超過を 429 で返すが、古いエラーでは 403 rateLimitExceeded の場合もある
+    return status == 429 or (status == 403 and bool(_RATE_LIMIT_PATTERN.search(content or '')))
+
+
+class QuotaScheduler:
+    """読み込み (read) と書き込み (write) のトークンバケットです。
+
+    acquire はトークンが補充されるまで待ってから1つ消費します。
+    429 を受けた場合は penalize で全プロセスのバケットを Retry-After の間止めます。
+    """
+
+    def __init__(self, name='default', quota_dir=QUOTA_DIR,
+                 read_per_minute=READ_REQUESTS_PER_MINUTE, write_per_minute=WRITE_REQUESTS_PER_MINUTE):
+        self.path = os.path.join(quota_dir, f'{name}.json')
+        self.limits = {'read': read_per_minute, 'write': write_per_minute}
+
+    @classmethod
+    def for_credentials(cls, credentials):
+        """サービスアカウントごとのスケジューラーを返します。"""
+        email = getattr(credentials, 'service_account_email', None) or 'default'
+        return cls(hashlib.sha256(email.encode('utf-8')).hexdigest()[:16])
+
+    def _take(self, kind, cost):
+        """トークンを消費できれば 0、できなければ次に消費できるまでの秒数を返します。"""
+        limit = self.limits[kind]
+        rate = limit / 60
+        with _locked_file(self.path) as f:
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                state = {}
+            now = time.time()
+            bucket = state.get(kind) or {'tokens': limit, 'updated_at': now, 'blocked_until': 0}
+            bucket['tokens'] = min(limit, bucket['tokens'] + (now - bucket['updated_at']) * rate)
+            bucket['updated_at'] = now
+
+            if now < bucket['blocked_until']:
+                wait_time = bucket['blocked_until'] - now
+            elif bucket['tokens'] >= cost:
+                bucket['tokens'] -= cost
+                wait_time = 0
+            else:
+                wait_time = (cost - bucket['tokens']) / rate
+
+            state[kind] = bucket
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            f.flush()
+        return wait_time
+
+    def acquire(self, kind, cost=1):
+        while True:
+            wait_time = self._take(kind, cost)
+            if not wait_time:
+                return
+            # 同時に待っているプロセスが一斉に起きないように揺らぎを加える
+            time.sleep(wait_time + random.uniform(0, 0.1))
+
+    async def acquire_async(self, kind, cost=1):
+        while True:
+            wait_time = self._take(kind, cost)
+            if not wait_time:
+                return
+            await asyncio.sleep(wait_time + random.uniform(0, 0.1))
+
+    def penalize(self, kind, retry_after=None):
+        """429 を受けたバケットを空にし、Retry-After の間は全プロセスで送信を止めます。"""
+        with _locked_file(self.path) as f:
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                state = {}
+            now = time.time()
+            bucket = state.get(kind) or {'tokens': 0, 'updated_at': now, 'blocked_until': 0}
+            bucket['tokens'] = 0
+            bucket['updated_at'] = now
+            if retry_after:
+                bucket['blocked_until'] = max(bucket['blocked_until'], now + retry_after)
+            state[kind] = bucket
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            f.flush()
+
+    def call(self, kind, request, max_retries=MAX_RETRIES):
+        """googleapiclient のリクエストをクォータに合わせて実行し、失敗した場合は再試行します。"""
+        from googleapiclient.errors import HttpError
+
+        for attempt in range(max_retries + 1):
+            self.acquire(kind)
+            try:
+                result = request()
+                Metrics.count('sheets_requests', kind=kind, status=200)
+                return result
+            except HttpError as e:
+                status = e.resp.status
+                Metrics.count('sheets_requests', kind=kind, status=status)
+                content = e.content.decode('utf-8', 'replace') if isinstance(e.content, bytes) else str(e.content)
+                rate_limited = is_rate_limited(status, content)
+                if rate_limited:
+                    Metrics.count('rate_limited', api='sheets')
+                if attempt == max_retries or not (rate_limited or status in RETRY_STATUSES):
+                    raise
+                retry_after = parse_retry_after(e.resp.get('retry-after'))
+                if rate_limited:
+                    self.penalize(kind, retry_after)
+                wait_time = backoff_delay(attempt, retry_after)
+                Metrics.count('sheets_retries', kind=kind)
+                logging.warning(f"Sheets API returned {status}, retrying in {wait_time:.1f} seconds "
+                                f"({attempt + 1}/{max_retries})")
+                time.sleep(wait_time)
+
+
+class FairShare:
+    """同じプロセスで複数のスプレッドシートを並列に処理する場合に、クォータを公平に分けます。
+
+    トークンを待っているスプレッドシートのうち、これまでに使った回数が最も少ないものに
+    次のトークンを渡します。待っているのが1つだけなら、そのスプレッドシートが全てのクォータを使えます。
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.used = {}  # スプレッドシート -> 使ったトークンの数
+        self.waiting = {'read': [], 'write': []}
+        self.active = {'read': None, 'write': None}  # バケットのトークンを待っている呼び出し
+        self.tickets = itertools.count()
+
+    def _next(self, kind):
+        return min(self.waiting[kind], key=lambda entry: (self.used.get(entry[0], 0), entry[1]))
+
+    def acquire(self, kind, workbook, take):
+        """順番が来たら take() でバケットからトークンを取ります。"""
+        entry = (workbook, next(self.tickets))
+        with self.condition:
+            self.waiting[kind].append(entry)
+            while self.active[kind] is not None or self._next(kind) != entry:
+                self.condition.wait()
+            self.active[kind] = entry
+        try:
+            take()
+        finally:
+            with self.condition:
+                self.active[kind] = None
+                self.waiting[kind].remove(entry)
+                self.used[workbook] = self.used.get(workbook, 0) + 1
+                self.condition.notify_all()
+
+
+class FairQuotaScheduler(QuotaScheduler):
+    """scheduler と同じバケットを使い、トークンの順番は FairShare で決めるスケジューラーです。"""
+
+    def __init__(self, scheduler, share, workbook):
+        self.path = scheduler.path
+        self.limits = scheduler.limits
+        self.share = share
+        self.workbook = workbook
+
+    def acquire(self, kind, cost=1):
+        self.share.acquire(kind, self.workbook, lambda: QuotaScheduler.acquire(self, kind, cost))
+
+
+def request_kind(method):
+    return 'read' if method == 'GET' else 'write'
+
+
+def make_request_builder(scheduler, prepare=None):
+    """execute() がクォータを通るようにした googleapiclient の HttpRequest クラスを返します。
+
+    prepare はリクエストの前に呼ぶ関数です (アクセストークンの取得など)。
+    """
+    from googleapiclient.http import HttpRequest
+
+    class QuotaHttpRequest(HttpRequest):
+        def execute(self, http=None, num_retries=0):
+            if prepare is not None:
+                prepare()
+            return scheduler.call(request_kind(self.method),
+                                  lambda: HttpRequest.execute(self, http=http, num_retries=num_retries))
+
+    return QuotaHttpRequest
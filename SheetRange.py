@@ -0,0 +1,187 @@
+import re
+import string
+from collections import namedtuple
+
+# 0始まりの行・列番号で表した矩形 (Sheets API の GridRange と同じく end は含まない)
+# 上限のない範囲 (例: 'A2:A', 'AD1:1') は end_row / end_col が None になる
+GridRange = namedtuple('GridRange', ['sheet', 'start_row', 'end_row', 'start_col', 'end_col'])
+
+_CELL_PATTERN = re.compile(r'^([A-Za-z]*)(\d*)$')
+# シート名を付けない範囲として扱う A1 表記 ('A1', 'A2:B', 'A:A', '1:3')
+# 列名は3文字 (ZZZ) まで、単独のセルは列と行の両方が必要で、'Setting' や 'Sheet1' はシート名になる
+_BARE_CELL_PATTERN = re.compile(r'^[A-Za-z]{1,3}[1-9]\d*$')
+_BARE_PART_PATTERN = re.compile(r'^(?:[A-Za-z]{1,3}|[A-Za-z]{0,3}[1-9]\d*)$')
+
+
+def column_letter(index):
+    """0始まりの列番号を列名 (0 -> A, 27 -> AB) に変換します。"""
+    letters = ""
+    while index >= 0:
+        letters = string.ascii_uppercase[index % 26] + letters
+        index = index // 26 - 1
+    return letters
+
+
+def column_index(letters):
+    """列名を0始まりの列番号 (A -> 0, AB -> 27) に変換します。"""
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + (ord(char) - ord('A') + 1)
+    return index - 1
+
+
+def _quote_sheet_name(sheet):
+    if re.search(r"[\s'!:]", sheet):
+        return "'" + sheet.replace("'", "''") + "'"
+    return sheet
+
+
+def _split_sheet(range_name):
+    if '!' not in range_name:
+        return None, range_name
+    sheet, cells = range_name.rsplit('!', 1)
+    if sheet.startswith("'") and sheet.endswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    return sheet, cells
+
+
+def _is_bare_a1(cells):
+    start, separator, end = cells.partition(':')
+    if not separator:
+        return bool(_BARE_CELL_PATTERN.match(start))
+    return bool(_BARE_PART_PATTERN.match(start) and _BARE_PART_PATTERN.match(end))
+
+
+def parse_a1(range_name):
+    """A1表記の範囲を GridRange に変換します。
+
+    'AI-memo' や 'Sheet1' のようにシート名だけの場合はシート全体、'A2:A' のように
+    行番号を省略した場合は下端が None になります。
+    """
+    sheet, cells = _split_sheet(range_name)
+    if '!' not in range_name and not _is_bare_a1(cells):
+        # シート名のみ (Sheets API と同じく、A1 表記として正しくない場合はシート名として読む)
+        sheet, _ = _split_sheet(range_name + '!')
+        return GridRange(sheet, None, None, None, None)
+
+    start, _, end = cells.partition(':')
+    start_match = _CELL_PATTERN.match(start)
+    end_match = _CELL_PATTERN.match(end or start)
+    if not start_match or not end_match:
+        raise ValueError(f"Invalid A1 range: {range_name}")
+
+    start_col_letters, start_row_digits = start_match.groups()
+    end_col_letters, end_row_digits = end_match.groups()
+
+    start_col = column_index(start_col_letters) if start_col_letters else None
+    end_col = column_index(end_col_letters) + 1 if end_col_letters else None
+    start_row = int(start_row_digits) - 1 if start_row_digits else None
+    end_row = int(end_row_digits) if end_row_digits else None
+    return GridRange(sheet, start_row, end_row, start_col, end_col)
+
+
+def format_a1(grid):
+    """GridRange をA1表記 ('AI-memo!AB2:AD10') に変換します。"""
+    if all(value is None for value in grid[1:]):
+        return _quote_sheet_name(grid.sheet)
+    if grid.start_col is None and grid.end_col is None and grid.end_row is not None:
+        # 行だけの範囲 ('Sheet1!1:3')
+        cells = f'{(grid.start_row or 0) + 1}:{grid.end_row}'
+        return f'{_quote_sheet_name(grid.sheet)}!{cells}' if grid.sheet else cells
+    start = (column_letter(grid.start_col) if grid.start_col is not None else 'A') + \
+        (str(grid.start_row + 1) if grid.start_row is not None else '')
+    end = (column_letter(grid.end_col - 1) if grid.end_col is not None else '') + \
+        (str(grid.end_row) if grid.end_row is not None else '')
+    cells = f'{start}:{end}' if end else start
+    if grid.sheet:
+        return f'{_quote_sheet_name(grid.sheet)}!{cells}'
+    return cells
+
+
+def to_grid_range(grid, sheet_id):
+    """GridRange を spreadsheets.batchUpdate 用の GridRange オブジェクトに変換します。"""
+    grid_range = {'sheetId': sheet_id}
+    if grid.start_row is not None:
+        grid_range['startRowIndex'] = grid.start_row
+    if grid.end_row is not None:
+        grid_range['endRowIndex'] = grid.end_row
+    if grid.start_col is not None:
+        grid_range['startColumnIndex'] = grid.start_col
+    if grid.end_col is not None:
+        grid_range['endColumnIndex'] = grid.end_col
+    return grid_range
+
+
+def from_grid_range(sheet, grid_range):
+    """spreadsheets.batchUpdate 用の GridRange オブジェクトを GridRange に変換します。"""
+    return GridRange(sheet, grid_range.get('startRowIndex'), grid_range.get('endRowIndex'),
+                     grid_range.get('startColumnIndex'), grid_range.get('endColumnIndex'))
+
+
+def _intervals_overlap(start_a, end_a, start_b, end_b):
+    start_a, start_b = start_a or 0, start_b or 0
+    return (end_b is None or start_a < end_b) and (end_a is None or start_b < end_a)
+
+
+def ranges_overlap(a, b):
+    """2つの GridRange が重なるかどうかを返します。
+
+    シート名が省略されている範囲 (最初のシート) は全てのシートと重なるものとして扱います。
+    """
+    if a.sheet and b.sheet and a.sheet.casefold() != b.sheet.casefold():
+        return False
+    return _intervals_overlap(a.start_row, a.end_row, b.start_row, b.end_row) and \
+        _intervals_overlap(a.start_col, a.end_col, b.start_col, b.end_col)
+
+
+def coalesce_blocks(cells):
+    """{(行, 列): 値} の疎なセルを連続した矩形ブロックにまとめます。
+
+    各行の連続した列を1つの区間にし、列区間が同じ区間が連続する行に
+    続く場合は1つの2次元ブロックとして縦に結合します。
+    (start_row, start_col, values) のリストを返します。
+    """
+    rows = {}
+    for (row, col), value in cells.items():
+        rows.setdefault(row, {})[col] = value
+
+    blocks = []
+    open_blocks = {}  # (開始列, 終了列) -> 直前の行まで伸びているブロック
+    previous_row = None
+    for row in sorted(rows):
+        row_cells = rows[row]
+        segments = []
+        run = []
+        for col in sorted(row_cells):
+            if run and col != run[-1] + 1:
+                segments.append(run)
+                run = []
+            run.append(col)
+        if run:
+            segments.append(run)
+
+        continuing = previous_row is not None and row == previous_row + 1
+        next_open_blocks = {}
+        for segment in segments:
+            span = (segment[0], segment[-1])
+            values = [row_cells[col] for col in segment]
+            block = open_blocks.get(span) if continuing else None
+            if block is None:
+                block = [row, segment[0], []]
+                blocks.append(block)
+            block[2].append(values)
+            next_open_blocks[span] = block
+        open_blocks = next_open_blocks
+        previous_row = row
+
+    return [tuple(block) for block in blocks]
+
+
+def coalesce_cells(sheet, cells):
+    """疎なセルを values.batchUpdate 用の最小限の範囲データに変換します。"""
+    data = []
+    for start_row, start_col, values in coalesce_blocks(cells):
+        grid = GridRange(sheet, start_row, start_row + len(values),
+                         start_col, start_col + len(values[0]))
+        data.append({'range': format_a1(grid), 'values': values})
+    return data
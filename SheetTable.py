@@ -0,0 +1,137 @@
+from itertools import zip_longest
+
+from SheetRange import coalesce_cells, parse_a1
+
+# Sheets API から読み込んだ値を列ごとに持つ表
+# get_values の結果は行ごとの長さが揃っていない list[list[str]] で、末尾の空のセルや空の行が省略されるため、
+# 読み込んだ時点で全ての列を同じ行数にそろえ、空のセルは '' にする
+# 行・列の番号は SheetRange と同じ0始まりで、row はデータの行 (ヘッダー行を除く) の番号
+
+
+class SheetTable:
+    """列の配列・ヘッダー名から列への対応・空セルのマスク・キー列による行の検索を持つ表です。
+
+    書き込む値は set で updates ({(シートの行, シートの列): 値}) に追加し、
+    write_ranges で values.batchUpdate 用の範囲データにまとめます。
+    """
+
+    def __init__(self, sheet, columns, headers=None, start_row=0, start_col=0, sheet_cols=None, row_count=None):
+        self.sheet = sheet
+        self.start_row = start_row  # 最初のデータ行のシート上の行番号 (0始まり)
+        self.start_col = start_col
+        self.sheet_cols = sheet_cols  # 列が連続していない場合の各列のシート上の列番号
+        self.row_count = max([len(column) for column in columns] + [row_count or 0])
+        self.columns = [column + [''] * (self.row_count - len(column)) for column in columns]
+        self.headers = list(headers or [])
+        self.header_index = {}
+        for col, header in enumerate(self.headers):
+            if header:
+                self.header_index.setdefault(header, col)  # 同名のヘッダーは最初の列を使う
+        self.empty = [bytearray(value == '' for value in column) for column in self.columns]
+        self.indexes = {}
+        self.updates = {}
+
+    @classmethod
+    def from_rows(cls, sheet, rows, start_row=0, start_col=0, header=False, headers=None):
+        """get_values の結果 (行ごとの値) から表を作成します。header=True の場合は1行目をヘッダーにします。
+
+        別に読み込んだヘッダー行は headers で指定します (読み込んだ列より右のヘッダーは書き込みにだけ使えます)。
+        """
+        width = 0
+        if header:
+            headers = [str(value) for value in rows[0]] if rows else []
+            width = len(headers)
+            rows = rows[1:]
+            start_row += 1
+        # 長さの違う行をまとめて転置する (短い行の末尾は '' で埋める)
+        columns = [list(column) for column in zip_longest(*rows, fillvalue='')]
+        columns += [[] for _ in range(width - len(columns))]
+        return cls(sheet, columns, headers, start_row, start_col, row_count=len(rows))
+
+    @classmethod
+    def from_column_ranges(cls, snapshot, ranges, headers=None):
+        """batch_get_values で読み込んだ1列ずつの範囲 (例: 'A2:A', 'H2:H') を並べた表を作成します。
+
+        範囲は同じシート・同じ開始行である必要があります。列は ranges の順番に並びます。
+        """
+        grids = [parse_a1(range_name) for range_name in ranges]
+        if len({(grid.sheet, grid.start_row) for grid in grids}) > 1:
+            raise ValueError(f"Ranges must start at the same row of the same sheet: {ranges}")
+        if not grids:
+            return cls(None, [], headers)
+        columns = [[row[0] if row else '' for row in snapshot.get(range_name, [])] for range_name in ranges]
+        return cls(grids[0].sheet, columns, headers, grids[0].start_row or 0,
+                   sheet_cols=[grid.start_col or 0 for grid in grids])
+
+    def __len__(self):
+        return self.row_count
+
+    def col(self, key):
+        """ヘッダー名または列番号 (表の中での0始まり) を列番号に変換します。"""
+        if isinstance(key, int):
+            return key
+        try:
+            return self.header_index[key]
+        except KeyError:
+            raise KeyError(f"Column {key!r} not found in {self.sheet}") from None
+
+    def sheet_col(self, key):
+        col = self.col(key)
+        return self.sheet_cols[col] if self.sheet_cols else self.start_col + col
+
+    def sheet_row(self, row):
+        """データの行番号をシート上の行番号 (1始まり、A1 表記の行) に変換します。"""
+        return self.start_row + row + 1
+
+    def column(self, key):
+        col = self.col(key)
+        return self.columns[col] if col < len(self.columns) else [''] * self.row_count
+
+    def value(self, row, key):
+        col = self.col(key)
+        return self.columns[col][row] if col < len(self.columns) else ''
+
+    def is_empty(self, row, key):
+        col = self.col(key)
+        return col >= len(self.columns) or bool(self.empty[col][row])
+
+    def last_row(self, *keys):
+        """keys のいずれかの列に値がある最後の行の次の行番号 (値がなければ 0) を返します。"""
+        masks = [self.empty[self.col(key)] for key in keys if self.col(key) < len(self.columns)]
+        for row in range(self.row_count - 1, -1, -1):
+            if any(not mask[row] for mask in masks):
+                return row + 1
+        return 0
+
+    def rows(self, *keys):
+        """keys の列の値を行ごとのタプルで返します。"""
+        return zip(*(self.column(key) for key in keys)) if keys else iter(())
+
+    def index_by(self, key):
+        """key の列の値から行番号への対応を返します (空の値は含まず、重複する値は最初の行)。"""
+        col = self.col(key)
+        index = self.indexes.get(col)
+        if index is None:
+            index = {}
+            for row, value in enumerate(self.column(col)):
+                if value != '':
+                    index.setdefault(value, row)
+            self.indexes[col] = index
+        return index
+
+    def find(self, key, value):
+        """key の列が value の行番号を返します。例: table.find('SKU', sku)"""
+        return self.index_by(key).get(value)
+
+    def set(self, row, key, value):
+        """書き込む値を追加します。表の値も更新します。"""
+        col = self.col(key)
+        self.updates[(self.sheet_row(row) - 1, self.sheet_col(col))] = value
+        if col < len(self.columns):
+            self.columns[col][row] = value
+            self.empty[col][row] = value == ''
+            self.indexes.pop(col, None)
+
+    def write_ranges(self):
+        """set で追加した値を連続する矩形にまとめ、values.batchUpdate 用の範囲データを返します。"""
+        return coalesce_cells(self.sheet, self.updates)
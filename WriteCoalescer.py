@@ -0,0 +1,178 @@
+import asyncio
+import logging
+
+from SheetRange import GridRange, coalesce_cells, format_a1, parse_a1, ranges_overlap
+
+# FastAPI サーバーで同時に届いた書き込みをまとめて1回の values.batchUpdate にするキュー
+# 書き込みの回数 (1分あたりの書き込みクォータ) を減らすため、WRITE_BATCH_WINDOW 秒の間に届いた
+# 書き込みをセル単位で合成する (同じセルへの書き込みは後から届いたものを優先する)
+# まとめた書き込みが 4xx で失敗した場合は、1件ずつ送り直して原因の書き込みだけを失敗させる
+
+WRITE_BATCH_WINDOW = 0.01  # 秒
+WRITE_BATCH_MAX_WRITES = 200  # この件数に達したらすぐに書き込む
+WRITE_BATCH_MAX_CELLS = 50000  # このセル数に達したらすぐに書き込む
+
+
+def parse_write(range_name, values):
+    """書き込む範囲を GridRange に変換し、値が範囲に収まるかを確認します。
+
+    values.update と同じく、範囲の外にはみ出す値は受け付けずに ValueError を送出します。
+    合成した後では範囲が広がり、Sheets API がはみ出しを検出できなくなるためです。
+    """
+    grid = parse_a1(range_name)
+    if grid.end_row is not None and len(values) > grid.end_row - (grid.start_row or 0):
+        raise ValueError(f"{len(values)} rows do not fit in {range_name}")
+    width = max((len(row) for row in values), default=0)
+    if grid.end_col is not None and width > grid.end_col - (grid.start_col or 0):
+        raise ValueError(f"{width} columns do not fit in {range_name}")
+    return grid
+
+
+def merge_writes(writes):
+    """[(GridRange, 値)] を届いた順に合成し、values.batchUpdate 用の data を返します。
+
+    値が None のセルは Sheets API と同じく変更しないセルとして扱います。
+    """
+    sheets = {}
+    for grid, values in writes:
+        cells = sheets.setdefault(grid.sheet, {})
+        start_row = grid.start_row or 0
+        start_col = grid.start_col or 0
+        for row_offset, row in enumerate(values):
+            for col_offset, value in enumerate(row):
+                if value is not None:
+                    cells[(start_row + row_offset, start_col + col_offset)] = value
+    data = []
+    for sheet, cells in sheets.items():
+        data.extend(coalesce_cells(sheet, cells))
+    return data
+
+
+def write_result(spreadsheet_id, grid, values, response):
+    """values.batchUpdate の応答から、1件の書き込みに対する values.update 形式の結果を作成します。
+
+    応答の各範囲 (updatedRange) のうち、この書き込みのセルが含まれるものだけを数えます。
+    """
+    start_row = grid.start_row or 0
+    start_col = grid.start_col or 0
+    updated = [parse_a1(item['updatedRange']) for item in (response or {}).get('responses', [])
+               if item.get('updatedRange')]
+    updated = [updated_grid for updated_grid in updated if ranges_overlap(updated_grid, grid)]
+    rows, cols, cells = set(), set(), 0
+    for row_offset, row in enumerate(values):
+        for col_offset, value in enumerate(row):
+            if value is None:
+                continue
+            cell = GridRange(grid.sheet, start_row + row_offset, start_row + row_offset + 1,
+                             start_col + col_offset, start_col + col_offset + 1)
+            if any(ranges_overlap(cell, updated_grid) for updated_grid in updated):
+                rows.add(cell.start_row)
+                cols.add(cell.start_col)
+                cells += 1
+    if cells:
+        updated_range = format_a1(GridRange(grid.sheet, min(rows), max(rows) + 1, min(cols), max(cols) + 1))
+    else:
+        updated_range = format_a1(grid)
+    return {
+        'spreadsheetId': (response or {}).get('spreadsheetId', spreadsheet_id),
+        'updatedRange': updated_range,
+        'updatedRows': len(rows),
+        'updatedColumns': len(cols),
+        'updatedCells': cells,
+    }
+
+
+def is_client_error(error):
+    """書き込みの内容が原因のエラー (429 以外の 4xx) かどうかを返します。"""
+    status = getattr(error, 'status', None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+class WriteCoalescer:
+    """書き込みを短時間ためてから、まとめて1回の values.batchUpdate で送信します。
+
+    write は data を受け取って values.batchUpdate を実行するコルーチン関数です。
+    まとめて送信する処理は1つずつ順番に実行するため、後から届いた書き込みが
+    先に届いた書き込みより前に反映されることはありません。
+    """
+
+    def __init__(self, spreadsheet_id, write, window=WRITE_BATCH_WINDOW,
+                 max_writes=WRITE_BATCH_MAX_WRITES, max_cells=WRITE_BATCH_MAX_CELLS):
+        self.spreadsheet_id = spreadsheet_id
+        self.write = write
+        self.window = window
+        self.max_writes = max_writes
+        self.max_cells = max_cells
+        self.pending = []  # (GridRange, 値, Future)
+        self.pending_cells = 0
+        self.timer = None
+        self.flushing = set()
+        self.lock = None
+
+    async def submit(self, range_name, values):
+        """書き込みを追加し、まとめた書き込みが完了したらこの書き込みの結果を返します。
+
+        A1表記として解釈できない範囲や、範囲に収まらない値の場合は ValueError を送出します。
+        """
+        grid = parse_write(range_name, values)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((grid, values, future))
+        self.pending_cells += sum(len(row) for row in values)
+
+        if len(self.pending) >= self.max_writes or self.pending_cells >= self.max_cells:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush)
+        # 呼び出し元がキャンセルされても、まとめた書き込み自体は続ける
+        return await asyncio.shield(future)
+
+    def flush(self):
+        """ためている書き込みの送信を開始します。"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending, self.pending_cells = self.pending, [], 0
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self.flushing.add(task)
+            task.add_done_callback(self.flushing.discard)
+
+    async def _send(self, batch):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            try:
+                data = merge_writes([(grid, values) for grid, values, _ in batch])
+                logging.debug(f"Coalesced {len(batch)} writes into {len(data)} ranges")
+                response = await self.write(data)
+            except Exception as e:
+                if len(batch) > 1 and is_client_error(e):
+                    logging.warning(f"Coalesced write of {len(batch)} ranges failed ({e}), retrying one by one")
+                    await self._send_each(batch)
+                    return
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            for grid, values, future in batch:
+                if not future.done():
+                    future.set_result(write_result(self.spreadsheet_id, grid, values, response))
+
+    async def _send_each(self, batch):
+        """書き込みを届いた順に1件ずつ送信し、失敗した書き込みの呼び出し元だけにエラーを返します。"""
+        for grid, values, future in batch:
+            try:
+                response = await self.write(merge_writes([(grid, values)]))
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(write_result(self.spreadsheet_id, grid, values, response))
+
+    async def close(self):
+        """ためている書き込みを送信し、全ての送信が終わるまで待ちます。"""
+        self.flush()
+        if self.flushing:
+            await asyncio.gather(*self.flushing, return_exceptions=True)
@@ -0,0 +1,244 @@
+"""ベンチマーク・動作確認用の OpenAI API の代替サーバーです。
+
+使い方:
+    python benchmarks/fake_openai.py [--port 8100] [--latency 0.5] [--batch-delay 5] [--rate-limit 500] [--inject-429 0.01]
+
+OPENAI_API_BASE=http://127.0.0.1:8100/v1 を指定してスクリプトを実行すると、
+OpenAI に接続せずに次のエンドポイントを使えます。
+    POST /v1/chat/completions        function_call の引数をスキーマから決まった値で返す
+    POST /v1/files                   JSONL ファイルのアップロード (multipart)
+    GET  /v1/files/{id}/content      アップロードしたファイル・結果ファイルの取得
+    POST /v1/batches                 バッチの作成
+    GET  /v1/batches/{id}            バッチの状態 (作成から --batch-delay 秒後に completed)
+    GET  /_stats                     エンドポイントごとの呼び出し回数
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_ids = itertools.count(1)
+_lock = threading.Lock()
+_batch_lock = threading.Lock()
+files = {}
+batches = {}
+stats = {}
+
+
+def count(name):
+    with _lock:
+        stats[name] = stats.get(name, 0) + 1
+
+
+def reset_stats():
+    with _lock:
+        stats.clear()
+
+
+def new_id(prefix):
+    with _lock:
+        return f'{prefix}-{next(_ids)}'
+
+
+def fake_value(name, schema, context):
+    """JSON スキーマに合わせたダミーの値を返します。"""
+    if schema.get('type') == 'object':
+        return {key: fake_value(key, value, context) for key, value in schema.get('properties', {}).items()}
+    if schema.get('type') == 'array':
+        # packed モードの Listings は入力の商品 (SKU) ごとに1件返す
+        return [fake_value(name, schema.get('items', {}), dict(context, SKU=sku))
+                for sku in context.get('skus', [''])]
+    if name in context:
+        return context[name]
+    return f'{name} {context.get("seed", "")}'.strip()
+
+
+def chat_completion(body):
+    function = body['functions'][0]
+    prompt = json.dumps(body.get('messages', []), ensure_ascii=False)
+    skus = []
+    for message in body.get('messages', []):
+        content = message.get('content')
+        parts = content if isinstance(content, list) else [{'type': 'text', 'text': content or ''}]
+        for part in parts:
+            for line in part.get('text', '').splitlines():
+                # packed モードの参考情報は 'SKU-xxx' の行で始まる
+                if line.startswith('SKU-') and 'の画像:' not in line:
+                    skus.append(line[len('SKU-'):].strip())
+    context = {'seed': str(abs(hash(prompt)) % 100000), 'skus': skus or ['']}
+    arguments = fake_value(function['name'], function['parameters'], context)
+    return {
+        'id': new_id('chatcmpl'),
+        'object': 'chat.completion',
+        'model': body.get('model'),
+        'choices': [{
+            'index': 0,
+            'finish_reason': 'function_call',
+            'message': {'role': 'assistant', 'content': None,
+                        'function_call': {'name': function['name'],
+                                          'arguments': json.dumps(arguments, ensure_ascii=False)}},
+        }],
+        'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': 100,
+                  'total_tokens': len(prompt) // 4 + 100},
+    }
+
+
+def complete_batch(batch):
+    """入力ファイルの各行を処理して結果ファイルを作成します。"""
+    lines = []
+    for line in files[batch['input_file_id']]['content'].decode('utf-8').splitlines():
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        lines.append(json.dumps({
+            'id': new_id('batch_req'),
+            'custom_id': request['custom_id'],
+            'response': {'status_code': 200, 'request_id': new_id('req'),
+                         'body': chat_completion(request['body'])},
+            'error': None,
+        }, ensure_ascii=False))
+    output_file_id = new_id('file')
+    files[output_file_id] = {'content': ('\n'.join(lines) + '\n').encode('utf-8'), 'purpose': 'batch_output'}
+    batch.update(status='completed', output_file_id=output_file_id, completed_at=int(time.time()),
+                 request_counts={'total': len(lines), 'completed': len(lines), 'failed': 0})
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    batch_delay = 0.0
+    rate_limit = None  # chat/completions の1分あたりの上限
+    inject_429 = 0.0
+    history = deque()
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _send_json(self, data, status=200, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _rate_limit_headers(self):
+        """429 の場合は Retry-After を含むヘッダー、そうでなければ残りのリクエスト数のヘッダーを返します。"""
+        now = time.time()
+        with _lock:
+            while self.history and self.history[0] <= now - 60:
+                self.history.popleft()
+            if self.rate_limit and len(self.history) >= self.rate_limit:
+                return True, {'retry-after': str(max(1, int(self.history[0] + 60 - now) + 1)),
+                              'x-ratelimit-remaining-requests': '0'}
+            if self.inject_429 and random.random() < self.inject_429:
+                return True, {'retry-after': '1', 'x-ratelimit-remaining-requests': '0'}
+            self.history.append(now)
+            remaining = self.rate_limit - len(self.history) if self.rate_limit else 10000
+        return False, {'x-ratelimit-limit-requests': str(self.rate_limit or 10000),
+                       'x-ratelimit-remaining-requests': str(remaining),
+                       'x-ratelimit-reset-requests': '60s'}
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path == '/v1/chat/completions':
+            count('chat.completions')
+            time.sleep(self.latency)
+            limited, headers = self._rate_limit_headers()
+            if limited:
+                count('429')
+                self._send_json({'error': {'message': 'Rate limit reached', 'type': 'requests'}},
+                                status=429, headers=headers)
+                return
+            self._send_json(chat_completion(json.loads(body)), headers=headers)
+        elif self.path == '/v1/files':
+            count('files.create')
+            message = BytesParser(policy=HTTP).parsebytes(
+                f'Content-Type: {self.headers["Content-Type"]}\r\n\r\n'.encode('utf-8') + body)
+            fields = {part.get_param('name', header='content-disposition'): part.get_payload(decode=True)
+                      for part in message.iter_parts()}
+            file_id = new_id('file')
+            files[file_id] = {'content': fields['file'], 'purpose': fields.get('purpose', b'').decode('utf-8')}
+            self._send_json({'id': file_id, 'object': 'file', 'bytes': len(fields['file']),
+                             'purpose': files[file_id]['purpose']})
+        elif self.path == '/v1/batches':
+            count('batches.create')
+            request = json.loads(body)
+            if request.get('input_file_id') not in files:
+                self._send_json({'error': {'message': 'input file not found'}}, status=404)
+                return
+            batch_id = new_id('batch')
+            batches[batch_id] = {'id': batch_id, 'object': 'batch', 'status': 'in_progress',
+                                 'endpoint': request.get('endpoint'), 'input_file_id': request['input_file_id'],
+                                 'completion_window': request.get('completion_window'),
+                                 'metadata': request.get('metadata') or {},
+                                 'created_at': int(time.time()), 'output_file_id': None, 'error_file_id': None}
+            self._send_json(batches[batch_id])
+        else:
+            self._send_json({'error': {'message': 'not found'}}, status=404)
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if self.path == '/_stats':
+            with _lock:
+                self._send_json(dict(stats))
+        elif len(parts) == 3 and parts[:2] == ['v1', 'batches'] and parts[2] in batches:
+            count('batches.retrieve')
+            batch = batches[parts[2]]
+            with _batch_lock:
+                if batch['status'] == 'in_progress' and time.time() - batch['created_at'] >= self.batch_delay:
+                    complete_batch(batch)
+            self._send_json(batch)
+        elif len(parts) == 4 and parts[:2] == ['v1', 'files'] and parts[3] == 'content' and parts[2] in files:
+            count('files.content')
+            content = files[parts[2]]['content']
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/jsonl')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self._send_json({'error': {'message': 'not found'}}, status=404)
+
+
+def serve(port=8100, latency=0.0, batch_delay=0.0, rate_limit=None, inject_429=0.0):
+    """代替サーバーを作成します。port=0 の場合は空いているポートを使います。"""
+    FakeOpenAIHandler.latency = latency
+    FakeOpenAIHandler.batch_delay = batch_delay
+    FakeOpenAIHandler.rate_limit = rate_limit
+    FakeOpenAIHandler.inject_429 = inject_429
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI API の代替サーバー')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', type=float, default=0.0, help='chat/completions の応答時間 (秒)')
+    parser.add_argument('--batch-delay', type=float, default=0.0, help='バッチが完了するまでの時間 (秒)')
+    parser.add_argument('--rate-limit', type=int, help='chat/completions の1分あたりの上限')
+    parser.add_argument('--inject-429', type=float, default=0.0, help='429 を返す確率')
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency, args.batch_delay, args.rate_limit, args.inject_429)
+    print(f'Fake OpenAI API listening on http://127.0.0.1:{args.port}/v1')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,379 @@
+"""ベンチマーク・動作確認用の Google Sheets API v4 の代替サーバーです。
+
+使い方:
+    python benchmarks/fake_sheets.py [--port 8200] [--latency 0.05] [--rate-limit 300] [--inject-429 0.01]
+
+MM_SHEETS_API_ENDPOINT=http://127.0.0.1:8200/ を指定し、サービスアカウントの JSON の
+token_uri を http://127.0.0.1:8200/token にすると、Google に接続せずにスクリプトを実行できます。
+    GET  /v4/spreadsheets/{id}                      シート情報
+    POST /v4/spreadsheets/{id}:batchUpdate          deleteDimension / insertDimension / addSheet など
+    GET  /v4/spreadsheets/{id}/values/{range}       values.get
+    GET  /v4/spreadsheets/{id}/values:batchGet      values.batchGet
+    PUT  /v4/spreadsheets/{id}/values/{range}       values.update
+    POST /v4/spreadsheets/{id}/values:batchUpdate   values.batchUpdate
+    POST /v4/spreadsheets/{id}/values:batchClear    values.batchClear
+    POST /token                                     アクセストークンの発行 (署名は確認しない)
+    GET  /_image/{name}                             出品画像の代わりの JPEG
+    GET  /_stats                                    API ごとの呼び出し回数
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SheetRange import format_a1, parse_a1  # noqa: E402
+
+DEFAULT_ROW_COUNT = 1000
+DEFAULT_COLUMN_COUNT = 26
+
+
+class FakeSpreadsheet:
+    """メモリ上のスプレッドシートです。シートごとに値を行のリストで持ちます。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sheets = {}  # シート名 -> {'sheetId', 'rows'}
+        self.next_sheet_id = 0
+
+    def add_sheet(self, title):
+        with self.lock:
+            return self._add_sheet(title)
+
+    def _add_sheet(self, title):
+        if title not in self.sheets:
+            self.sheets[title] = {'sheetId': self.next_sheet_id, 'rows': []}
+            self.next_sheet_id += 1
+        return self.sheets[title]
+
+    def _sheet(self, name):
+        if name is None:
+            return next(iter(self.sheets.values()))
+        for title, sheet in self.sheets.items():
+            if title.casefold() == name.casefold():
+                return sheet
+        raise KeyError(f'Unable to parse range: {name}')
+
+    def properties(self):
+        with self.lock:
+            return [{'properties': {
+                'sheetId': sheet['sheetId'],
+                'title': title,
+                'gridProperties': {
+                    'rowCount': max(DEFAULT_ROW_COUNT, len(sheet['rows'])),
+                    'columnCount': max([DEFAULT_COLUMN_COUNT] + [len(row) for row in sheet['rows']]),
+                },
+            }} for title, sheet in self.sheets.items()]
+
+    def get(self, range_name):
+        """range_name の値を、Sheets API と同じく末尾の空のセル・行を除いて返します。"""
+        grid = parse_a1(range_name)
+        with self.lock:
+            rows = self._sheet(grid.sheet)['rows']
+            start_row = grid.start_row or 0
+            end_row = len(rows) if grid.end_row is None else min(grid.end_row, len(rows))
+            start_col = grid.start_col or 0
+            values = []
+            for row in rows[start_row:end_row]:
+                cells = list(row[start_col:grid.end_col])
+                while cells and cells[-1] in ('', None):
+                    cells.pop()
+                values.append(cells)
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def update(self, range_name, values):
+        grid = parse_a1(range_name)
+        start_row = grid.start_row or 0
+        start_col = grid.start_col or 0
+        with self.lock:
+            rows = self._sheet(grid.sheet)['rows']
+            for row_offset, row_values in enumerate(values):
+                row_index = start_row + row_offset
+                while len(rows) <= row_index:
+                    rows.append([])
+                row = rows[row_index]
+                for col_offset, value in enumerate(row_values):
+                    if value is None:
+                        continue
+                    col = start_col + col_offset
+                    if len(row) <= col:
+                        row.extend([''] * (col + 1 - len(row)))
+                    row[col] = value
+        width = max((len(row) for row in values), default=0)
+        return {
+            'updatedRange': format_a1(grid._replace(start_row=start_row, end_row=start_row + len(values),
+                                                    start_col=start_col, end_col=start_col + width)),
+            'updatedRows': len(values),
+            'updatedColumns': width,
+            'updatedCells': sum(len(row) for row in values),
+        }
+
+    def clear(self, range_name):
+        grid = parse_a1(range_name)
+        with self.lock:
+            rows = self._sheet(grid.sheet)['rows']
+            end_row = len(rows) if grid.end_row is None else min(grid.end_row, len(rows))
+            for row in rows[grid.start_row or 0:end_row]:
+                end_col = len(row) if grid.end_col is None else min(grid.end_col, len(row))
+                for col in range(grid.start_col or 0, end_col):
+                    row[col] = ''
+        return range_name
+
+    def batch_update(self, requests):
+        with self.lock:
+            by_id = {sheet['sheetId']: sheet for sheet in self.sheets.values()}
+            replies = []
+            for request in requests:
+                if 'deleteDimension' in request:
+                    dimension = request['deleteDimension']['range']
+                    if dimension.get('dimension') == 'ROWS':
+                        del by_id[dimension['sheetId']]['rows'][dimension['startIndex']:dimension['endIndex']]
+                elif 'insertDimension' in request:
+                    dimension = request['insertDimension']['range']
+                    if dimension.get('dimension') == 'ROWS':
+                        rows = by_id[dimension['sheetId']]['rows']
+                        rows[dimension['startIndex']:dimension['startIndex']] = \
+                            [[] for _ in range(dimension['endIndex'] - dimension['startIndex'])]
+                elif 'addSheet' in request:
+                    sheet = self._add_sheet(request['addSheet']['properties']['title'])
+                    replies.append({'addSheet': {'properties': {'sheetId': sheet['sheetId']}}})
+                    continue
+                replies.append({})
+        return replies
+
+
+class SheetsStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.calls)
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+
+
+class RateLimiter:
+    """1分あたりのリクエスト数を超えたら 429 を返すための固定長の記録です。"""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.lock = threading.Lock()
+        self.history = {'read': deque(), 'write': deque()}
+
+    def check(self, kind):
+        """超過していなければ None、超過していれば Retry-After の秒数を返します。"""
+        if not self.per_minute:
+            return None
+        now = time.time()
+        with self.lock:
+            history = self.history[kind]
+            while history and history[0] <= now - 60:
+                history.popleft()
+            if len(history) >= self.per_minute:
+                return max(1, int(history[0] + 60 - now) + 1)
+            history.append(now)
+        return None
+
+
+_image_bytes = None
+
+
+def image_bytes():
+    """出品画像の代わりの 800x600 の JPEG を返します (Pillow が必要です)。"""
+    global _image_bytes
+    if _image_bytes is None:
+        from PIL import Image
+
+        buffered = io.BytesIO()
+        Image.new('RGB', (800, 600), (200, 120, 80)).save(buffered, format='JPEG', quality=90)
+        _image_bytes = buffered.getvalue()
+    return _image_bytes
+
+
+class FakeSheetsHandler(BaseHTTPRequestHandler):
+    spreadsheet = None
+    stats = None
+    limiter = None
+    latency = 0.0
+    inject_429 = 0.0
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        """リクエストの本文を Content-Type に合わせて読み込みます。
+
+        トークンの発行 (/token) はフォーム形式 (grant_type=...&assertion=...)、それ以外は JSON です。
+        """
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type == 'application/x-www-form-urlencoded':
+            return {key: values[-1] for key, values in parse_qs(data.decode('utf-8')).items()}
+        return json.loads(data) if data else {}
+
+    def _send_json(self, data, status=200, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message, headers=None):
+        self._send_json({'error': {'code': status, 'message': message}}, status=status, headers=headers)
+
+    def _throttle(self, name, kind):
+        """遅延を入れ、レート制限または 429 の注入に該当すれば 429 を返して True を返します。"""
+        self.stats.count(name)
+        if self.latency:
+            time.sleep(self.latency)
+        retry_after = self.limiter.check(kind)
+        if retry_after is None and self.inject_429 and random.random() < self.inject_429:
+            retry_after = 1
+        if retry_after is not None:
+            self.stats.count('429')
+            self._send_error(429, 'Quota exceeded for quota metric', {'Retry-After': str(retry_after)})
+            return True
+        return False
+
+    def _route(self, method):
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        query = parse_qs(url.query)
+        try:
+            body = self._read_body() if method in ('POST', 'PUT') else None
+        except ValueError as e:
+            self._send_error(400, f'Invalid request body: {e}')
+            return
+
+        if path == '/token':
+            self.stats.count('token')
+            self._send_json({'access_token': 'fake-token', 'expires_in': 3600, 'token_type': 'Bearer'})
+            return
+        if path.startswith('/_image/'):
+            self.stats.count('image')
+            content = image_bytes()
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('ETag', '"fake-image"')
+            self.end_headers()
+            self.wfile.write(content)
+            return
+        if path == '/_stats':
+            self._send_json(self.stats.snapshot())
+            return
+        if not path.startswith('/v4/spreadsheets/'):
+            self._send_error(404, 'Not found')
+            return
+
+        rest = path[len('/v4/spreadsheets/'):]
+        spreadsheet_id, _, rest = rest.partition('/')
+        if ':' in spreadsheet_id and not rest:
+            spreadsheet_id, _, action = spreadsheet_id.partition(':')
+            rest = ':' + action
+
+        try:
+            if rest == '' and method == 'GET':
+                if not self._throttle('spreadsheets.get', 'read'):
+                    self._send_json({'spreadsheetId': spreadsheet_id, 'sheets': self.spreadsheet.properties()})
+            elif rest == ':batchUpdate' and method == 'POST':
+                if not self._throttle('spreadsheets.batchUpdate', 'write'):
+                    replies = self.spreadsheet.batch_update(body.get('requests', []))
+                    self._send_json({'spreadsheetId': spreadsheet_id, 'replies': replies})
+            elif rest == 'values:batchGet' and method == 'GET':
+                if not self._throttle('values.batchGet', 'read'):
+                    self._send_json({'spreadsheetId': spreadsheet_id, 'valueRanges': [
+                        {'range': range_name, 'majorDimension': 'ROWS', 'values': self.spreadsheet.get(range_name)}
+                        for range_name in query.get('ranges', [])]})
+            elif rest == 'values:batchUpdate' and method == 'POST':
+                if not self._throttle('values.batchUpdate', 'write'):
+                    responses = [self.spreadsheet.update(item['range'], item.get('values', []))
+                                 for item in body.get('data', [])]
+                    self._send_json({'spreadsheetId': spreadsheet_id, 'responses': responses,
+                                     'totalUpdatedCells': sum(r['updatedCells'] for r in responses)})
+            elif rest == 'values:batchClear' and method == 'POST':
+                if not self._throttle('values.batchClear', 'write'):
+                    cleared = [self.spreadsheet.clear(range_name) for range_name in body.get('ranges', [])]
+                    self._send_json({'spreadsheetId': spreadsheet_id, 'clearedRanges': cleared})
+            elif rest.startswith('values/') and method == 'GET':
+                if not self._throttle('values.get', 'read'):
+                    range_name = rest[len('values/'):]
+                    self._send_json({'range': range_name, 'majorDimension': 'ROWS',
+                                     'values': self.spreadsheet.get(range_name)})
+            elif rest.startswith('values/') and method == 'PUT':
+                if not self._throttle('values.update', 'write'):
+                    result = self.spreadsheet.update(rest[len('values/'):], body.get('values', []))
+                    self._send_json(dict(result, spreadsheetId=spreadsheet_id))
+            else:
+                self._send_error(404, f'Unknown method {method} {path}')
+        except (KeyError, ValueError) as e:
+            self._send_error(400, str(e))
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+    def do_PUT(self):
+        self._route('PUT')
+
+
+def serve(port=8200, latency=0.0, rate_limit=None, inject_429=0.0, spreadsheet=None):
+    """代替サーバーを作成します。port=0 の場合は空いているポートを使います。"""
+    handler = type('Handler', (FakeSheetsHandler,), {
+        'spreadsheet': spreadsheet or FakeSpreadsheet(),
+        'stats': SheetsStats(),
+        'limiter': RateLimiter(rate_limit),
+        'latency': latency,
+        'inject_429': inject_429,
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Google Sheets API の代替サーバー')
+    parser.add_argument('--port', type=int, default=8200)
+    parser.add_argument('--latency', type=float, default=0.0, help='1リクエストあたりの応答時間 (秒)')
+    parser.add_argument('--rate-limit', type=int, help='読み込み・書き込みそれぞれの1分あたりの上限')
+    parser.add_argument('--inject-429', type=float, default=0.0, help='429 を返す確率')
+    parser.add_argument('--sheets', default='出品用CSV,Setting,AI-memo', help='作成するシート名 (カンマ区切り)')
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency, args.rate_limit, args.inject_429)
+    for title in args.sheets.split(','):
+        server.RequestHandlerClass.spreadsheet.add_sheet(title)
+    print(f'Fake Sheets API listening on http://127.0.0.1:{args.port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""GAS_ListingDataTranscription.py の FastAPI サーバーに負荷をかけて、スループットと遅延を計測します。
+
+使い方:
+    python benchmarks/gas_load_benchmark.py --url http://127.0.0.1:8000 \
+        --path "/get-values/AI-memo!A1:C100" --requests 500 --concurrency 50
+
+POST の場合は --method POST --body '[["a", "b"]]' のように JSON の本文を指定します。
+パスの {i} はリクエストの番号に置き換わります (例: --path "/update-values/AI-memo!AB{i}")。
+1秒あたりのリクエスト数と遅延 (p50 / p90 / p99, ミリ秒) を JSON で出力します。
+変更前後の比較は、それぞれのコミットでサーバーを起動して同じ引数で実行します。
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+
+def percentile(sorted_values, ratio):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(ratio * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run(url, method, body, total, concurrency, timeout):
+    latencies = []
+    statuses = {}
+    counter = iter(range(total))
+
+    async def worker(session):
+        for index in counter:
+            start = time.perf_counter()
+            try:
+                async with session.request(method, url.replace('{i}', str(index + 1)), json=body) as response:
+                    await response.read()
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'url': url,
+        'method': method,
+        'requests': total,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(total / elapsed, 1),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 1),
+            'p90': round(percentile(latencies, 0.90), 1),
+            'p99': round(percentile(latencies, 0.99), 1),
+            'max': round(latencies[-1], 1),
+        },
+        'statuses': statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FastAPI サーバーの負荷テスト')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--path', default='/get-values/AI-memo!A1:C100')
+    parser.add_argument('--method', default='GET')
+    parser.add_argument('--body', help='POST する JSON')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    body = json.loads(args.body) if args.body else None
+    result = asyncio.run(run(args.url.rstrip('/') + args.path, args.method.upper(), body,
+                             args.requests, args.concurrency, args.timeout))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""出品画像のサムネイル作成 (縮小・JPEG エンコード) の速度を計測します。
+
+使い方:
+    python benchmarks/image_encode_benchmark.py path/to/sample_photos [--repeat 3]
+
+フォルダ内の画像 (jpg / jpeg / png / webp) を次の方法で処理し、
+1秒あたりの処理枚数とピークメモリ (RSS) を JSON で出力します。
+    full:       従来の方法 (全解像度でデコードしてから縮小)
+    draft:      JPEG の draft モードで縮小版をデコード
+    draft_pool: draft モード + CPU コア数のプロセスプール
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ImageCache import encode_thumbnail  # noqa: E402
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def peak_rss_mb():
+    """このプロセスと子プロセスのピーク RSS (MB) を返します。取得できない環境では None です。"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024  # macOS はバイト、Linux は KB
+    return {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / divisor, 1),
+    }
+
+
+def _encode_legacy(content):
+    return encode_thumbnail(content, (150, 150), draft=False)
+
+
+def _encode_draft(content):
+    return encode_thumbnail(content, (150, 150), draft=True)
+
+
+def run_mode(mode, images, repeat, workers):
+    start = time.perf_counter()
+    count = 0
+    if mode == 'draft_pool':
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for _ in range(repeat):
+                count += sum(1 for _ in pool.map(_encode_draft, images, chunksize=4))
+    else:
+        encode = _encode_legacy if mode == 'full' else _encode_draft
+        for _ in range(repeat):
+            for content in images:
+                encode(content)
+                count += 1
+    elapsed = time.perf_counter() - start
+    return {'images': count, 'seconds': round(elapsed, 3), 'images_per_second': round(count / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('folder')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--modes', default='full,draft,draft_pool')
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(args.folder, name) for name in os.listdir(args.folder)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        parser.error(f"No images found in {args.folder}")
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+
+    modes = args.modes.split(',')
+    if len(modes) == 1:
+        result = run_mode(modes[0], images, args.repeat, args.workers)
+        result['peak_rss_mb'] = peak_rss_mb()
+        print(json.dumps(result))
+        return
+
+    # ピーク RSS をモードごとに測るため、各モードを別プロセスで実行する
+    results = {'images': len(images), 'bytes': sum(map(len, images)), 'workers': args.workers}
+    for mode in modes:
+        completed = subprocess.run(
+            [sys.executable, __file__, args.folder, '--repeat', str(args.repeat),
+             '--workers', str(args.workers), '--modes', mode],
+            capture_output=True, text=True, check=True)
+        results[mode] = json.loads(completed.stdout)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
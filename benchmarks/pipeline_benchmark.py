@@ -0,0 +1,385 @@
+"""ローカルの代替サーバー (fake_sheets.py / fake_openai.py) を使って各処理の速度を計測します。
+
+使い方:
+    python benchmarks/pipeline_benchmark.py --sizes 100,1000,10000 --output results.json
+    python benchmarks/pipeline_benchmark.py --sizes 50000 --scenarios transcription,fastapi \
+        --sheets-latency 0.05 --sheets-rate-limit 300 --inject-429 0.01
+
+シナリオ:
+    transcription: ListingDataTranscription.main (出品用CSV -> AI-memo)
+    ai:            AI to Create Title Description ItemDetails.py の main (--ai-mode で生成モードを指定)
+    fastapi:       GAS_ListingDataTranscription.py を uvicorn で起動し、/get-values の繰り返し、
+                   /update-values の同時書き込み、/batch-get?stream=true の全行取得を計測
+
+各シナリオは別プロセスで実行し、実行時間・1秒あたりの行数・ピークメモリ (RSS)・
+API ごとの呼び出し回数を JSON で出力します。コミットごとの比較に使えるよう、
+出力にはコミットのハッシュを含めます。
+子プロセスが ERROR 以上のログを出した場合や、Sheets API (ai では OpenAI API も) を1回も呼ばなかった場合は
+そのシナリオを失敗 ("error") とし、失敗したシナリオがあれば終了コード 1 で終わります。
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, ROOT)
+
+import fake_openai  # noqa: E402
+import fake_sheets  # noqa: E402
+from ListingDataTranscription import AI_MEMO_HEADERS  # noqa: E402
+
+SCRIPTS = {
+    'transcription': os.path.join(ROOT, 'ListingDataTranscription.py'),
+    'ai': os.path.join(ROOT, 'AI to Create Title Description ItemDetails.py'),
+}
+SPREADSHEET_ID = 'benchmark-spreadsheet'
+CSV_HEADERS = ['Brand', 'Color', 'Size', 'Material', 'Condition']
+IMAGES_PER_ROW = 3
+MAX_REPORTED_ERRORS = 5  # 結果に含めるエラーログの件数
+# 計測として意味のある実行かどうかを判定するために数えない呼び出し (認証と画像の取得)
+NON_API_CALLS = ('token', 'image', '429')
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024  # macOS はバイト、Linux は KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor, 1)
+
+
+def process_peak_rss_mb(pid):
+    """実行中のプロセスのピーク RSS (MB) を返します。/proc がない環境では None です。"""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def write_service_account(path, token_uri):
+    """代替サーバーの token_uri を使うサービスアカウントの JSON を作成します。"""
+    try:
+        import rsa
+
+        _, private_key = rsa.newkeys(2048)
+        private_key_pem = private_key.save_pkcs1().decode('utf-8')
+    except ImportError:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa as crypto_rsa
+
+        private_key_pem = crypto_rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()).decode('utf-8')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'type': 'service_account',
+            'project_id': 'benchmark',
+            'private_key_id': 'benchmark',
+            'private_key': private_key_pem,
+            'client_email': 'benchmark@benchmark.iam.gserviceaccount.com',
+            'client_id': '0',
+            'token_uri': token_uri,
+        }, f)
+
+
+def seed_spreadsheet(spreadsheet, rows, base_url):
+    """出品用CSV・Setting・AI-memo シートに rows 行の合成データを作成します。"""
+    for title in ('出品用CSV', 'Setting', 'AI-memo'):
+        spreadsheet.add_sheet(title)
+    spreadsheet.update('Setting!B2', [['https://drive.google.com/file/d/placeholder/view']])
+    spreadsheet.update('Setting!F1', [['sk-benchmark-1'], ['sk-benchmark-2']])
+    spreadsheet.update('出品用CSV!AF1', [CSV_HEADERS])
+
+    titles, descriptions, skus, images, memo = [], [], [], [], []
+    for i in range(rows):
+        urls = [f'{base_url}_image/{i}-{j}.jpg' for j in range(IMAGES_PER_ROW)]
+        titles.append([f'商品タイトル {i}'])
+        descriptions.append([f'商品説明 {i} ' + 'ヴィンテージ ' * 20])
+        skus.append([f'SKU-{i:06d}'])
+        images.append(['|'.join(urls)])
+        memo.append([titles[-1][0], descriptions[-1][0], skus[-1][0]] + urls)
+    spreadsheet.update('出品用CSV!AD2', titles)
+    spreadsheet.update('出品用CSV!AE2', descriptions)
+    spreadsheet.update('出品用CSV!B2', skus)
+    spreadsheet.update('出品用CSV!H2', images)
+    # ai / fastapi シナリオ用に転記済みの AI-memo を作成する
+    spreadsheet.update('AI-memo!A1', [AI_MEMO_HEADERS + CSV_HEADERS])
+    spreadsheet.update('AI-memo!A2', memo)
+
+
+def run_child(scenario, overrides, log_level):
+    """子プロセスでスクリプトの main を実行し、実行時間・ピーク RSS・エラーログを JSON で出力します。"""
+    import importlib.util
+    import logging
+
+    class ErrorCollector(logging.Handler):
+        def __init__(self):
+            super().__init__(logging.ERROR)
+            self.messages = []
+
+        def emit(self, record):
+            self.messages.append(record.getMessage()[:500])
+
+    sys.path.insert(0, ROOT)
+    spec = importlib.util.spec_from_file_location(f'benchmark_{scenario}', SCRIPTS[scenario])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    logging.getLogger().setLevel(log_level)
+    # 表示するログのレベルに関係なく、ERROR 以上のログは全て数える
+    errors = ErrorCollector()
+    logging.getLogger().addHandler(errors)
+    for name, value in overrides.items():
+        setattr(module, name, value)
+
+    start = time.perf_counter()
+    outcome = module.main()
+    seconds = round(time.perf_counter() - start, 3)
+    if isinstance(outcome, dict) and 'error' in outcome:
+        errors.messages.append(str(outcome['error']))
+    print(json.dumps({'seconds': seconds, 'peak_rss_mb': peak_rss_mb(), 'errors': errors.messages},
+                     ensure_ascii=False))
+
+
+def api_call_count(calls):
+    return sum(count for name, count in calls.items() if name not in NON_API_CALLS)
+
+
+def check_result(result):
+    """計測結果が実際に処理した実行のものかを確認し、問題の一覧を返します (空なら成功)。"""
+    problems = list(result.get('error') or [])
+    errors = result.pop('errors', [])
+    if errors:
+        problems.append(f"{len(errors)} errors logged: {errors[:MAX_REPORTED_ERRORS]}")
+    if not api_call_count(result['api_calls']['sheets']):
+        problems.append('no Sheets API calls were made')
+    if result['scenario'] == 'ai' and not api_call_count(result['api_calls']['openai']):
+        problems.append('no OpenAI API calls were made')
+    for name, phase in result.get('phases', {}).items():
+        failed = {status: count for status, count in phase.get('statuses', {}).items()
+                  if not status.startswith('2')}
+        if failed:
+            problems.append(f"{name}: non-2xx responses {failed}")
+        if 'rows' in phase and not phase['rows']:
+            problems.append(f"{name}: no rows were streamed")
+    return problems
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def count_stream_rows(url, body):
+    """/batch-get?stream=true の NDJSON を読み、(行数, 秒) を返します。"""
+    request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    start = time.perf_counter()
+    rows = 0
+    with urllib.request.urlopen(request, timeout=600) as response:
+        for line in response:
+            if line.strip():
+                rows += 1
+    return rows, time.perf_counter() - start
+
+
+def server_log_errors(log_path):
+    """uvicorn のログから ERROR 以上の行とトレースバックの最後の行を返します。"""
+    try:
+        with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    errors = []
+    in_traceback = False
+    for line in lines:
+        if line.startswith('Traceback'):
+            in_traceback = True
+        elif in_traceback and not line.startswith(' '):
+            errors.append(line)  # 例外の種類とメッセージ
+            in_traceback = False
+        elif ' - ERROR - ' in line or ' - CRITICAL - ' in line:
+            errors.append(line)
+    return errors
+
+
+def run_fastapi(env, size, log_path):
+    """GAS_ListingDataTranscription.py を uvicorn で起動して各エンドポイントを計測します。
+
+    サーバーのログはファイルに残し、ERROR 以上のログは結果の errors に含めます。
+    """
+    port = free_port()
+    env = dict(env, MM_LOG_LEVEL='WARNING', MM_LOG_FORMAT='text')
+    with open(log_path, 'w', encoding='utf-8') as log:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'GAS_ListingDataTranscription:app',
+             '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+            cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        result = measure_fastapi(server, f'http://127.0.0.1:{port}', size)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    result['errors'] = server_log_errors(log_path)
+    return result
+
+
+def measure_fastapi(server, base_url, size):
+    from gas_load_benchmark import run as load_test
+
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(f'{base_url}/get-values/Setting!B2', timeout=1).read()
+            break
+        except OSError:
+            if server.poll() is not None:
+                return {'error': [f'uvicorn exited with status {server.returncode} before the server started']}
+            time.sleep(0.1)
+    else:
+        return {'error': ['uvicorn did not start within 30 seconds']}
+
+    requests = min(size, 2000)
+    start = time.perf_counter()
+    phases = {
+        'get_values': asyncio.run(load_test(
+            f'{base_url}/get-values/Setting!B2', 'GET', None, requests, 50, 60)),
+        'update_values': asyncio.run(load_test(
+            f'{base_url}/update-values/AI-memo!AE{{i}}', 'POST', [['benchmark']], requests, 50, 60)),
+    }
+    rows, seconds = count_stream_rows(f'{base_url}/batch-get?stream=true', ['AI-memo'])
+    phases['batch_get_stream'] = {'rows': rows, 'seconds': round(seconds, 3),
+                                  'rows_per_second': round(rows / seconds, 1) if seconds else None}
+    return {'seconds': round(time.perf_counter() - start, 3), 'phases': phases,
+            'peak_rss_mb': process_peak_rss_mb(server.pid)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='代替サーバーを使ったパイプラインのベンチマーク')
+    parser.add_argument('--sizes', default='100,1000', help='行数 (カンマ区切り)')
+    parser.add_argument('--scenarios', default='transcription,ai,fastapi')
+    parser.add_argument('--ai-mode', default='async', help="AI スクリプトの GENERATION_MODE")
+    parser.add_argument('--sheets-latency', type=float, default=0.0)
+    parser.add_argument('--sheets-rate-limit', type=int, help='Sheets API の1分あたりの上限 (読み込み・書き込みそれぞれ)')
+    parser.add_argument('--openai-latency', type=float, default=0.0)
+    parser.add_argument('--openai-rate-limit', type=int)
+    parser.add_argument('--inject-429', type=float, default=0.0, help='両方の代替サーバーで 429 を返す確率')
+    parser.add_argument('--client-quota', type=int, default=1000000,
+                        help='スクリプト側の Sheets クォータ (1分あたり)。代替サーバーの上限と合わせると 429 を避けられる')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help='結果を保存する JSON ファイル (省略時は標準出力)')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--overrides', default='{}', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, json.loads(args.overrides), args.log_level)
+        return
+
+    spreadsheet = fake_sheets.FakeSpreadsheet()
+    sheets_server = fake_sheets.serve(0, args.sheets_latency, args.sheets_rate_limit, args.inject_429, spreadsheet)
+    openai_server = fake_openai.serve(0, args.openai_latency, 0.0, args.openai_rate_limit, args.inject_429)
+    for server in (sheets_server, openai_server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    sheets_url = f'http://127.0.0.1:{sheets_server.server_address[1]}/'
+    openai_url = f'http://127.0.0.1:{openai_server.server_address[1]}/v1'
+
+    work_dir = tempfile.mkdtemp(prefix='mm-benchmark-')
+    service_account_file = os.path.join(work_dir, 'service_account.json')
+    write_service_account(service_account_file, f'{sheets_url}token')
+
+    results = []
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            for scenario in args.scenarios.split(','):
+                # 各シナリオは同じ初期状態・空のキャッシュから始める
+                spreadsheet.sheets.clear()
+                seed_spreadsheet(spreadsheet, size, sheets_url)
+                run_dir = tempfile.mkdtemp(dir=work_dir)
+                env = dict(os.environ, **{
+                    'MM_SHEETS_API_ENDPOINT': sheets_url,
+                    'OPENAI_API_BASE': openai_url,
+                    'MM_SERVICE_ACCOUNT_FILE': service_account_file,
+                    'MM_SPREADSHEET_ID': SPREADSHEET_ID,
+                    'MM_SHEETS_READS_PER_MINUTE': str(args.client_quota),
+                    'MM_SHEETS_WRITES_PER_MINUTE': str(args.client_quota),
+                })
+                for name in ('TOKEN_CACHE_DIR', 'QUOTA_DIR', 'IMAGE_CACHE_DIR', 'PROGRESS_DIR', 'BATCH_STATE_DIR'):
+                    env[f'MM_{name}'] = os.path.join(run_dir, name.lower())
+                env['MM_GENERATION_CACHE_PATH'] = os.path.join(run_dir, 'generation_cache.sqlite3')
+                sheets_server.RequestHandlerClass.stats.reset()
+                fake_openai.reset_stats()
+
+                result = {'scenario': scenario, 'rows': size}
+                start = time.perf_counter()
+                if scenario == 'fastapi':
+                    result.update(run_fastapi(env, size, os.path.join(run_dir, 'uvicorn.log')))
+                else:
+                    overrides = {'GENERATION_MODE': args.ai_mode, 'BATCH_WAIT': True,
+                                 'BATCH_POLL_INTERVAL': 1} if scenario == 'ai' else {}
+                    if scenario == 'ai':
+                        result['mode'] = args.ai_mode
+                    completed = subprocess.run(
+                        [sys.executable, __file__, '--child', scenario, '--overrides', json.dumps(overrides),
+                         '--log-level', args.log_level],
+                        cwd=ROOT, env=env, capture_output=True, text=True)
+                    if completed.returncode != 0:
+                        result['error'] = completed.stderr.strip().splitlines()[-1:]
+                    else:
+                        result.update(json.loads(completed.stdout.strip().splitlines()[-1]))
+                        result['rows_per_second'] = round(size / result['seconds'], 1) if result['seconds'] else None
+                result['wall_seconds'] = round(time.perf_counter() - start, 3)
+                result['api_calls'] = {'sheets': sheets_server.RequestHandlerClass.stats.snapshot(),
+                                       'openai': dict(fake_openai.stats)}
+                problems = check_result(result)
+                if problems:
+                    result['error'] = problems
+                results.append(result)
+                status = f"FAILED {problems}" if problems else f"{result.get('seconds', result['wall_seconds'])}s"
+                print(f"{scenario} {size} rows: {status}", file=sys.stderr)
+    finally:
+        sheets_server.shutdown()
+        openai_server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps({
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('child', 'overrides', 'output')},
+        'results': results,
+    }, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    if any('error' in result for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""各スクリプトの起動時間 (最初のリクエストまでの時間) を計測します。
+
+使い方:
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --service-account-file key.json --spreadsheet-id XXX
+
+計測は毎回新しい Python プロセスで行い、結果を JSON で出力します。
+サービスアカウントを指定した場合は、トークンキャッシュなし (cold) と
+キャッシュあり (warm) の両方で最初の values.get までの時間を計測します。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPETS = {
+    'import_sheet_client': 'import SheetClient',
+    'import_ai_script': (
+        'import importlib.util\n'
+        'spec = importlib.util.spec_from_file_location('
+        '"ai_script", "AI to Create Title Description ItemDetails.py")\n'
+        'spec.loader.exec_module(importlib.util.module_from_spec(spec))'
+    ),
+    'import_transcription': 'import ListingDataTranscription',
+    'import_googleapiclient': 'import googleapiclient.discovery',
+}
+
+FIRST_REQUEST_SNIPPET = '''
+import sys, time
+start = time.perf_counter()
+from SheetClient import build_sheets_service, load_credentials
+service = build_sheets_service(load_credentials(sys.argv[1]))
+service.spreadsheets().values().get(spreadsheetId=sys.argv[2], range='Setting!B2').execute()
+print(time.perf_counter() - start)
+'''
+
+
+def run_snippet(code, args=(), env=None):
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-c', code, *args], cwd=ROOT, env=env,
+                               capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        return None, completed.stderr.strip().splitlines()[-1:] or ['failed']
+    return elapsed, completed.stdout.strip()
+
+
+def measure(code, repeat, args=(), env=None, inner=False):
+    samples = []
+    for _ in range(repeat):
+        elapsed, output = run_snippet(code, args, env)
+        if elapsed is None:
+            return {'error': output[0]}
+        samples.append(float(output) if inner else elapsed)
+    return {'median_s': round(statistics.median(samples), 4),
+            'min_s': round(min(samples), 4), 'samples': len(samples)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--service-account-file')
+    parser.add_argument('--spreadsheet-id')
+    args = parser.parse_args()
+
+    results = {'python': sys.version.split()[0]}
+    results['baseline_interpreter'] = measure('pass', args.repeat)
+    for name, code in IMPORT_SNIPPETS.items():
+        results[name] = measure(code, args.repeat)
+
+    if args.service_account_file and args.spreadsheet_id:
+        request_args = (args.service_account_file, args.spreadsheet_id)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = dict(os.environ, MM_TOKEN_CACHE_DIR=cache_dir)
+            # cold: 毎回キャッシュを空にして計測
+            cold = []
+            for _ in range(args.repeat):
+                for name in os.listdir(cache_dir):
+                    os.remove(os.path.join(cache_dir, name))
+                cold.append(measure(FIRST_REQUEST_SNIPPET, 1, request_args, env, inner=True))
+            errors = [c for c in cold if 'error' in c]
+            results['first_request_cold'] = errors[0] if errors else {
+                'median_s': round(statistics.median(c['median_s'] for c in cold), 4),
+                'samples': len(cold)}
+            results['first_request_warm'] = measure(
+                FIRST_REQUEST_SNIPPET, args.repeat, request_args, env, inner=True)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
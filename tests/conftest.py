@@ -0,0 +1,21 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# スクリプトはリポジトリ直下のモジュールを import するため、テストからも同じように読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def ai_script():
+    """ファイル名に空白を含む AI スクリプトをモジュールとして読み込みます。"""
+    pytest.importorskip('requests')
+    pytest.importorskip('aiohttp')
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'AI to Create Title Description ItemDetails.py')
+    spec = importlib.util.spec_from_file_location('ai_item_details', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,81 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from AsyncSheetClient import AsyncSheetClient, SheetsApiError  # noqa: E402
+from SheetQuota import QuotaScheduler  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, status, body, reason='', headers=None):
+        self.status = status
+        self.body = body
+        self.reason = reason
+        self.headers = headers or {}
+
+    async def text(self, errors='strict'):
+        return self.body
+
+    async def json(self, content_type='application/json'):
+        return json.loads(self.body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeSession:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        return self.responses.pop(0)
+
+    async def close(self):
+        pass
+
+
+class FakeCredentials:
+    token = 'token'
+    expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+def make_client(tmp_path, monkeypatch, *responses):
+    monkeypatch.setattr('AsyncSheetClient.backoff_delay', lambda attempt, retry_after=None: 0)
+    client = AsyncSheetClient(FakeCredentials(), 'sheet-id', scheduler=QuotaScheduler('test', str(tmp_path)))
+    client.session = FakeSession(*responses)
+    client.token_lock = asyncio.Lock()
+    return client
+
+
+def test_html_error_page_is_retried(tmp_path, monkeypatch):
+    client = make_client(tmp_path, monkeypatch,
+                         FakeResponse(502, '<html><body>Bad Gateway</body></html>', 'Bad Gateway'),
+                         FakeResponse(200, '{"values": [["a"]]}'))
+    assert asyncio.run(client.get_values('Setting!B2')) == {'values': [['a']]}
+    assert len(client.session.requests) == 2
+
+
+def test_html_error_page_becomes_sheets_api_error(tmp_path, monkeypatch):
+    client = make_client(tmp_path, monkeypatch, FakeResponse(404, '<html>Not Found</html>', 'Not Found'))
+    with pytest.raises(SheetsApiError) as error:
+        asyncio.run(client.get_values('Setting!B2'))
+    assert error.value.status == 404
+    assert 'Not Found' in str(error.value)
+
+
+def test_json_error_message_is_used(tmp_path, monkeypatch):
+    body = json.dumps({'error': {'code': 400, 'message': 'Unable to parse range: Missing!A1'}})
+    client = make_client(tmp_path, monkeypatch, FakeResponse(400, body, 'Bad Request'))
+    with pytest.raises(SheetsApiError) as error:
+        asyncio.run(client.get_values('Missing!A1'))
+    assert error.value.status == 400
+    assert str(error.value) == 'Unable to parse range: Missing!A1'
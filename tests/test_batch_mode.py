@@ -0,0 +1,133 @@
+import json
+
+from ListingDataTranscription import AI_MEMO_HEADERS
+
+
+class FakeBatchService:
+    api_key = 'sk-a'
+
+    def __init__(self):
+        self.lines = []
+
+    def submit(self, jsonl_path, metadata=None):
+        with open(jsonl_path, 'r', encoding='utf-8') as f:
+            self.submitted = [json.loads(line) for line in f]
+        return {'id': 'batch-1'}
+
+    def get(self, batch_id):
+        return {'status': 'completed', 'output_file_id': 'file-1'}
+
+    def iter_file_lines(self, file_id):
+        return iter(self.lines)
+
+
+class FakeSheetService:
+    spreadsheet_id = 'sheet-id'
+
+    def __init__(self, skus):
+        self.skus = skus
+
+    def get_values(self, range_name):
+        assert range_name == 'AI-memo!C2:C'
+        return [[sku] for sku in self.skus]
+
+
+def result_line(custom_id, title):
+    arguments = json.dumps({'NewTitle': title, 'NewDescription': f'{title} description', 'ItemSpecifics': {}})
+    body = {'choices': [{'message': {'function_call': {'arguments': arguments}}}]}
+    return {'custom_id': custom_id, 'response': {'status_code': 200, 'body': body}}
+
+
+def submit_and_collect(ai_script, monkeypatch, tmp_path, current_skus):
+    written = []
+    monkeypatch.setattr(ai_script.BatchUpdater, 'batch_update_values',
+                        staticmethod(lambda sheet_service, data, batch_size=None: written.extend(data) or True))
+    batch_service = FakeBatchService()
+    state_path = str(tmp_path / 'sheet-id.json')
+    jobs = [('', 'a', 'desc a'), ('', 'b', 'desc b'), ('', 'c', 'desc c')]
+    ai_script.submit_batch(batch_service, state_path, jobs, ['A', 'B', 'C'], AI_MEMO_HEADERS)
+    with open(state_path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    assert state['requests']['row-3'] == {'row': 3, 'sku': 'B', 'cache_key': None}
+
+    batch_service.lines = [result_line(line['custom_id'], line['custom_id']) for line in batch_service.submitted]
+    assert ai_script.collect_batch(batch_service, FakeSheetService(current_skus), state_path)
+    return {item['range']: item['values'] for item in written}
+
+
+def test_results_are_written_to_the_submitted_rows(ai_script, monkeypatch, tmp_path):
+    written = submit_and_collect(ai_script, monkeypatch, tmp_path, ['A', 'B', 'C'])
+    assert written == {'AI-memo!AB2:AC4': [['row-2', 'row-2 description'],
+                                           ['row-3', 'row-3 description'],
+                                           ['row-4', 'row-4 description']]}
+
+
+def test_results_follow_moved_skus_and_skip_removed_ones(ai_script, monkeypatch, tmp_path):
+    # 送信後に2行目が削除され、C の後に行が挿入された
+    written = submit_and_collect(ai_script, monkeypatch, tmp_path, ['B', 'C', 'D'])
+    assert written == {'AI-memo!AB2:AC3': [['row-3', 'row-3 description'],
+                                           ['row-4', 'row-4 description']]}
+
+
+def test_resolve_batch_row(ai_script):
+    current = ai_script.SheetTable.from_rows('AI-memo', [['A'], [''], ['C']], start_row=1)
+    assert ai_script.resolve_batch_row(current, {'row': 2, 'sku': 'A'}) == 2
+    assert ai_script.resolve_batch_row(current, {'row': 2, 'sku': 'C'}) == 4
+    assert ai_script.resolve_batch_row(current, {'row': 3, 'sku': ''}) == 3
+    assert ai_script.resolve_batch_row(current, {'row': 2, 'sku': ''}) is None
+    assert ai_script.resolve_batch_row(current, {'row': 2, 'sku': 'Z'}) is None
+    assert ai_script.resolve_batch_row(current, {'row': 9}) == 9
+
+
+class FakeImageResponse:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+def test_undecodable_image_fails_only_its_row(ai_script, monkeypatch, tmp_path):
+    import io
+
+    from PIL import Image
+
+    buffered = io.BytesIO()
+    Image.new('RGB', (40, 30), (200, 120, 80)).save(buffered, format='JPEG')
+    jpeg = buffered.getvalue()
+
+    class FakeSession:
+        def get(self, url, headers=None, timeout=None):
+            # 画像の代わりに HTML のエラーページを返す URL
+            return FakeImageResponse(b'<html>Not Found</html>' if url.endswith('broken.jpg') else jpeg)
+
+    monkeypatch.setattr(ai_script, 'USE_IMAGE_CACHE', False)
+    monkeypatch.setattr(ai_script, 'USE_PROCESS_POOL', False)
+    monkeypatch.setattr(ai_script.ImageService, 'get_session', classmethod(lambda cls: FakeSession()))
+    ai_script.ImageService.reset()
+    batch_service = FakeBatchService()
+    jobs = [('https://example.com/a.jpg', 'a', 'desc a'), ('https://example.com/broken.jpg', 'b', 'desc b'),
+            ('https://example.com/c.jpg', 'c', 'desc c')]
+    state_path = str(tmp_path / 'sheet-id.json')
+    unsent = ai_script.submit_batch(batch_service, state_path, jobs, ['A', 'B', 'C'], AI_MEMO_HEADERS)
+    ai_script.ImageService.reset()
+
+    assert list(unsent) == [1]
+    assert isinstance(unsent[1], Exception)
+    assert [line['custom_id'] for line in batch_service.submitted] == ['row-2', 'row-4']
+    with open(state_path, 'r', encoding='utf-8') as f:
+        assert sorted(json.load(f)['requests']) == ['row-2', 'row-4']
+
+
+def test_add_result_cells_writes_by_header_name(ai_script):
+    headers = AI_MEMO_HEADERS + ['Brand', 'SKU', 'Color', 'Brand']
+    table = ai_script.result_table(headers)
+    assert ai_script.get_item_specifics_headers(table) == ['Brand', 'SKU', 'Color', 'Brand']
+    result = ('title', 'description', {'Brand': 'Acme', 'SKU': 'X-1', 'Size': 'L', 'Color': None})
+    assert ai_script.add_result_cells(table, 0, result)
+    # SKU は C列を指すため商品情報としては書き込まず、同名の Brand は最初の列に書き込む
+    assert table.updates == {(1, 27): 'title', (1, 28): 'description', (1, 29): 'Acme'}
+    assert not ai_script.add_result_cells(table, 1, 'Request Error')
@@ -0,0 +1,29 @@
+import asyncio
+import json
+
+
+def test_broken_image_fails_only_its_row(ai_script, monkeypatch):
+    monkeypatch.setattr(ai_script, 'USE_IMAGE_CACHE', False)
+
+    async def encode(self, url, max_size=(150, 150)):
+        if url.endswith('broken.jpg'):
+            raise OSError('cannot identify image file')
+        return 'aW1hZ2U='
+
+    async def post_chat_completion(self, payload, index):
+        text = json.dumps(payload['messages'], ensure_ascii=False)
+        skus = [sku for sku in ('A', 'C') if f'SKU-{sku}' in text]
+        listings = [{'SKU': sku, 'NewTitle': f'title {sku}', 'NewDescription': f'description {sku}',
+                     'ItemSpecifics': {}} for sku in skus]
+        arguments = json.dumps({'Listings': listings})
+        return {'choices': [{'message': {'function_call': {'arguments': arguments}}}]}
+
+    monkeypatch.setattr(ai_script.AsyncImageService, 'encode_image_from_url', encode)
+    monkeypatch.setattr(ai_script.AsyncOpenAIService, 'post_chat_completion', post_chat_completion)
+    jobs = [('https://example.com/a.jpg', 'a', 'desc a'),
+            ('https://example.com/broken.jpg', 'b', 'desc b'),
+            ('https://example.com/c.jpg', 'c', 'desc c')]
+    results = asyncio.run(ai_script.generate_packed(['sk-a'], jobs, ['A', 'B', 'C'], []))
+    assert isinstance(results[1], OSError)
+    assert results[0][0] == 'title A'
+    assert results[2][0] == 'title C'
@@ -0,0 +1,25 @@
+from GenerationCache import GenerationCache
+from ImageCache import thumbnail_digest
+
+
+def test_key_depends_on_image_content():
+    payload = {'messages': [{'role': 'user', 'content': 'title'}]}
+    url = 'https://example.com/a.jpg'
+    old = GenerationCache.make_key(payload, url, thumbnail_digest('b2xk'))
+    new = GenerationCache.make_key(payload, url, thumbnail_digest('bmV3'))
+    assert old != new
+    assert old == GenerationCache.make_key(payload, url, thumbnail_digest('b2xk'))
+    assert GenerationCache.make_key(payload, url) == GenerationCache.make_key(payload, url, thumbnail_digest(None))
+
+
+def test_put_get_and_evict(tmp_path):
+    cache = GenerationCache(str(tmp_path / 'cache.sqlite3'), max_entries=2)
+    try:
+        for index in range(3):
+            cache.put(f'key-{index}', (f'title {index}', 'description', ['N/A']))
+        assert cache.get('key-2') == ('title 2', 'description', ['N/A'])
+        assert cache.get('missing') is None
+        assert cache.evict() == 1
+        assert cache.get('key-2') is not None
+    finally:
+        cache.close()
@@ -0,0 +1,27 @@
+import os
+
+from ImageCache import ThumbnailCache, thumbnail_digest
+
+
+def test_store_and_load(tmp_path):
+    cache = ThumbnailCache(str(tmp_path))
+    url = 'https://example.com/a.jpg'
+    cache.store(url, (150, 150), 'dGh1bWI=', etag='"v1"')
+    entry = cache.load(url, (150, 150))
+    assert entry['thumbnail'] == 'dGh1bWI='
+    assert cache.is_fresh(entry)
+    assert ThumbnailCache.conditional_headers(entry) == {'If-None-Match': '"v1"'}
+    assert cache.load(url, (300, 300)) is None
+
+
+def test_evict_oldest_first(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), max_bytes=0)
+    cache.store('https://example.com/a.jpg', (150, 150), 'a' * 100)
+    assert cache.evict() == 1
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names]
+
+
+def test_thumbnail_digest():
+    assert thumbnail_digest(None) == ''
+    assert thumbnail_digest('') == ''
+    assert thumbnail_digest('YQ==') != thumbnail_digest('Yg==')
@@ -0,0 +1,51 @@
+import asyncio
+
+
+def test_failed_images_are_not_remembered(ai_script, monkeypatch):
+    service = ai_script.ImageService
+    service.reset()
+    outcomes = [None, 'dGh1bWI=']
+    calls = []
+
+    def fetch(url, max_size):
+        calls.append(url)
+        return outcomes.pop(0)
+
+    monkeypatch.setattr(service, '_fetch_and_encode', fetch)
+    assert service.encode_image_from_url('https://example.com/a.jpg') is None
+    assert service.encode_image_from_url('https://example.com/a.jpg') == 'dGh1bWI='
+    assert service.encode_image_from_url('https://example.com/a.jpg') == 'dGh1bWI='
+    assert len(calls) == 2
+    service.reset()
+
+
+def test_memo_is_bounded(ai_script, monkeypatch):
+    service = ai_script.ImageService
+    service.reset()
+    monkeypatch.setattr(ai_script, 'IMAGE_MEMO_MAX_ENTRIES', 3)
+    monkeypatch.setattr(service, '_fetch_and_encode', lambda url, max_size: url)
+    for index in range(5):
+        service.encode_image_from_url(f'https://example.com/{index}.jpg')
+    assert [key[0] for key in service.results] == [f'https://example.com/{index}.jpg' for index in (2, 3, 4)]
+    service.reset()
+    assert not service.results
+
+
+def test_async_failed_images_are_retried(ai_script, monkeypatch):
+    monkeypatch.setattr(ai_script, 'USE_IMAGE_CACHE', False)
+    image_service = ai_script.AsyncImageService(session=None, cache=None)
+    outcomes = [None, 'dGh1bWI=']
+
+    async def fetch(url, max_size):
+        return outcomes.pop(0)
+
+    monkeypatch.setattr(image_service, '_fetch_and_encode', fetch)
+
+    async def scenario():
+        first = await image_service.encode_image_from_url('https://example.com/a.jpg')
+        await asyncio.sleep(0)
+        second = await image_service.encode_image_from_url('https://example.com/a.jpg')
+        third = await image_service.encode_image_from_url('https://example.com/a.jpg')
+        return first, second, third
+
+    assert asyncio.run(scenario()) == (None, 'dGh1bWI=', 'dGh1bWI=')
@@ -0,0 +1,34 @@
+from ListingDataTranscription import AI_MEMO_HEADERS, plan_incremental_update
+
+
+def make_grid(*skus):
+    return [AI_MEMO_HEADERS] + [[f'title {sku}', f'description {sku}', sku] for sku in skus]
+
+
+def test_empty_sheet_appends_after_header():
+    plan = plan_incremental_update([], make_grid('A', 'B'))
+    assert plan == {'removed': [], 'changed': [], 'added': [(2, 1), (3, 2)]}
+
+
+def test_header_only_sheet_appends_after_header():
+    plan = plan_incremental_update([AI_MEMO_HEADERS], make_grid('A', 'B'))
+    assert plan == {'removed': [], 'changed': [], 'added': [(2, 1), (3, 2)]}
+
+
+def test_unchanged_rows_are_left_alone():
+    grid = make_grid('A', 'B')
+    assert plan_incremental_update(grid, grid) == {'removed': [], 'changed': [], 'added': []}
+
+
+def test_deletions_shift_changed_and_added_rows():
+    existing = make_grid('A', 'B', 'C', 'D')
+    existing[3] = ['old title C', 'description C', 'C']
+    grid = make_grid('C', 'D', 'E')
+    plan = plan_incremental_update(existing, grid)
+    # A (2行目) と B (3行目) を削除すると C は2行目、D は3行目になり、E は4行目に追加する
+    assert plan == {'removed': [2, 3], 'changed': [(2, 1)], 'added': [(4, 3)]}
+
+
+def test_duplicate_or_empty_sku_falls_back_to_full_rewrite():
+    assert plan_incremental_update([], make_grid('A', 'A')) is None
+    assert plan_incremental_update([], make_grid('A', '')) is None
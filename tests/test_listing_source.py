@@ -0,0 +1,126 @@
+import csv
+
+import pytest
+
+import ListingDataTranscription
+from ListingSource import read_listing_file, write_grid_file
+
+
+def write_listing_csv(path, rows):
+    header = [f'col{i}' for i in range(31)] + ['Brand', 'Color', '']
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        csv.writer(f).writerows([header] + rows)
+
+
+def listing_row(title, description, sku, images):
+    row = [''] * 33
+    row[1], row[7], row[29], row[30] = sku, images, title, description
+    row[31] = 'brand'
+    return row
+
+
+def test_read_listing_file_keeps_listing_columns(tmp_path):
+    path = tmp_path / 'listing.csv'
+    write_listing_csv(path, [listing_row('t1', 'd1', 'S1', 'a.jpg|b.jpg'), listing_row('t2', 'd2', 'S2', ''),
+                             [''] * 33])
+    table, headers = read_listing_file(str(path))
+    assert headers == [['Brand', 'Color']]
+    assert len(table) == 2  # 末尾の空行は含まない
+    assert list(table.rows(0, 1, 2, 3)) == [('t1', 'd1', 'S1', 'a.jpg|b.jpg'), ('t2', 'd2', 'S2', '')]
+    assert table.sheet_row(0) == 2
+    assert table.sheet_col(2) == 1
+
+
+def test_write_grid_file_replaces_without_leaving_temp_files(tmp_path):
+    path = tmp_path / 'out' / 'memo.csv'
+    write_grid_file(str(path), [['New-Titel'], ['old']])
+    write_grid_file(str(path), [['New-Titel'], ['新しい']])
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        assert list(csv.reader(f)) == [['New-Titel'], ['新しい']]
+    assert [p.name for p in path.parent.iterdir()] == ['memo.csv']
+
+
+def test_run_transcribes_file_to_file(tmp_path):
+    source = tmp_path / 'listing.csv'
+    output = tmp_path / 'memo.csv'
+    write_listing_csv(source, [listing_row('t1', 'd1', 'S1', 'a.jpg')])
+    result = ListingDataTranscription.run(None, listing_source_file=str(source), output_file=str(output),
+                                          output_mode='file', placeholder_url='https://example.com/p.jpg')
+    assert result == {'rows': 1, 'mode': 'file', 'output': str(output)}
+    with open(output, 'r', encoding='utf-8-sig', newline='') as f:
+        grid = list(csv.reader(f))
+    assert grid[0][-2:] == ['Brand', 'Color']
+    assert grid[1][:5] == ['t1', 'd1', 'S1', 'a.jpg', 'https://example.com/p.jpg']
+
+
+@pytest.mark.parametrize('output_mode, output_file, expected', [
+    (None, None, 'sheet'), (None, 'memo.csv', 'both'), ('file', 'memo.csv', 'file'), ('sheet', 'memo.csv', 'sheet'),
+])
+def test_resolve_output_mode(output_mode, output_file, expected):
+    assert ListingDataTranscription.resolve_output_mode(output_mode, output_file) == expected
+
+
+def test_invalid_output_mode_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ListingDataTranscription.resolve_output_mode('files', 'memo.csv')
+    result = ListingDataTranscription.run(None, output_file=str(tmp_path / 'memo.csv'), output_mode='Sheet')
+    assert 'error' in result
+
+
+class FakeRequest:
+    def __init__(self, calls, name, error=None):
+        self.calls, self.name, self.error = calls, name, error
+
+    def execute(self):
+        self.calls.append(self.name)
+        if self.error is not None:
+            raise self.error
+        return {}
+
+
+class FakeSheetsApi:
+    """spreadsheets() / values() の呼び出しを記録し、values.update だけを失敗させます。"""
+
+    def __init__(self, update_error=None):
+        self.calls = []
+        self.update_error = update_error
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def batchClear(self, **kwargs):
+        return FakeRequest(self.calls, 'batchClear')
+
+    def update(self, **kwargs):
+        return FakeRequest(self.calls, 'update', self.update_error)
+
+    def batchUpdate(self, **kwargs):
+        return FakeRequest(self.calls, 'batchUpdate')
+
+
+class FakeTranscriptionService:
+    spreadsheet_id = 'sheet-id'
+
+    def __init__(self, api):
+        self.service = api
+
+    def get_sheet_id(self, sheet_name):
+        return 0
+
+
+@pytest.mark.parametrize('update_error', [None, OSError('HTTP 500')])
+def test_run_full_mode_reports_write_errors(tmp_path, update_error):
+    source = tmp_path / 'listing.csv'
+    write_listing_csv(source, [listing_row('t1', 'd1', 'S1', 'a.jpg')])
+    api = FakeSheetsApi(update_error)
+    result = ListingDataTranscription.run(FakeTranscriptionService(api), listing_source_file=str(source),
+                                          output_mode='sheet', placeholder_url='https://example.com/p.jpg')
+    if update_error is None:
+        assert result == {'rows': 1, 'mode': 'full'}
+        assert api.calls == ['batchClear', 'update', 'batchUpdate']
+    else:
+        assert result == {'error': 'HTTP 500'}
+        assert api.calls == ['batchClear', 'update']
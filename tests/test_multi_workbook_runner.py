@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from MultiWorkbookRunner import load_manifest
+
+
+def write_manifest(tmp_path, manifest):
+    path = tmp_path / 'workbooks.json'
+    path.write_text(json.dumps(manifest), encoding='utf-8')
+    return str(path)
+
+
+def test_load_manifest_reads_per_workbook_transcription_options(tmp_path):
+    path = write_manifest(tmp_path, {
+        'service_account_file': 'sa.json',
+        'workbooks': [
+            'id-1',
+            {'spreadsheet_id': 'id-2', 'name': 'B', 'stages': ['ai', 'transcription'],
+             'listing_source_file': 'b.csv', 'output_file': 'b.parquet', 'output_mode': 'file'},
+        ],
+    })
+    service_account_file, workbooks = load_manifest(path)
+    assert service_account_file == 'sa.json'
+    assert workbooks[0] == {'spreadsheet_id': 'id-1', 'name': 'id-1', 'stages': ['transcription', 'ai'],
+                            'transcription': {}}
+    assert workbooks[1]['stages'] == ['transcription', 'ai']
+    assert workbooks[1]['transcription'] == {'listing_source_file': 'b.csv', 'output_file': 'b.parquet',
+                                             'output_mode': 'file'}
+
+
+@pytest.mark.parametrize('workbooks', [
+    [{'spreadsheet_id': 'id-1', 'output_mode': 'files'}],
+    [{'spreadsheet_id': 'id-1', 'output_file': 'memo.csv'}, {'spreadsheet_id': 'id-2', 'output_file': './memo.csv'}],
+    [{'spreadsheet_id': 'id-1', 'stages': ['upload']}],
+])
+def test_load_manifest_rejects_invalid_workbooks(tmp_path, workbooks):
+    with pytest.raises(ValueError):
+        load_manifest(write_manifest(tmp_path, {'workbooks': workbooks}))
@@ -0,0 +1,90 @@
+import asyncio
+
+
+class FakeResponse:
+    def __init__(self, status, body=None, headers=None, raise_for_status=None):
+        self.status_code = self.status = status
+        self.body = body
+        self.headers = headers or {}
+        self.content = b'{}'
+        self._raise_for_status = raise_for_status
+
+    def raise_for_status(self):
+        if self._raise_for_status:
+            raise self._raise_for_status
+
+    def json(self, *args, **kwargs):
+        if isinstance(self.body, Exception):
+            raise self.body
+        return self.body
+
+
+def counting_pool(ai_script, keys):
+    class CountingPool(ai_script.OpenAIKeyPool):
+        releases = []
+
+        def release(self, key, status=None, headers=None):
+            self.releases.append((key, status))
+            super().release(key, status, headers)
+
+    CountingPool.releases = []
+    return CountingPool(keys)
+
+
+def test_acquire_prefers_key_with_most_headroom(ai_script):
+    pool = ai_script.OpenAIKeyPool(['sk-a', 'sk-b'])
+    pool.release(pool.acquire('sk-a'), 200, {'x-ratelimit-remaining-requests': '1',
+                                             'x-ratelimit-reset-requests': '60s'})
+    assert pool.acquire('sk-a') == 'sk-b'
+
+
+def test_throttled_key_cools_down(ai_script):
+    pool = ai_script.OpenAIKeyPool(['sk-a', 'sk-b'])
+    pool.release(pool.acquire('sk-a'), 429, {'retry-after': '30'})
+    assert [pool.acquire('sk-a') for _ in range(3)] == ['sk-b'] * 3
+
+
+def test_parse_duration(ai_script):
+    assert ai_script.OpenAIKeyPool.parse_duration('6m0s') == 360
+    assert ai_script.OpenAIKeyPool.parse_duration('20ms') == 0.02
+    assert ai_script.OpenAIKeyPool.parse_duration('1.5') == 1.5
+    assert ai_script.OpenAIKeyPool.parse_duration('soon') is None
+
+
+def test_invalid_json_releases_key_once(ai_script, monkeypatch):
+    pool = counting_pool(ai_script, ['sk-a'])
+    monkeypatch.setattr(ai_script.requests, 'post',
+                        lambda *args, **kwargs: FakeResponse(200, ValueError('not JSON')), raising=False)
+    service = ai_script.OpenAIService(['sk-a'], key_pool=pool)
+    assert service.post_chat_completion({}, 0) == 'Request Error'
+    assert pool.releases == [('sk-a', 200)]
+    assert pool.states['sk-a']['in_flight'] == 0
+
+
+def test_invalid_json_releases_key_once_async(ai_script):
+    pool = counting_pool(ai_script, ['sk-a'])
+
+    class Response:
+        status = 200
+        headers = {}
+
+        async def json(self):
+            raise ValueError('not JSON')
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            return False
+
+    class Session:
+        def post(self, *args, **kwargs):
+            return Response()
+
+    async def scenario():
+        service = ai_script.AsyncOpenAIService(['sk-a'], Session(), key_pool=pool)
+        return await service.post_chat_completion({}, 0)
+
+    assert asyncio.run(scenario()) == 'Request Error'
+    assert pool.releases == [('sk-a', 200)]
+    assert pool.states['sk-a']['in_flight'] == 0
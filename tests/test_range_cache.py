@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from RangeCache import RangeCache, etag_matches, make_etag
+
+
+def fill(cache, *range_names):
+    for range_name in range_names:
+        key, grid = cache.normalize(range_name)
+        cache.put(key, grid, [[range_name]], cache.generation)
+
+
+def test_normalize_ignores_sheet_case_and_quotes():
+    cache = RangeCache()
+    assert cache.normalize("'setting'!f1:F")[0] == cache.normalize('Setting!F1:F')[0]
+    assert cache.normalize('Setting')[0] == cache.normalize("'SETTING'")[0]
+
+
+@pytest.mark.parametrize('written, expected', [
+    (['Setting'], {'Sheet1!A1:B2', 'AI-memo!A2:D'}),
+    (['setting'], {'Sheet1!A1:B2', 'AI-memo!A2:D'}),
+    (['Sheet1'], {'Setting!F1:F', 'AI-memo!A2:D'}),
+    (['Sheet1!1:3'], {'Setting!F1:F', 'AI-memo!A2:D'}),
+    (['AI-memo!E2:E'], {'Setting!F1:F', 'Sheet1!A1:B2', 'AI-memo!A2:D'}),
+])
+def test_invalidate_ranges(written, expected):
+    cache = RangeCache()
+    fill(cache, 'Setting!F1:F', 'Sheet1!A1:B2', 'AI-memo!A2:D')
+    cache.invalidate_ranges(written)
+    assert {entry[1][0][0] for entry in cache.entries.values()} == expected
+
+
+def test_invalidate_whole_sheet_entry():
+    cache = RangeCache()
+    fill(cache, 'Setting', 'Sheet1')
+    assert cache.invalidate_ranges(['setting!B2']) == 1
+    assert cache.invalidate_ranges(['Sheet1!A1']) == 1
+    assert not cache.entries
+
+
+def test_get_or_fetch_shares_loads_and_skips_stale_writes():
+    cache = RangeCache()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return [['a']]
+
+    async def scenario():
+        first, second = await asyncio.gather(cache.get_or_fetch('Setting!B2', fetch),
+                                             cache.get_or_fetch('setting!B2', fetch))
+        assert first == second == ([['a']], make_etag([['a']]))
+        assert len(calls) == 1
+
+        # 読み込み中に書き込まれた値は保存しない
+        cache.entries.clear()
+        task = asyncio.ensure_future(cache.get_or_fetch('Setting!B2', fetch))
+        await asyncio.sleep(0)
+        cache.invalidate_ranges(['Setting'])
+        await task
+        assert not cache.entries
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('header, matches', [
+    ('"abc"', True),
+    ('"x", "abc"', True),
+    ('W/"abc"', True),
+    ('*', True),
+    ('"abcd"', False),
+    ('"ab"', False),
+    ('', False),
+    (None, False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, '"abc"') is matches
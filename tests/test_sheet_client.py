@@ -0,0 +1,63 @@
+import json
+import os
+import stat
+from datetime import datetime, timedelta
+
+import pytest
+
+import SheetClient
+
+
+class FakeCredentials:
+    service_account_email = 'bot@example.iam.gserviceaccount.com'
+
+    def __init__(self, token=None, expiry=None):
+        self.token = token
+        self.expiry = expiry
+
+
+@pytest.fixture
+def token_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(SheetClient, 'TOKEN_CACHE_DIR', str(tmp_path / 'tokens'))
+    return tmp_path / 'tokens'
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='POSIX permissions')
+def test_saved_token_is_private(token_dir):
+    credentials = FakeCredentials('secret', datetime.utcnow() + timedelta(hours=1))
+    path = SheetClient._token_cache_path(credentials, SheetClient.SCOPES)
+    SheetClient._save_token(credentials, path)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert json.loads(open(path, encoding='utf-8').read())['token'] == 'secret'
+    assert os.listdir(token_dir) == [os.path.basename(path)]
+
+
+def test_cached_token_round_trip(token_dir):
+    expiry = datetime.utcnow() + timedelta(hours=1)
+    path = SheetClient._token_cache_path(FakeCredentials(), SheetClient.SCOPES)
+    SheetClient._save_token(FakeCredentials('secret', expiry), path)
+    credentials = FakeCredentials()
+    assert SheetClient._load_cached_token(credentials, path)
+    assert (credentials.token, credentials.expiry) == ('secret', expiry)
+
+
+def test_expiring_cached_token_is_not_used(token_dir):
+    path = SheetClient._token_cache_path(FakeCredentials(), SheetClient.SCOPES)
+    SheetClient._save_token(FakeCredentials('old', datetime.utcnow() + timedelta(minutes=1)), path)
+    assert not SheetClient._load_cached_token(FakeCredentials(), path)
+
+
+def test_ensure_token_refreshes_only_when_needed(monkeypatch):
+    refreshed = []
+
+    def refresh(credentials, scopes):
+        refreshed.append(scopes)
+        credentials.token = 'new'
+        credentials.expiry = datetime.utcnow() + timedelta(hours=1)
+
+    monkeypatch.setattr(SheetClient, 'refresh_credentials', refresh)
+    credentials = FakeCredentials()
+    SheetClient.ensure_token(credentials)
+    SheetClient.ensure_token(credentials)
+    assert credentials.token == 'new'
+    assert len(refreshed) == 1
@@ -0,0 +1,87 @@
+import asyncio
+
+import SheetMetadata as sheet_metadata
+from SheetMetadata import SheetMetadata
+
+
+def spreadsheet(*titles):
+    return {'sheets': [{'properties': {'sheetId': index, 'title': title}} for index, title in enumerate(titles)]}
+
+
+class Fetcher:
+    def __init__(self, *versions):
+        self.versions = list(versions)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.versions[min(self.calls, len(self.versions)) - 1]
+
+
+def test_get_loads_once():
+    metadata = SheetMetadata()
+    fetch = Fetcher(spreadsheet('AI-memo', 'Setting'))
+    assert metadata.get('Setting', fetch)['sheetId'] == 1
+    assert metadata.get('AI-memo', fetch)['sheetId'] == 0
+    assert fetch.calls == 1
+
+
+def test_ttl_reloads_changed_sheets(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sheet_metadata.time, 'monotonic', lambda: now[0])
+    metadata = SheetMetadata(ttl=60)
+    fetch = Fetcher(spreadsheet('AI-memo'), spreadsheet('Renamed', 'AI-memo'))
+    assert metadata.get('AI-memo', fetch)['sheetId'] == 0
+    now[0] += 59
+    assert metadata.get('AI-memo', fetch)['sheetId'] == 0
+    now[0] += 1
+    assert metadata.get('AI-memo', fetch)['sheetId'] == 1
+    assert fetch.calls == 2
+
+
+def test_missing_sheet_is_refetched_after_interval(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sheet_metadata.time, 'monotonic', lambda: now[0])
+    metadata = SheetMetadata()
+    fetch = Fetcher(spreadsheet('AI-memo'), spreadsheet('AI-memo', 'New'))
+    assert metadata.get('New', fetch) is None
+    assert metadata.get('New', fetch) is None
+    now[0] += sheet_metadata.MISS_REFRESH_INTERVAL
+    assert metadata.get('New', fetch)['sheetId'] == 1
+
+
+def test_invalidate_on_error():
+    metadata = SheetMetadata()
+    fetch = Fetcher(spreadsheet('AI-memo'))
+    metadata.get('AI-memo', fetch)
+    metadata.invalidate_on_error(500, 'Internal error')
+    metadata.get('AI-memo', fetch)
+    assert fetch.calls == 1
+    metadata.invalidate_on_error(400, 'Unable to parse range: Old!A1')
+    metadata.get('AI-memo', fetch)
+    assert fetch.calls == 2
+
+
+def test_invalidate_if_structural():
+    metadata = SheetMetadata()
+    metadata.get('AI-memo', Fetcher(spreadsheet('AI-memo')))
+    metadata.invalidate_if_structural([{'repeatCell': {}}])
+    assert metadata.loaded_at is not None
+    metadata.invalidate_if_structural([{'deleteDimension': {}}])
+    assert metadata.loaded_at is None
+
+
+def test_get_async_fetches_once_for_concurrent_callers():
+    metadata = SheetMetadata()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return spreadsheet('AI-memo')
+
+    async def scenario():
+        return await asyncio.gather(*(metadata.get_async('AI-memo', fetch) for _ in range(5)))
+
+    assert [properties['sheetId'] for properties in asyncio.run(scenario())] == [0] * 5
+    assert len(calls) == 1
@@ -0,0 +1,78 @@
+import pytest
+
+from SheetRange import (GridRange, coalesce_blocks, coalesce_cells, column_index, column_letter, format_a1,
+                        parse_a1, ranges_overlap)
+
+
+@pytest.mark.parametrize('index, letters', [(0, 'A'), (25, 'Z'), (26, 'AA'), (27, 'AB'), (701, 'ZZ'), (702, 'AAA')])
+def test_column_letter_round_trip(index, letters):
+    assert column_letter(index) == letters
+    assert column_index(letters) == index
+
+
+@pytest.mark.parametrize('range_name, expected', [
+    ('AI-memo!A2:D', GridRange('AI-memo', 1, None, 0, 4)),
+    ('出品用CSV!AF1:1', GridRange('出品用CSV', 0, 1, 31, None)),
+    ('Setting!B2', GridRange('Setting', 1, 2, 1, 2)),
+    ("'My Sheet'!A:A", GridRange('My Sheet', None, None, 0, 1)),
+    ('Sheet1!1:3', GridRange('Sheet1', 0, 3, None, None)),
+    ('A1:B2', GridRange(None, 0, 2, 0, 2)),
+    ('1:3', GridRange(None, 0, 3, None, None)),
+])
+def test_parse_a1(range_name, expected):
+    assert parse_a1(range_name) == expected
+
+
+@pytest.mark.parametrize('range_name', ['Setting', 'Sheet1', 'AI-memo', 'ABCD1', 'Data2024'])
+def test_parse_a1_bare_sheet_names(range_name):
+    # A1 表記に見えてもシート名として読む (Sheets API と同じ)
+    assert parse_a1(range_name) == GridRange(range_name, None, None, None, None)
+
+
+def test_parse_a1_quoted_sheet_name_without_range():
+    assert parse_a1("'It''s'") == GridRange("It's", None, None, None, None)
+
+
+def test_parse_a1_invalid():
+    with pytest.raises(ValueError):
+        parse_a1('Sheet1!A1:B2:C3')
+
+
+@pytest.mark.parametrize('grid, expected', [
+    (GridRange('AI-memo', 1, 10, 27, 30), 'AI-memo!AB2:AD10'),
+    (GridRange('AI-memo', 1, None, 0, 1), 'AI-memo!A2:A'),
+    (GridRange('Sheet1', 0, 3, None, None), 'Sheet1!1:3'),
+    (GridRange(None, 4, 5, None, None), '5:5'),
+    (GridRange('My Sheet', None, None, None, None), "'My Sheet'"),
+    (GridRange("It's", 0, 1, 0, 1), "'It''s'!A1:A1"),
+])
+def test_format_a1(grid, expected):
+    assert format_a1(grid) == expected
+
+
+@pytest.mark.parametrize('range_name', ['AI-memo!A2:D', 'Sheet1!1:3', 'Setting', "'My Sheet'!B2:C5", 'A:A'])
+def test_format_parse_round_trip(range_name):
+    assert parse_a1(format_a1(parse_a1(range_name))) == parse_a1(range_name)
+
+
+def test_ranges_overlap():
+    assert ranges_overlap(parse_a1('Setting'), parse_a1('setting!F1:F'))
+    assert ranges_overlap(parse_a1('A1:B2'), parse_a1('Other!B2'))  # シート名なしは全てのシートと重なる
+    assert not ranges_overlap(parse_a1('Sheet1!A1:B2'), parse_a1('Sheet1!C1:D2'))
+    assert not ranges_overlap(parse_a1('Sheet1!1:3'), parse_a1('Sheet1!A4:Z'))
+    assert not ranges_overlap(parse_a1('Sheet1'), parse_a1('Sheet2!A1'))
+
+
+def test_coalesce_blocks_merges_rows_with_same_columns():
+    cells = {(1, 3): 'x', (1, 4): 'y', (2, 3): 'z', (2, 4): 'w', (2, 7): 'v', (4, 3): 'u'}
+    assert coalesce_blocks(cells) == [
+        (1, 3, [['x', 'y'], ['z', 'w']]),
+        (2, 7, [['v']]),
+        (4, 3, [['u']]),
+    ]
+
+
+def test_coalesce_cells():
+    assert coalesce_cells('AI-memo', {(1, 0): 'a', (1, 1): 'b', (2, 0): 'c', (2, 1): 'd'}) == [
+        {'range': 'AI-memo!A2:B3', 'values': [['a', 'b'], ['c', 'd']]},
+    ]
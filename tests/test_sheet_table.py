@@ -0,0 +1,62 @@
+import pytest
+
+from SheetTable import SheetTable
+
+
+def test_from_rows_pads_ragged_rows():
+    table = SheetTable.from_rows('AI-memo', [['a', 'desc', 'A'], ['b'], [], ['', '', 'D', 'x.jpg']], start_row=1)
+    assert len(table) == 4
+    assert table.column(2) == ['A', '', '', 'D']
+    assert table.value(1, 1) == ''
+    assert table.is_empty(2, 0)
+    assert not table.is_empty(3, 3)
+    assert table.sheet_row(0) == 2
+
+
+def test_from_rows_with_header():
+    table = SheetTable.from_rows('Data', [['SKU', 'Title', 'Brand'], ['A1', 't']], header=True)
+    assert table.start_row == 1
+    assert table.column('Brand') == ['']
+    assert table.value(0, 'Title') == 't'
+    with pytest.raises(KeyError):
+        table.col('Color')
+
+
+def test_last_row_ignores_trailing_blank_rows():
+    table = SheetTable.from_rows('AI-memo', [['a', ''], ['', ''], ['', 'd'], ['', ''], ['', '']])
+    assert table.last_row(0, 1) == 3
+    assert table.last_row(0) == 1
+    assert SheetTable.from_rows('AI-memo', []).last_row(0) == 0
+
+
+def test_find_is_refreshed_after_set():
+    table = SheetTable.from_rows('AI-memo', [['A'], [''], ['C'], ['A']], start_row=1)
+    assert table.find(0, 'A') == 0
+    assert table.find(0, 'C') == 2
+    assert table.find(0, '') is None
+    table.set(1, 0, 'B')
+    assert table.find(0, 'B') == 1
+    assert not table.is_empty(1, 0)
+
+
+def test_set_and_write_ranges_use_sheet_coordinates():
+    table = SheetTable.from_rows('AI-memo', [['a', 'b']], start_row=1)
+    table.set(0, 27, 'title a')
+    table.set(0, 28, 'desc a')
+    table.set(1, 27, 'title b')
+    table.set(1, 28, 'desc b')
+    assert table.updates[(1, 27)] == 'title a'
+    assert table.write_ranges() == [{'range': 'AI-memo!AB2:AC3',
+                                     'values': [['title a', 'desc a'], ['title b', 'desc b']]}]
+
+
+def test_from_column_ranges_keeps_sheet_columns():
+    snapshot = {'出品用CSV!AD2:AD': [['t1'], ['t2']], '出品用CSV!B2:B': [['S1']]}
+    table = SheetTable.from_column_ranges(snapshot, ['出品用CSV!AD2:AD', '出品用CSV!B2:B'])
+    assert table.sheet == '出品用CSV'
+    assert table.column(1) == ['S1', '']
+    assert table.sheet_col(1) == 1
+    table.set(1, 1, 'S2')
+    assert table.write_ranges() == [{'range': '出品用CSV!B3:B3', 'values': [['S2']]}]
+    with pytest.raises(ValueError):
+        SheetTable.from_column_ranges(snapshot, ['出品用CSV!AD2:AD', '出品用CSV!B1:B'])
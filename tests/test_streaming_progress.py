@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+from ListingDataTranscription import AI_MEMO_HEADERS
+
+
+class FakeSheetService:
+    spreadsheet_id = 'sheet-id'
+
+    def __init__(self, rows, row_count=None, fail_from=None):
+        self.rows = rows
+        self.row_count = row_count or len(rows) + 1  # ヘッダー行を含む
+        self.fail_from = fail_from
+        self.requested = []
+
+    def get_row_count(self, sheet_name):
+        return self.row_count
+
+    def fetch_values(self, range_name):
+        # 'AI-memo!A{start}:D{end}'
+        start, end = range_name.split('!A')[1].split(':D')
+        self.requested.append((int(start), int(end)))
+        if self.fail_from is not None and int(start) >= self.fail_from:
+            raise OSError('connection reset')
+        values = [list(row) for row in self.rows[int(start) - 2:int(end) - 1]]
+        # Sheets API と同じく末尾の空のセル・空の行を返さない
+        for row in values:
+            while row and row[-1] == '':
+                row.pop()
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+
+def run_streaming(ai_script, monkeypatch, tmp_path, rows, outcomes, write_ok=True, sheet_service=None):
+    monkeypatch.setattr(ai_script, 'PROGRESS_DIR', str(tmp_path))
+    monkeypatch.setattr(ai_script, 'USE_IMAGE_CACHE', False)
+    written = []
+
+    def batch_update_values(sheet_service, data, batch_size=ai_script.BATCH_SIZE):
+        written.extend(data)
+        return write_ok
+
+    async def send_to_openai(self, image_url, title, description, item_specifics_headers, index):
+        outcome = outcomes[title]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(ai_script.BatchUpdater, 'batch_update_values', staticmethod(batch_update_values))
+    monkeypatch.setattr(ai_script.AsyncOpenAIService, 'send_to_openai', send_to_openai)
+    monkeypatch.setattr(ai_script.ProgressWatermark.__init__, '__defaults__', (str(tmp_path),))
+    asyncio.run(ai_script.generate_streaming(sheet_service or FakeSheetService(rows), ['sk-a'], AI_MEMO_HEADERS))
+    return written
+
+
+def progress_file(tmp_path):
+    path = tmp_path / 'sheet-id.json'
+    return json.loads(path.read_text()) if path.exists() else None
+
+
+def test_all_rows_written_clears_progress(ai_script, monkeypatch, tmp_path):
+    rows = [['a', 'desc', 'A'], ['', '', 'B'], ['c', 'desc', 'C']]
+    outcomes = {'a': ('title a', 'desc a', {}), 'c': ('title c', 'desc c', {})}
+    written = run_streaming(ai_script, monkeypatch, tmp_path, rows, outcomes)
+    assert {item['range'] for item in written} == {'AI-memo!AB2:AC2', 'AI-memo!AB4:AC4'}
+    assert progress_file(tmp_path) is None
+
+
+def test_failed_rows_are_not_marked_done(ai_script, monkeypatch, tmp_path):
+    rows = [['a', 'desc', 'A'], ['b', 'desc', 'B'], ['c', 'desc', 'C'], ['d', 'desc', 'D']]
+    outcomes = {'a': ('title a', 'desc a', {}), 'b': 'Request Error',
+                'c': RuntimeError('boom'), 'd': ('title d', 'desc d', {})}
+    run_streaming(ai_script, monkeypatch, tmp_path, rows, outcomes)
+    # 3行目 (b) が失敗したため、次の実行は3行目から再開する
+    assert progress_file(tmp_path)['watermark'] == 2
+
+
+def test_failed_write_is_not_marked_done(ai_script, monkeypatch, tmp_path):
+    rows = [['a', 'desc', 'A']]
+    ai_script.ProgressWatermark('sheet-id', [], str(tmp_path)).mark_done([])
+    run_streaming(ai_script, monkeypatch, tmp_path, rows, {'a': ('title a', 'desc a', {})}, write_ok=False)
+    assert progress_file(tmp_path)['watermark'] == 1
+
+
+def test_progress_watermark_advances_over_contiguous_rows(ai_script, tmp_path):
+    progress = ai_script.ProgressWatermark('sheet-id', ['Brand'], str(tmp_path))
+    progress.mark_done([2, 4])
+    assert progress.watermark == 2
+    progress.mark_done([3])
+    assert progress.watermark == 4
+    resumed = ai_script.ProgressWatermark('sheet-id', ['Brand'], str(tmp_path))
+    assert resumed.load() == 4
+    assert ai_script.ProgressWatermark('sheet-id', ['Color'], str(tmp_path)).load() == 1
+
+
+def test_blank_rows_at_a_page_boundary_do_not_stop_the_run(ai_script, monkeypatch, tmp_path):
+    monkeypatch.setattr(ai_script, 'STREAM_PAGE_SIZE', 2)
+    # 2〜3行目のページは3行目が空行のため1行しか返らず、4行目のページは全て空行
+    rows = [['a', 'desc', 'A'], ['', '', ''], ['', '', ''], ['', '', ''], ['e', 'desc', 'E'], ['f', 'desc', 'F']]
+    outcomes = {title: (f'title {title}', f'desc {title}', {}) for title in 'aef'}
+    sheet_service = FakeSheetService(rows, row_count=10)
+    written = run_streaming(ai_script, monkeypatch, tmp_path, rows, outcomes, sheet_service=sheet_service)
+    assert {item['range'] for item in written} == {'AI-memo!AB2:AC2', 'AI-memo!AB6:AC7'}
+    assert sheet_service.requested == [(2, 3), (4, 5), (6, 7), (8, 9), (10, 10)]
+    assert progress_file(tmp_path) is None
+
+
+def test_unreadable_page_keeps_progress(ai_script, monkeypatch, tmp_path):
+    monkeypatch.setattr(ai_script, 'STREAM_PAGE_SIZE', 2)
+    rows = [['a', 'desc', 'A'], ['b', 'desc', 'B'], ['c', 'desc', 'C']]
+    outcomes = {title: (f'title {title}', f'desc {title}', {}) for title in 'abc'}
+    sheet_service = FakeSheetService(rows, fail_from=4)
+    written = run_streaming(ai_script, monkeypatch, tmp_path, rows, outcomes, sheet_service=sheet_service)
+    assert {item['range'] for item in written} == {'AI-memo!AB2:AC3'}
+    assert progress_file(tmp_path)['watermark'] == 3
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from SheetRange import parse_a1
+from WriteCoalescer import WriteCoalescer, merge_writes, parse_write, write_result
+
+
+class FakeApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def batch_response(data):
+    responses = []
+    for item in data:
+        values = item['values']
+        responses.append({'updatedRange': item['range'],
+                          'updatedCells': sum(value is not None for row in values for value in row)})
+    return {'spreadsheetId': 'sheet-id', 'responses': responses}
+
+
+def test_merge_writes_later_write_wins_and_none_is_skipped():
+    data = merge_writes([
+        (parse_a1('AI-memo!AB2:AC2'), [['a', 'b']]),
+        (parse_a1('AI-memo!AB3:AC3'), [['c', 'd']]),
+        (parse_a1('AI-memo!AC2'), [['B']]),
+        (parse_a1('AI-memo!AB4:AC4'), [[None, 'e']]),
+    ])
+    assert data == [
+        {'range': 'AI-memo!AB2:AC3', 'values': [['a', 'B'], ['c', 'd']]},
+        {'range': 'AI-memo!AC4:AC4', 'values': [['e']]},
+    ]
+
+
+def test_merge_writes_keeps_sheets_apart():
+    data = merge_writes([(parse_a1('A!A1'), [['x']]), (parse_a1('B!A1'), [['y']])])
+    assert [item['range'] for item in data] == ['A!A1:A1', 'B!A1:A1']
+
+
+@pytest.mark.parametrize('range_name, values', [
+    ('Sheet1!A1', [['a', 'b']]),
+    ('Sheet1!A1:B1', [['a'], ['b']]),
+    ('Sheet1!A1:A', [['a', 'b']]),
+])
+def test_parse_write_rejects_values_outside_range(range_name, values):
+    with pytest.raises(ValueError):
+        parse_write(range_name, values)
+
+
+@pytest.mark.parametrize('range_name, values', [
+    ('Sheet1!A1:B2', [['a', 'b'], ['c']]),
+    ('Sheet1!A2:B', [['a', 'b']] * 100),
+    ('Sheet1', [['a'] * 30] * 30),
+])
+def test_parse_write_accepts_values_inside_range(range_name, values):
+    assert parse_write(range_name, values) == parse_a1(range_name)
+
+
+def test_write_result_counts_only_updated_cells():
+    grid = parse_a1('AI-memo!AB2:AC3')
+    response = {'spreadsheetId': 'sheet-id', 'responses': [{'updatedRange': 'AI-memo!AB2:AC2'}]}
+    assert write_result('sheet-id', grid, [['a', 'b'], ['c', 'd']], response) == {
+        'spreadsheetId': 'sheet-id', 'updatedRange': 'AI-memo!AB2:AC2',
+        'updatedRows': 1, 'updatedColumns': 2, 'updatedCells': 2,
+    }
+
+
+def run_writes(write, writes):
+    async def scenario():
+        coalescer = WriteCoalescer('sheet-id', write)
+        results = await asyncio.gather(*(coalescer.submit(range_name, values) for range_name, values in writes),
+                                       return_exceptions=True)
+        await coalescer.close()
+        return results
+
+    return asyncio.run(scenario())
+
+
+def test_concurrent_writes_share_one_request():
+    calls = []
+
+    async def write(data):
+        calls.append(data)
+        return batch_response(data)
+
+    results = run_writes(write, [('AI-memo!AB2:AC2', [['a', 'b']]), ('AI-memo!AB3:AC3', [['c', 'd']])])
+    assert len(calls) == 1
+    assert [result['updatedRange'] for result in results] == ['AI-memo!AB2:AC2', 'AI-memo!AB3:AC3']
+    assert [result['updatedCells'] for result in results] == [2, 2]
+
+
+def test_client_error_fails_only_the_bad_write():
+    calls = []
+
+    async def write(data):
+        calls.append(data)
+        if any(item['range'].startswith('Missing!') for item in data):
+            raise FakeApiError(400, 'Unable to parse range: Missing!A1')
+        return batch_response(data)
+
+    results = run_writes(write, [('AI-memo!AB2', [['a']]), ('Missing!A1', [['b']]), ('AI-memo!AB3', [['c']])])
+    assert len(calls) == 4  # まとめた書き込み1回 + 1件ずつ3回
+    assert results[0]['updatedRange'] == 'AI-memo!AB2:AB2'
+    assert isinstance(results[1], FakeApiError)
+    assert results[2]['updatedRange'] == 'AI-memo!AB3:AB3'
+
+
+def test_server_error_fails_every_write():
+    async def write(data):
+        raise FakeApiError(503, 'Service unavailable')
+
+    results = run_writes(write, [('AI-memo!AB2', [['a']]), ('AI-memo!AB3', [['c']])])
+    assert all(isinstance(result, FakeApiError) for result in results)